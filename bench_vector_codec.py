@@ -0,0 +1,75 @@
+""" Micro-benchmark of per-request CPU for the /get-videos/ query path: text vector literal vs binary codec. """
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from dotenv import load_dotenv
+
+from pgvector_codec import encode_vector, register_vector_codec
+
+load_dotenv()
+
+POSTGRES_CONNECTION_STRING = os.getenv("POSTGRES_CONNECTION_STRING")
+
+TEXT_QUERY = "SELECT * FROM public.get_similar_videos($1, $2, $3)"
+BINARY_QUERY = "SELECT title, videoid, seconds, text, distance FROM public.get_similar_videos($1::public.vector, $2, $3)"
+
+
+def random_vector(dimensions: int) -> list:
+    return [random.uniform(-1, 1) for _ in range(dimensions)]
+
+
+def bench_encoding(vector: list, iterations: int) -> None:
+    """Client-side cost of turning an embedding into a query parameter"""
+    start = time.process_time()
+    for _ in range(iterations):
+        f"[{', '.join(map(str, vector))}]"
+    text_us = (time.process_time() - start) / iterations * 1e6
+
+    start = time.process_time()
+    for _ in range(iterations):
+        encode_vector(vector)
+    binary_us = (time.process_time() - start) / iterations * 1e6
+
+    print(f"encode text literal: {text_us:8.1f} us/request")
+    print(f"encode binary:       {binary_us:8.1f} us/request ({text_us / binary_us:.1f}x faster)")
+
+
+async def bench_queries(vector: list, iterations: int) -> None:
+    """End-to-end client CPU and wall time per query against a live database"""
+    import asyncpg
+
+    text_connection = await asyncpg.connect(POSTGRES_CONNECTION_STRING)
+    binary_connection = await asyncpg.connect(POSTGRES_CONNECTION_STRING)
+    await register_vector_codec(binary_connection)
+
+    async def run(label: str, connection: asyncpg.Connection, query: str, value: object) -> None:
+        await connection.fetch(query, value, 0.4, 4)  # warm the statement cache
+        cpu, wall = time.process_time(), time.perf_counter()
+        for _ in range(iterations):
+            await connection.fetch(query, value() if callable(value) else value, 0.4, 4)
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+        print(f"{label}: {cpu / iterations * 1e6:8.1f} us CPU, {wall / iterations * 1e3:6.2f} ms wall per request")
+
+    try:
+        await run("query text   ", text_connection, TEXT_QUERY, lambda: f"[{', '.join(map(str, vector))}]")
+        await run("query binary ", binary_connection, BINARY_QUERY, vector)
+    finally:
+        await text_connection.close()
+        await binary_connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dimensions", type=int, default=768)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--database", action="store_true", help="Also time queries against POSTGRES_CONNECTION_STRING")
+    args = parser.parse_args()
+
+    vector = random_vector(args.dimensions)
+    bench_encoding(vector, args.iterations)
+    if args.database:
+        asyncio.run(bench_queries(vector, args.iterations // 10))
@@ -1,10 +1,18 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 import glob
+import itertools
 import os
 import json
+from pathlib import Path
 import tiktoken
 import logging
 
+from manifest import Manifest, fingerprint, source_hash
+from master_file import MasterWriter, VideoCursor, master_path, read_segments
+from transcript_store import TranscriptStore, store_path
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -21,13 +29,20 @@ class BUCKET_TRANSCRIPTS:
     PERCENTAGE_OVERLAP = 0.05
     MAX_TOKENS = 2048
 
-    def __init__(self, folder=None, minutes=5, verbose=False):
+    def __init__(self, folder=None, minutes=5, verbose=False, workers=1, incremental=False, use_store=False):
         self.segments = []
         self.total_files = 0
+        self.total_segments = 0
         self.transcript_folder = folder or "transcripts"
         self.segment_length_minutes = minutes or self.SEGMENT_LENGTH_MINUTES
         self.verbose = verbose
+        self.workers = workers or os.cpu_count()
+        self.incremental = incremental
+        self.reused_files = 0
+        self.use_store = use_store
+        self.store = None
         self.tokenizer = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        self.space_token = self.tokenizer.encode(" ")[0]
 
         if self.verbose:
             logger.setLevel(logging.DEBUG)
@@ -58,14 +73,12 @@ class BUCKET_TRANSCRIPTS:
         text = text.replace("[inaudible]", "")  # [inaudible]
         return text
 
-    def append_text_to_previous_segment(self, text):
-        """Append PERCENTAGE_OVERLAP text to the previous segment to smooth context transition"""
-        if len(self.segments) > 0:
-            words = text.split(" ")
-            word_count = len(words)
-            if word_count > 0:
-                append_text = " ".join(words[0 : int(word_count * self.PERCENTAGE_OVERLAP)])
-                self.segments[-1]["text"] += append_text
+    def append_text_to_previous_segment(self, tokens):
+        """Append PERCENTAGE_OVERLAP of the new segment's tokens to the previous segment to smooth context transition"""
+        if len(self.segments) > 0 and len(tokens) > 0:
+            overlap = tokens[0 : int(len(tokens) * self.PERCENTAGE_OVERLAP)]
+            # the slice can end part way through a multibyte character; drop the incomplete character
+            self.segments[-1]["text"] += self.tokenizer.decode(overlap, errors="ignore")
 
     def add_new_segment(self, metadata, text, segment_begin_seconds):
         """Add a new segment to the segments list"""
@@ -78,12 +91,21 @@ class BUCKET_TRANSCRIPTS:
         self.segments.append(metadata.copy())
 
     def parse_json_vtt_transcript(self, vtt, metadata):
-        """Parse the JSON VTT file and return the transcript"""
+        """Parse the JSON VTT file and return the transcript."""
+        with open(vtt, "r", encoding="utf-8") as json_file:
+            self.parse_transcript(json.load(json_file), metadata)
+
+    def parse_transcript(self, json_vtt, metadata):
+        """Split a transcript's captions into segments.
+
+        Each caption is tokenized once, plus once more with its trailing space when it starts a segment, since the
+        two can merge; segment sizes are carried as running token counts and the overlap between segments is taken
+        from the token lists rather than re-splitting and re-encoding text.
+        """
         text = ""
         current_seconds = None
         seg_begin_seconds = None
         seg_finish_seconds = None
-        current_token_length = 0
         first_segment = True
 
         # Add speaker name, title, and description to the transcript
@@ -92,48 +114,51 @@ class BUCKET_TRANSCRIPTS:
                 metadata[key] = self.clean_text(metadata.get(key))
                 text += f"{metadata.get(key)}. "
 
-        current_token_length = len(self.tokenizer.encode(text))
-
-        # Open the VTT file
-        with open(vtt, "r", encoding="utf-8") as json_file:
-            json_vtt = json.load(json_file)
-
-            for segment in json_vtt:
-                seg = VttSegment(segment)
-                current_seconds = int(seg.start)
-                current_text = seg.text
-
-                if seg_begin_seconds is None:
-                    seg_begin_seconds = current_seconds
-                    seg_finish_seconds = seg_begin_seconds + self.segment_length_minutes * 60
-
-                total_tokens = len(self.tokenizer.encode(current_text)) + current_token_length
-
-                if current_seconds < seg_finish_seconds and total_tokens < self.MAX_TOKENS:
-                    text += current_text + " "
-                    current_token_length = total_tokens
-                else:
-                    if not first_segment:
-                        self.append_text_to_previous_segment(text)
-                    first_segment = False
-                    self.add_new_segment(metadata, text, seg_begin_seconds)
-
-                    text = current_text + " "
-                    seg_begin_seconds = None
-                    seg_finish_seconds = None
-                    current_token_length = len(self.tokenizer.encode(text))
-
-            if seg_begin_seconds and text != "":
-                previous_segment_tokens = len(self.tokenizer.encode(self.segments[-1]["text"]))
-                current_segment_tokens = len(self.tokenizer.encode(text))
-
-                if previous_segment_tokens + current_segment_tokens < self.MAX_TOKENS:
-                    self.segments[-1]["text"] += text
-                else:
-                    if not first_segment:
-                        self.append_text_to_previous_segment(text)
-                    first_segment = False
-                    self.add_new_segment(metadata, text, seg_begin_seconds)
+        tokens = self.tokenizer.encode(text)
+        current_token_length = len(tokens)
+
+        for segment in json_vtt:
+            seg = VttSegment(segment)
+            current_seconds = int(seg.start)
+            current_text = seg.text
+
+            if seg_begin_seconds is None:
+                seg_begin_seconds = current_seconds
+                seg_finish_seconds = seg_begin_seconds + self.segment_length_minutes * 60
+
+            caption_tokens = self.tokenizer.encode(current_text)
+            total_tokens = len(caption_tokens) + current_token_length
+
+            if current_seconds < seg_finish_seconds and total_tokens < self.MAX_TOKENS:
+                text += current_text + " "
+                tokens += caption_tokens
+                tokens.append(self.space_token)
+                current_token_length = total_tokens
+            else:
+                if not first_segment:
+                    self.append_text_to_previous_segment(tokens)
+                first_segment = False
+                self.add_new_segment(metadata, text, seg_begin_seconds)
+
+                text = current_text + " "
+                tokens = self.tokenizer.encode(text)
+                seg_begin_seconds = None
+                seg_finish_seconds = None
+                current_token_length = len(tokens)
+
+        if seg_begin_seconds and text != "":
+            if first_segment:
+                # the whole video fits in one segment
+                self.add_new_segment(metadata, text, seg_begin_seconds)
+                return
+
+            # Once per video, whether the tail fits in the previous segment is decided on exact token counts
+            previous_segment_tokens = len(self.tokenizer.encode(self.segments[-1]["text"]))
+            if previous_segment_tokens + len(self.tokenizer.encode(text)) < self.MAX_TOKENS:
+                self.segments[-1]["text"] += text
+            else:
+                self.append_text_to_previous_segment(tokens)
+                self.add_new_segment(metadata, text, seg_begin_seconds)
 
     def get_transcript(self, metadata):
         """Get the transcript from the .vtt file"""
@@ -141,32 +166,147 @@ class BUCKET_TRANSCRIPTS:
 
         if not os.path.exists(vtt):
             logger.info("vtt file does not exist: %s", vtt)
-            return
+            return False
         logger.debug("Processing file: %s", vtt)
         self.total_files += 1
 
         self.parse_json_vtt_transcript(vtt, metadata)
+        return True
 
-    def save_segments(self):
-        """Save segments to a JSON file"""
-        output_file = os.path.join(self.transcript_folder, "output", "master_transcriptions.json")
-        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    def bucket_file(self, file):
+        """Bucket one video's metadata file, or video id when reading the transcript store, returning its
+        segments, or None if it has no transcript"""
+        self.segments = []
+        if self.store:
+            meta, transcript = self.store.get(file)
+            found = transcript is not None
+            if found:
+                self.total_files += 1
+                self.parse_transcript(transcript, meta)
+        else:
+            with open(file, encoding="utf-8") as f:
+                meta = json.load(f)
+            found = self.get_transcript(meta)
+
+        segments, self.segments = self.segments, []
+        return segments if found else None
+
+    def bucket_files(self, files):
+        """Yield each file's segments in order, sharding the files across a process pool when workers > 1"""
+        if self.workers <= 1:
+            for file in files:
+                yield self.bucket_file(file)
+            return
 
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump(self.segments, f, ensure_ascii=False, indent=4)
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=init_bucket_worker,
+            initargs=(self.transcript_folder, self.segment_length_minutes, self.verbose, self.use_store),
+        ) as executor:
+            # A window of 2 x workers files in flight keeps every worker busy while bounding the results held in
+            # memory; taking results from the front of the window keeps the merge in submission order
+            files = iter(files)
+            window = deque(
+                executor.submit(bucket_worker_file, file) for file in itertools.islice(files, self.workers * 2)
+            )
+            try:
+                while window:
+                    segments = window.popleft().result()
+                    window.extend(executor.submit(bucket_worker_file, file) for file in itertools.islice(files, 1))
+                    yield segments
+            finally:
+                # closing the generator early must not leave the pool working through files nobody will read
+                for future in window:
+                    future.cancel()
+
+    def bucket_fingerprint(self, video_id):
+        """Fingerprint of everything that determines a video's segments"""
+        source = self.store.source_hash(video_id) if self.store else source_hash(self.transcript_folder, video_id)
+        return fingerprint(
+            source,
+            self.segment_length_minutes,
+            self.MAX_TOKENS,
+            self.PERCENTAGE_OVERLAP,
+        )
+
+    def list_videos(self):
+        """(source, videoId) pairs to bucket in videoId order; the source is passed to bucket_file"""
+        if self.use_store:
+            # Videos are read from the consolidated store by id instead of from per-video files
+            if self.store is None:
+                self.store = TranscriptStore(store_path(self.transcript_folder))
+            return [(video_id, video_id) for video_id in self.store.video_ids()]
+
+        folder = os.path.join(self.transcript_folder, "*.json")
+        files = sorted(glob.glob(folder), key=lambda name: Path(name).stem)
+        return [(file, Path(file).stem) for file in files]
 
     def process_transcripts(self):
-        """Process all transcripts in the transcript folder"""
+        """Process all transcripts in the transcript folder.
+
+        In incremental mode, videos whose files and bucketing parameters match the manifest keep their segments
+        from the previous master file, including any embedding and summary, and only the rest are bucketed.
+        """
         logger.info("Transcription folder: %s", self.transcript_folder)
         logger.info("Segment length %d minutes", self.segment_length_minutes)
+        logger.info("Bucketing workers: %d", self.workers)
+
+        videos = self.list_videos()
+        manifest = Manifest(self.transcript_folder)
+        fingerprints = {video_id: self.bucket_fingerprint(video_id) for _, video_id in videos}
+
+        reusable = set()
+        if self.incremental and master_path(self.transcript_folder).exists():
+            reusable = {
+                video_id for video_id, value in fingerprints.items() if manifest.unchanged("bucket", video_id, value)
+            }
+        logger.info("Videos to bucket: %d of %d", len(videos) - len(reusable), len(videos))
+
+        previous = VideoCursor(read_segments(self.transcript_folder)) if reusable else None
+        bucketed = self.bucket_files([file for file, video_id in videos if video_id not in reusable])
+
+        # Videos are written in videoId order, one at a time, so memory is bounded by bucket_files' window of files
+        # in flight
+        with MasterWriter(self.transcript_folder) as writer:
+            for _, video_id in videos:
+                if video_id in reusable:
+                    segments = previous.take(video_id)
+                    self.reused_files += 1 if segments else 0
+                else:
+                    segments = next(bucketed)
+                    if segments is None:
+                        continue
+                    if self.workers > 1:
+                        self.total_files += 1
+
+                writer.write_many(segments)
+                self.total_segments += len(segments)
+
+        for video_id, value in fingerprints.items():
+            manifest.mark("bucket", video_id, value)
+        manifest.forget("bucket", manifest.video_ids("bucket") - fingerprints.keys())
+        manifest.save()
+
+        if self.store:
+            self.store.close()
+            self.store = None
+
+        logger.info("Total files: %s (%s reused)", self.total_files + self.reused_files, self.reused_files)
+        logger.info("Total segments: %s", self.total_segments)
+
+
+# Each pool process builds its own bucketer, and with it its own tokenizer, once
+_worker_bucketer = None
 
-        folder = os.path.join(self.transcript_folder, "*.json")
 
-        for file in glob.glob(folder):
-            meta = json.load(open(file, encoding="utf-8"))
-            self.get_transcript(meta)
+def init_bucket_worker(folder, minutes, verbose, use_store):
+    """Process pool initializer: create the worker's bucketer and its own connection to the transcript store"""
+    global _worker_bucketer
+    _worker_bucketer = BUCKET_TRANSCRIPTS(folder, minutes, verbose, use_store=use_store)
+    if use_store:
+        _worker_bucketer.store = TranscriptStore(store_path(folder))
 
-        logger.info("Total files: %s", self.total_files)
-        logger.info("Total segments: %s", len(self.segments))
 
-        self.save_segments()
+def bucket_worker_file(file):
+    """Process pool task: bucket one file or stored video with the worker's bucketer"""
+    return _worker_bucketer.bucket_file(file)
@@ -31,47 +31,74 @@ COMMENT ON EXTENSION vector IS 'vector data type and ivfflat and hnsw access met
 
 
 --
--- Name: get_similar_videos(public.vector, double precision, integer); Type: FUNCTION; Schema: public; Owner: postgres
+-- Name: get_similar_videos(public.vector, double precision, integer, character varying, character varying[], integer, integer); Type: FUNCTION; Schema: public; Owner: postgres
 --
 
-CREATE FUNCTION public.get_similar_videos(query_vector public.vector, max_distance double precision, limit_count integer) RETURNS TABLE(speaker character varying, title character varying, description character varying, videoid character varying, seconds integer, text character varying, distance double precision)
-    LANGUAGE plpgsql
+CREATE FUNCTION public.get_similar_videos(query_vector public.vector, max_distance double precision, limit_count integer, filter_speaker character varying DEFAULT NULL, filter_videoids character varying[] DEFAULT NULL, min_seconds integer DEFAULT NULL, max_seconds integer DEFAULT NULL) RETURNS TABLE(speaker character varying, title character varying, description character varying, videoid character varying, seconds integer, text character varying, distance double precision)
+    LANGUAGE sql STABLE
     AS $$
-BEGIN
-    RETURN QUERY
-    SELECT 
-        vc.speaker, 
-        vc.title, 
-        vc.description, 
-        vc.videoid, 
-        ve.seconds, 
-        ve.text, 
-        ve.embedding <=> query_vector AS distance
-    FROM public.video_embeddings ve
-    JOIN public.video_catalog vc ON ve.id = vc.id
-    WHERE ve.embedding <=> query_vector < max_distance
-    ORDER BY distance
-    LIMIT limit_count;
-END;
+    -- Order by distance with LIMIT first so the vector index drives the scan, then apply the cutoff
+    SELECT
+        vc.speaker,
+        vc.title,
+        vc.description,
+        vc.videoid,
+        nearest.seconds,
+        nearest.text,
+        nearest.distance
+    FROM (
+        SELECT ve.videoid, ve.seconds, ve.text, ve.embedding <=> query_vector AS distance
+        FROM public.video_embeddings ve
+        WHERE (filter_videoids IS NULL OR ve.videoid = ANY(filter_videoids))
+            AND (filter_speaker IS NULL OR ve.videoid = ANY(ARRAY(
+                SELECT vs.videoid FROM public.video_catalog vs WHERE vs.speaker = filter_speaker
+            )))
+            AND (min_seconds IS NULL OR ve.seconds >= min_seconds)
+            AND (max_seconds IS NULL OR ve.seconds <= max_seconds)
+        ORDER BY ve.embedding <=> query_vector
+        LIMIT limit_count
+    ) nearest
+    JOIN public.video_catalog vc ON vc.videoid = nearest.videoid
+    WHERE nearest.distance < max_distance
+    ORDER BY nearest.distance;
 $$;
 
 
-ALTER FUNCTION public.get_similar_videos(query_vector public.vector, max_distance double precision, limit_count integer) OWNER TO postgres;
+ALTER FUNCTION public.get_similar_videos(query_vector public.vector, max_distance double precision, limit_count integer, filter_speaker character varying, filter_videoids character varying[], min_seconds integer, max_seconds integer) OWNER TO postgres;
 
 SET default_tablespace = '';
 
 SET default_table_access_method = heap;
 
+--
+-- Name: catalog_version; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.catalog_version (
+    id boolean DEFAULT true NOT NULL,
+    version bigint DEFAULT 0 NOT NULL,
+    CONSTRAINT catalog_version_single_row CHECK (id)
+);
+
+
+ALTER TABLE public.catalog_version OWNER TO postgres;
+
+--
+-- Data for Name: catalog_version; Type: TABLE DATA; Schema: public; Owner: postgres
+--
+
+INSERT INTO public.catalog_version (id, version) VALUES (true, 0);
+
+
 --
 -- Name: video_catalog; Type: TABLE; Schema: public; Owner: postgres
 --
 
 CREATE TABLE public.video_catalog (
-    id integer NOT NULL,
+    videoid character varying(128) NOT NULL,
     speaker character varying(256) NOT NULL,
     title character varying(256) NOT NULL,
-    description character varying(4096) NOT NULL,
-    videoid character varying(128) NOT NULL
+    description character varying(4096) NOT NULL
 );
 
 
@@ -87,7 +114,8 @@ CREATE TABLE public.video_embeddings (
     start character varying(64) NOT NULL,
     seconds integer NOT NULL,
     text character varying(12288) NOT NULL,
-    summary character varying(16384) NOT NULL
+    summary character varying(16384) NOT NULL,
+    videoid character varying(128) NOT NULL
 );
 
 
@@ -121,6 +149,14 @@ ALTER SEQUENCE public.video_gpt_id_seq OWNED BY public.video_embeddings.id;
 ALTER TABLE ONLY public.video_embeddings ALTER COLUMN id SET DEFAULT nextval('public.video_gpt_id_seq'::regclass);
 
 
+--
+-- Name: catalog_version catalog_version_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.catalog_version
+    ADD CONSTRAINT catalog_version_pkey PRIMARY KEY (id);
+
+
 --
 -- Name: video_embeddings video_gpt_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
@@ -130,19 +166,40 @@ ALTER TABLE ONLY public.video_embeddings
 
 
 --
--- Name: video_catalog video_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+-- Name: video_catalog video_catalog_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
 --
 
 ALTER TABLE ONLY public.video_catalog
-    ADD CONSTRAINT video_pkey PRIMARY KEY (id);
+    ADD CONSTRAINT video_catalog_pkey PRIMARY KEY (videoid);
+
+
+--
+-- Name: video_embeddings_embedding_hnsw_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX video_embeddings_embedding_hnsw_idx ON public.video_embeddings USING hnsw (embedding public.vector_cosine_ops) WITH (m='16', ef_construction='64');
+
+
+--
+-- Name: video_embeddings_videoid_seconds_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX video_embeddings_videoid_seconds_idx ON public.video_embeddings USING btree (videoid, seconds);
+
+
+--
+-- Name: video_catalog_speaker_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX video_catalog_speaker_idx ON public.video_catalog USING btree (speaker);
 
 
 --
--- Name: video_embeddings fk_video_catalog_id; Type: FK CONSTRAINT; Schema: public; Owner: postgres
+-- Name: video_embeddings fk_video_catalog_videoid; Type: FK CONSTRAINT; Schema: public; Owner: postgres
 --
 
 ALTER TABLE ONLY public.video_embeddings
-    ADD CONSTRAINT fk_video_catalog_id FOREIGN KEY (id) REFERENCES public.video_catalog(id);
+    ADD CONSTRAINT fk_video_catalog_videoid FOREIGN KEY (videoid) REFERENCES public.video_catalog(videoid);
 
 
 --
@@ -0,0 +1,13 @@
+--
+-- Single-row catalog version, bumped by LOAD_TRANSCRIPTS whenever it loads data.
+-- query_service polls it to invalidate cached search results.
+--
+
+CREATE TABLE IF NOT EXISTS public.catalog_version (
+    id boolean DEFAULT true NOT NULL,
+    version bigint DEFAULT 0 NOT NULL,
+    CONSTRAINT catalog_version_single_row CHECK (id),
+    CONSTRAINT catalog_version_pkey PRIMARY KEY (id)
+);
+
+INSERT INTO public.catalog_version (id, version) VALUES (true, 0) ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1,30 @@
+--
+-- Index-friendly get_similar_videos and an HNSW cosine index on video_embeddings.embedding.
+-- Run outside a transaction (CREATE INDEX CONCURRENTLY). Use vector_index.py to switch to IVFFlat or tune parameters.
+--
+
+CREATE OR REPLACE FUNCTION public.get_similar_videos(query_vector public.vector, max_distance double precision, limit_count integer) RETURNS TABLE(speaker character varying, title character varying, description character varying, videoid character varying, seconds integer, text character varying, distance double precision)
+    LANGUAGE sql STABLE
+    AS $$
+    -- Order by distance with LIMIT first so the vector index drives the scan, then apply the cutoff
+    SELECT
+        vc.speaker,
+        vc.title,
+        vc.description,
+        vc.videoid,
+        nearest.seconds,
+        nearest.text,
+        nearest.distance
+    FROM (
+        SELECT ve.id, ve.seconds, ve.text, ve.embedding <=> query_vector AS distance
+        FROM public.video_embeddings ve
+        ORDER BY ve.embedding <=> query_vector
+        LIMIT limit_count
+    ) nearest
+    JOIN public.video_catalog vc ON nearest.id = vc.id
+    WHERE nearest.distance < max_distance
+    ORDER BY nearest.distance;
+$$;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS video_embeddings_embedding_hnsw_idx
+    ON public.video_embeddings USING hnsw (embedding public.vector_cosine_ops) WITH (m = 16, ef_construction = 64);
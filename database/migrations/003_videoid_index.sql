@@ -0,0 +1,6 @@
+--
+-- Incremental loads delete and replace rows by videoid.
+-- Run outside a transaction (CREATE INDEX CONCURRENTLY).
+--
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS video_catalog_videoid_idx ON public.video_catalog USING btree (videoid);
@@ -0,0 +1,40 @@
+--
+-- Optional: store embeddings as halfvec(768) instead of vector(768), halving the table and HNSW index footprint.
+-- Needs pgvector 0.7+. Rewrites video_embeddings, so plan for the downtime. Apply before 005.
+-- Run outside a transaction (CREATE INDEX CONCURRENTLY). Loaders and query_service need no configuration change:
+-- pgvector_codec registers a binary halfvec codec and get_similar_videos keeps its vector signature.
+--
+
+DROP INDEX IF EXISTS public.video_embeddings_embedding_hnsw_idx;
+DROP INDEX IF EXISTS public.video_embeddings_embedding_ivfflat_idx;
+
+ALTER TABLE public.video_embeddings
+    ALTER COLUMN embedding TYPE public.halfvec(768) USING embedding::public.halfvec(768);
+
+CREATE OR REPLACE FUNCTION public.get_similar_videos(query_vector public.vector, max_distance double precision, limit_count integer) RETURNS TABLE(speaker character varying, title character varying, description character varying, videoid character varying, seconds integer, text character varying, distance double precision)
+    LANGUAGE sql STABLE
+    AS $$
+    -- Order by distance with LIMIT first so the vector index drives the scan, then apply the cutoff
+    SELECT
+        vc.speaker,
+        vc.title,
+        vc.description,
+        vc.videoid,
+        nearest.seconds,
+        nearest.text,
+        nearest.distance
+    FROM (
+        SELECT ve.id, ve.seconds, ve.text, ve.embedding <=> query_vector::public.halfvec(768) AS distance
+        FROM public.video_embeddings ve
+        ORDER BY ve.embedding <=> query_vector::public.halfvec(768)
+        LIMIT limit_count
+    ) nearest
+    JOIN public.video_catalog vc ON nearest.id = vc.id
+    WHERE nearest.distance < max_distance
+    ORDER BY nearest.distance;
+$$;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS video_embeddings_embedding_hnsw_idx
+    ON public.video_embeddings USING hnsw (embedding public.halfvec_cosine_ops) WITH (m = 16, ef_construction = 64);
+
+ANALYZE public.video_embeddings;
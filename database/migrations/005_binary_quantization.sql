@@ -0,0 +1,90 @@
+--
+-- Binary-quantized HNSW index and a two-phase search: Hamming distance over one bit per dimension finds
+-- candidate_count candidates, then exact cosine distance on the stored embeddings re-ranks them.
+-- The index is on an expression, so the table stores nothing extra; each entry is 96 bytes instead of 3 KB.
+-- Works with vector or halfvec storage (apply 004 first if using it). Needs pgvector 0.7+.
+-- Run outside a transaction (CREATE INDEX CONCURRENTLY). Enable in query_service with RERANK_CANDIDATES.
+--
+
+-- The function follows the catalog layout: one video_catalog row per segment before 006, one per video after
+-- 006 and 007 (as database.sql creates it), where it also takes 007's filters
+DO $migration$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_attribute
+        WHERE attrelid = 'public.video_embeddings'::regclass AND attname = 'videoid' AND NOT attisdropped
+    ) THEN
+        EXECUTE $function$
+CREATE OR REPLACE FUNCTION public.get_similar_videos_reranked(query_vector public.vector, max_distance double precision, limit_count integer, candidate_count integer, filter_speaker character varying DEFAULT NULL, filter_videoids character varying[] DEFAULT NULL, min_seconds integer DEFAULT NULL, max_seconds integer DEFAULT NULL) RETURNS TABLE(speaker character varying, title character varying, description character varying, videoid character varying, seconds integer, text character varying, distance double precision)
+    LANGUAGE sql STABLE
+    AS $$
+    -- An HNSW scan returns at most hnsw.ef_search rows, so callers set it to at least candidate_count
+    SELECT
+        vc.speaker,
+        vc.title,
+        vc.description,
+        vc.videoid,
+        nearest.seconds,
+        nearest.text,
+        nearest.distance
+    FROM (
+        SELECT candidates.videoid, candidates.seconds, candidates.text, candidates.embedding::public.vector <=> query_vector AS distance
+        FROM (
+            SELECT ve.videoid, ve.seconds, ve.text, ve.embedding
+            FROM public.video_embeddings ve
+            WHERE (filter_videoids IS NULL OR ve.videoid = ANY(filter_videoids))
+                AND (filter_speaker IS NULL OR ve.videoid = ANY(ARRAY(
+                    SELECT vs.videoid FROM public.video_catalog vs WHERE vs.speaker = filter_speaker
+                )))
+                AND (min_seconds IS NULL OR ve.seconds >= min_seconds)
+                AND (max_seconds IS NULL OR ve.seconds <= max_seconds)
+            ORDER BY public.binary_quantize(ve.embedding)::bit(768) <~> public.binary_quantize(query_vector)::bit(768)
+            LIMIT candidate_count
+        ) candidates
+        ORDER BY distance
+        LIMIT limit_count
+    ) nearest
+    JOIN public.video_catalog vc ON vc.videoid = nearest.videoid
+    WHERE nearest.distance < max_distance
+    ORDER BY nearest.distance;
+$$;
+$function$;
+    ELSE
+        EXECUTE $function$
+CREATE OR REPLACE FUNCTION public.get_similar_videos_reranked(query_vector public.vector, max_distance double precision, limit_count integer, candidate_count integer) RETURNS TABLE(speaker character varying, title character varying, description character varying, videoid character varying, seconds integer, text character varying, distance double precision)
+    LANGUAGE sql STABLE
+    AS $$
+    -- An HNSW scan returns at most hnsw.ef_search rows, so callers set it to at least candidate_count
+    SELECT
+        vc.speaker,
+        vc.title,
+        vc.description,
+        vc.videoid,
+        nearest.seconds,
+        nearest.text,
+        nearest.distance
+    FROM (
+        SELECT candidates.id, candidates.seconds, candidates.text, candidates.embedding::public.vector <=> query_vector AS distance
+        FROM (
+            SELECT ve.id, ve.seconds, ve.text, ve.embedding
+            FROM public.video_embeddings ve
+            ORDER BY public.binary_quantize(ve.embedding)::bit(768) <~> public.binary_quantize(query_vector)::bit(768)
+            LIMIT candidate_count
+        ) candidates
+        ORDER BY distance
+        LIMIT limit_count
+    ) nearest
+    JOIN public.video_catalog vc ON nearest.id = vc.id
+    WHERE nearest.distance < max_distance
+    ORDER BY nearest.distance;
+$$;
+$function$;
+    END IF;
+END
+$migration$;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS video_embeddings_embedding_bits_hnsw_idx
+    ON public.video_embeddings USING hnsw ((public.binary_quantize(embedding)::bit(768)) public.bit_hamming_ops)
+    WITH (m = 16, ef_construction = 64);
+
+ANALYZE public.video_embeddings;
@@ -0,0 +1,120 @@
+--
+-- One video_catalog row per video instead of one per segment. video_catalog is keyed by videoid and
+-- video_embeddings references it, so titles and descriptions are stored once and searches join the
+-- top-K rows to the catalog through its primary key.
+-- Runs in one transaction. The UPDATE rewrites video_embeddings; run VACUUM FULL (or pg_repack) afterwards
+-- to return the space.
+--
+
+BEGIN;
+
+ALTER TABLE public.video_embeddings ADD COLUMN videoid character varying(128);
+
+UPDATE public.video_embeddings ve SET videoid = vc.videoid FROM public.video_catalog vc WHERE vc.id = ve.id;
+
+ALTER TABLE public.video_embeddings DROP CONSTRAINT fk_video_catalog_id;
+ALTER TABLE public.video_embeddings ALTER COLUMN videoid SET NOT NULL;
+
+CREATE TABLE public.video_catalog_by_video (
+    videoid character varying(128) NOT NULL,
+    speaker character varying(256) NOT NULL,
+    title character varying(256) NOT NULL,
+    description character varying(4096) NOT NULL
+);
+
+-- Segments of a video share its metadata; keep the most recently loaded copy
+INSERT INTO public.video_catalog_by_video (videoid, speaker, title, description)
+SELECT DISTINCT ON (videoid) videoid, speaker, title, description
+FROM public.video_catalog
+ORDER BY videoid, id DESC;
+
+DROP TABLE public.video_catalog;
+ALTER TABLE public.video_catalog_by_video RENAME TO video_catalog;
+
+ALTER TABLE ONLY public.video_catalog
+    ADD CONSTRAINT video_catalog_pkey PRIMARY KEY (videoid);
+
+ALTER TABLE ONLY public.video_embeddings
+    ADD CONSTRAINT fk_video_catalog_videoid FOREIGN KEY (videoid) REFERENCES public.video_catalog(videoid);
+
+-- Incremental loads delete and replace a video's segments by videoid
+CREATE INDEX video_embeddings_videoid_idx ON public.video_embeddings USING btree (videoid);
+
+-- The distance expression must match the HNSW index: vector(768), or halfvec(768) after 004_halfvec_storage.sql
+DO $migration$
+DECLARE
+    embedding_type text;
+BEGIN
+    SELECT format('public.%s(%s)', t.typname, a.atttypmod) INTO embedding_type
+    FROM pg_attribute a
+    JOIN pg_type t ON t.oid = a.atttypid
+    WHERE a.attrelid = 'public.video_embeddings'::regclass AND a.attname = 'embedding';
+
+    EXECUTE format($function$
+CREATE OR REPLACE FUNCTION public.get_similar_videos(query_vector public.vector, max_distance double precision, limit_count integer) RETURNS TABLE(speaker character varying, title character varying, description character varying, videoid character varying, seconds integer, text character varying, distance double precision)
+    LANGUAGE sql STABLE
+    AS $$
+    -- Order by distance with LIMIT first so the vector index drives the scan, then apply the cutoff
+    SELECT
+        vc.speaker,
+        vc.title,
+        vc.description,
+        vc.videoid,
+        nearest.seconds,
+        nearest.text,
+        nearest.distance
+    FROM (
+        SELECT ve.videoid, ve.seconds, ve.text, ve.embedding <=> query_vector::%1$s AS distance
+        FROM public.video_embeddings ve
+        ORDER BY ve.embedding <=> query_vector::%1$s
+        LIMIT limit_count
+    ) nearest
+    JOIN public.video_catalog vc ON vc.videoid = nearest.videoid
+    WHERE nearest.distance < max_distance
+    ORDER BY nearest.distance;
+$$;
+$function$, embedding_type);
+END
+$migration$;
+
+-- get_similar_videos_reranked needs binary_quantize (pgvector 0.7+); replace it only where 005 created it
+DO $migration$
+BEGIN
+    IF to_regproc('public.get_similar_videos_reranked') IS NOT NULL THEN
+        EXECUTE $function$
+CREATE OR REPLACE FUNCTION public.get_similar_videos_reranked(query_vector public.vector, max_distance double precision, limit_count integer, candidate_count integer) RETURNS TABLE(speaker character varying, title character varying, description character varying, videoid character varying, seconds integer, text character varying, distance double precision)
+    LANGUAGE sql STABLE
+    AS $$
+    -- An HNSW scan returns at most hnsw.ef_search rows, so callers set it to at least candidate_count
+    SELECT
+        vc.speaker,
+        vc.title,
+        vc.description,
+        vc.videoid,
+        nearest.seconds,
+        nearest.text,
+        nearest.distance
+    FROM (
+        SELECT candidates.videoid, candidates.seconds, candidates.text, candidates.embedding::public.vector <=> query_vector AS distance
+        FROM (
+            SELECT ve.videoid, ve.seconds, ve.text, ve.embedding
+            FROM public.video_embeddings ve
+            ORDER BY public.binary_quantize(ve.embedding)::bit(768) <~> public.binary_quantize(query_vector)::bit(768)
+            LIMIT candidate_count
+        ) candidates
+        ORDER BY distance
+        LIMIT limit_count
+    ) nearest
+    JOIN public.video_catalog vc ON vc.videoid = nearest.videoid
+    WHERE nearest.distance < max_distance
+    ORDER BY nearest.distance;
+$$;
+$function$;
+    END IF;
+END
+$migration$;
+
+COMMIT;
+
+ANALYZE public.video_catalog;
+ANALYZE public.video_embeddings;
@@ -0,0 +1,108 @@
+--
+-- Optional speaker, videoid and segment start time filters on get_similar_videos and get_similar_videos_reranked,
+-- applied inside the nearest-neighbour scan so a filtered search still returns limit_count rows.
+-- With pgvector 0.8+, query_service turns on hnsw.iterative_scan for filtered searches so the HNSW index keeps
+-- scanning until enough rows pass the filter; selective filters can use the btree indexes below instead.
+-- Apply after 006. The functions are replaced in one transaction; the indexes are built concurrently afterwards.
+--
+
+BEGIN;
+
+-- New defaulted parameters would make three-argument calls ambiguous between old and new signatures
+DROP FUNCTION IF EXISTS public.get_similar_videos(public.vector, double precision, integer);
+
+-- The distance expression must match the HNSW index: vector(768), or halfvec(768) after 004_halfvec_storage.sql
+DO $migration$
+DECLARE
+    embedding_type text;
+BEGIN
+    SELECT format('public.%s(%s)', t.typname, a.atttypmod) INTO embedding_type
+    FROM pg_attribute a
+    JOIN pg_type t ON t.oid = a.atttypid
+    WHERE a.attrelid = 'public.video_embeddings'::regclass AND a.attname = 'embedding';
+
+    EXECUTE format($function$
+CREATE FUNCTION public.get_similar_videos(query_vector public.vector, max_distance double precision, limit_count integer, filter_speaker character varying DEFAULT NULL, filter_videoids character varying[] DEFAULT NULL, min_seconds integer DEFAULT NULL, max_seconds integer DEFAULT NULL) RETURNS TABLE(speaker character varying, title character varying, description character varying, videoid character varying, seconds integer, text character varying, distance double precision)
+    LANGUAGE sql STABLE
+    AS $$
+    -- Order by distance with LIMIT first so the vector index drives the scan, then apply the cutoff
+    SELECT
+        vc.speaker,
+        vc.title,
+        vc.description,
+        vc.videoid,
+        nearest.seconds,
+        nearest.text,
+        nearest.distance
+    FROM (
+        SELECT ve.videoid, ve.seconds, ve.text, ve.embedding <=> query_vector::%1$s AS distance
+        FROM public.video_embeddings ve
+        WHERE (filter_videoids IS NULL OR ve.videoid = ANY(filter_videoids))
+            AND (filter_speaker IS NULL OR ve.videoid = ANY(ARRAY(
+                SELECT vs.videoid FROM public.video_catalog vs WHERE vs.speaker = filter_speaker
+            )))
+            AND (min_seconds IS NULL OR ve.seconds >= min_seconds)
+            AND (max_seconds IS NULL OR ve.seconds <= max_seconds)
+        ORDER BY ve.embedding <=> query_vector::%1$s
+        LIMIT limit_count
+    ) nearest
+    JOIN public.video_catalog vc ON vc.videoid = nearest.videoid
+    WHERE nearest.distance < max_distance
+    ORDER BY nearest.distance;
+$$;
+$function$, embedding_type);
+END
+$migration$;
+
+-- get_similar_videos_reranked needs binary_quantize (pgvector 0.7+); replace it only where 005 created it
+DO $migration$
+BEGIN
+    IF to_regproc('public.get_similar_videos_reranked') IS NOT NULL THEN
+        DROP FUNCTION IF EXISTS public.get_similar_videos_reranked(public.vector, double precision, integer, integer);
+        EXECUTE $function$
+CREATE FUNCTION public.get_similar_videos_reranked(query_vector public.vector, max_distance double precision, limit_count integer, candidate_count integer, filter_speaker character varying DEFAULT NULL, filter_videoids character varying[] DEFAULT NULL, min_seconds integer DEFAULT NULL, max_seconds integer DEFAULT NULL) RETURNS TABLE(speaker character varying, title character varying, description character varying, videoid character varying, seconds integer, text character varying, distance double precision)
+    LANGUAGE sql STABLE
+    AS $$
+    -- An HNSW scan returns at most hnsw.ef_search rows, so callers set it to at least candidate_count
+    SELECT
+        vc.speaker,
+        vc.title,
+        vc.description,
+        vc.videoid,
+        nearest.seconds,
+        nearest.text,
+        nearest.distance
+    FROM (
+        SELECT candidates.videoid, candidates.seconds, candidates.text, candidates.embedding::public.vector <=> query_vector AS distance
+        FROM (
+            SELECT ve.videoid, ve.seconds, ve.text, ve.embedding
+            FROM public.video_embeddings ve
+            WHERE (filter_videoids IS NULL OR ve.videoid = ANY(filter_videoids))
+                AND (filter_speaker IS NULL OR ve.videoid = ANY(ARRAY(
+                    SELECT vs.videoid FROM public.video_catalog vs WHERE vs.speaker = filter_speaker
+                )))
+                AND (min_seconds IS NULL OR ve.seconds >= min_seconds)
+                AND (max_seconds IS NULL OR ve.seconds <= max_seconds)
+            ORDER BY public.binary_quantize(ve.embedding)::bit(768) <~> public.binary_quantize(query_vector)::bit(768)
+            LIMIT candidate_count
+        ) candidates
+        ORDER BY distance
+        LIMIT limit_count
+    ) nearest
+    JOIN public.video_catalog vc ON vc.videoid = nearest.videoid
+    WHERE nearest.distance < max_distance
+    ORDER BY nearest.distance;
+$$;
+$function$;
+    END IF;
+END
+$migration$;
+
+COMMIT;
+
+-- videoid filters, optionally narrowed by start time; its videoid prefix replaces the index from 006
+CREATE INDEX CONCURRENTLY IF NOT EXISTS video_embeddings_videoid_seconds_idx
+    ON public.video_embeddings USING btree (videoid, seconds);
+DROP INDEX CONCURRENTLY IF EXISTS public.video_embeddings_videoid_idx;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS video_catalog_speaker_idx ON public.video_catalog USING btree (speaker);
@@ -2,16 +2,24 @@
 
 import os
 from pathlib import Path
+import asyncio
 import json
 import logging
+import random
 import time
-import threading
-import queue
-import googleapiclient.discovery
-import googleapiclient.errors
-from youtube_transcript_api import YouTubeTranscriptApi
-from youtube_transcript_api.formatters import WebVTTFormatter
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Awaitable, Callable
+
+import httpx
+from youtube_transcript_api import (
+    NoTranscriptAvailable,
+    NoTranscriptFound,
+    TooManyRequests,
+    TranscriptsDisabled,
+    VideoUnavailable,
+    YouTubeTranscriptApi,
+)
+
+from transcript_store import TranscriptStore, store_path
 
 
 logging.basicConfig(level=logging.INFO)
@@ -20,36 +28,158 @@ logger = logging.getLogger(__name__)
 GOOGLE_DEVELOPER_API_KEY = os.environ["GOOGLE_DEVELOPER_API_KEY"]
 YOUTUBE_PLAYLIST_ID = os.environ["YOUTUBE_PLAYLIST_ID"]
 
-# Initialize the Google developer API client
-GOOGLE_API_SERVICE_NAME = "youtube"
-GOOGLE_API_VERSION = "v3"
+# Base URLs can point at a local stub of the YouTube Data API and transcript endpoints
+YOUTUBE_API_BASE_URL = os.getenv("YOUTUBE_API_BASE_URL", "https://www.googleapis.com/youtube/v3")
+TRANSCRIPT_API_BASE_URL = os.getenv("TRANSCRIPT_API_BASE_URL")
 
 MAX_RESULTS = 50
-PROCESSING_THREADS = 40
+MAX_CONCURRENCY = 40
+MIN_CONCURRENCY = 1
+INITIAL_CONCURRENCY = 8
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 120.0
+STATUS_FILE = "download_status.jsonl"
+
+DOWNLOADED = "downloaded"
+NO_TRANSCRIPT = "no_transcript"
+FAILED_RETRYABLE = "failed_retryable"
+
+
+class TranscriptUnavailable(Exception):
+    """The video has no transcript; retrying will not help"""
+
+
+class RetryableError(Exception):
+    """A transient failure; throttled is True when the service asked us to slow down"""
+
+    def __init__(self, message: str, throttled: bool = False, retry_after: float | None = None) -> None:
+        super().__init__(message)
+        self.throttled = throttled
+        self.retry_after = retry_after
+
+
+TranscriptFetcher = Callable[[str], Awaitable[list]]
+
 
-formatter = WebVTTFormatter()
-q = queue.Queue()
+async def fetch_youtube_transcript(video_id: str) -> list:
+    """Fetch a transcript with youtube_transcript_api, which is synchronous, on a worker thread"""
+    try:
+        return await asyncio.to_thread(YouTubeTranscriptApi.get_transcript, video_id)
+    except (TranscriptsDisabled, NoTranscriptFound, NoTranscriptAvailable, VideoUnavailable) as e:
+        raise TranscriptUnavailable(str(e)) from e
+    except TooManyRequests as e:
+        raise RetryableError(str(e), throttled=True) from e
+    except Exception as e:
+        raise RetryableError(str(e)) from e
 
 
-class Counter:
-    """thread safe counter"""
+def retry_after_seconds(response: httpx.Response) -> float | None:
+    """Seconds from a Retry-After header, if it is given as a number"""
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
 
-    def __init__(self):
-        """initialize the counter"""
-        self.value = 0
-        self.lock = threading.Lock()
 
-    def increment(self):
-        """increment the counter"""
-        with self.lock:
-            self.value += 1
+def raise_for_retryable(response: httpx.Response) -> None:
+    """Raise RetryableError for throttling and server errors"""
+    if response.status_code == 429 or (response.status_code == 403 and b"rateLimitExceeded" in response.content):
+        raise RetryableError(f"HTTP {response.status_code}", throttled=True, retry_after=retry_after_seconds(response))
+    if response.status_code >= 500:
+        raise RetryableError(f"HTTP {response.status_code}", retry_after=retry_after_seconds(response))
+
+
+class HttpTranscriptFetcher:
+    """Fetch transcripts as JSON from GET {base_url}/{video_id}, for a transcript service or a local stub.
+
+    200: a JSON list of {"text", "start", "duration"} captions, as youtube_transcript_api returns them
+    404: the video has no transcript, recorded as no_transcript and not requested again
+    429, or 403 with rateLimitExceeded: throttled; a numeric Retry-After is the least delay before the retry
+    5xx and connection errors: retried with backoff, then recorded as failed_retryable
+    every retried response halves the concurrency, as an overloaded service answers with errors as well as 429s
+    any other status: logged as an error without a recorded status, so the next run tries the video again
+
+    loadtest/stub_transcript_server.py implements this protocol and the playlistItems endpoint.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, base_url: str) -> None:
+        self.client = client
+        self.base_url = base_url.rstrip("/")
+
+    async def __call__(self, video_id: str) -> list:
+        try:
+            response = await self.client.get(f"{self.base_url}/{video_id}")
+        except httpx.HTTPError as e:
+            raise RetryableError(str(e)) from e
+        if response.status_code == 404:
+            raise TranscriptUnavailable(f"No transcript for {video_id}")
+        raise_for_retryable(response)
+        response.raise_for_status()
+        return response.json()
+
+
+class AdaptiveLimiter:
+    """Concurrency limit that adapts AIMD style: +1 per limit's worth of successes, halved on throttling or errors"""
+
+    def __init__(
+        self, initial: int = INITIAL_CONCURRENCY, minimum: int = MIN_CONCURRENCY, maximum: int = MAX_CONCURRENCY
+    ) -> None:
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self) -> "AdaptiveLimiter":
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def success(self) -> None:
+        """Additive increase"""
+        self.limit = min(self.limit + 1 / self.limit, self.maximum)
+
+    def throttled(self) -> None:
+        """Multiplicative decrease, at most once per second so a burst of 429s or 503s only halves the limit once"""
+        now = time.monotonic()
+        if now - self.last_decrease < 1.0:
+            return
+        self.last_decrease = now
+        self.limit = max(self.limit / 2, self.minimum)
 
 
 class DOWNLOAD_TRANSCRIPT:
 
-    def __init__(self, transcript_folder: str) -> None:
-        self.count = Counter()
+    def __init__(
+        self,
+        transcript_folder: str,
+        fetch_transcript: TranscriptFetcher | None = None,
+        max_concurrency: int = MAX_CONCURRENCY,
+        max_retries: int = MAX_RETRIES,
+        use_store: bool = False,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> None:
         self.transcript_folder = transcript_folder
+        # routes the playlist and transcript requests somewhere other than the network, e.g. an in-process stub
+        self.transport = transport
+        self.use_store = use_store
+        self.store = None
+        self.fetch_transcript = fetch_transcript
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.status_file = Path(self.transcript_folder) / STATUS_FILE
+        self.status = {}
+        self.counts = {DOWNLOADED: 0, NO_TRANSCRIPT: 0, FAILED_RETRYABLE: 0}
+        self.skipped = 0
+        self.limiter = None
 
     def gen_metadata(self, playlist_item: dict) -> None:
         """Generate metadata for a video"""
@@ -64,102 +194,192 @@ class DOWNLOAD_TRANSCRIPT:
         metadata["videoId"] = playlist_item["snippet"]["resourceId"]["videoId"]
         metadata["description"] = playlist_item["snippet"]["description"]
 
+        if self.store:
+            self.store.put_metadata(video_id, metadata)
+            return
+
         # save the metadata as a .json file
         with filename.open("w", encoding="utf-8") as file:
             json.dump(metadata, file)
 
-    def get_transcript(self, playlist_item: dict, counter_id: int) -> bool:
-        """Get the transcript for a video"""
-
-        video_id = playlist_item["snippet"]["resourceId"]["videoId"]
+    def save_transcript(self, video_id: str, transcript: list) -> None:
+        """Save the transcript to the store, or as a .vtt file"""
         filename = Path(self.transcript_folder) / (video_id + ".json.vtt")
 
-        # if video transcript already exists, skip it
-        if Path(filename).exists():
-            logger.debug("Skipping video %d, %s", counter_id, video_id)
-            return False
+        # remove \n from the text
+        for item in transcript:
+            item["text"] = item["text"].replace("\n", " ")
 
-        try:
-            transcript = YouTubeTranscriptApi.get_transcript(video_id)
-            # remove \n from the text
-            for item in transcript:
-                item["text"] = item["text"].replace("\n", " ")
-
-            logger.debug("Transcription download completed: %d, %s", counter_id, video_id)
-            # save the transcript as a .vtt file
-            with open(filename, "w", encoding="utf-8") as file:
-                json.dump(transcript, file, indent=4, ensure_ascii=False)
-                # file.write(transcript)
-
-        except Exception as exception:
-            logger.debug(exception)
-            logger.debug("Transcription not found for video: %s", video_id)
+        if self.store:
+            self.store.put_transcript(video_id, transcript)
+            return
+
+        with filename.open("w", encoding="utf-8") as file:
+            json.dump(transcript, file, indent=4, ensure_ascii=False)
+
+    def load_status(self) -> None:
+        """Load the last recorded status of each video from previous runs"""
+        if not self.status_file.exists():
+            return
+        with self.status_file.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line may be partial if the previous run was killed mid-write
+                    continue
+                self.status[entry["videoId"]] = entry["status"]
+
+    def record_status(self, journal: object, video_id: str, status: str, attempts: int, error: str = "") -> None:
+        """Append a video's outcome to the status file"""
+        self.status[video_id] = status
+        self.counts[status] += 1
+        entry = {"videoId": video_id, "status": status, "attempts": attempts, "error": error, "time": time.time()}
+        journal.write(json.dumps(entry) + "\n")
+        journal.flush()
+
+    def needs_download(self, video_id: str) -> bool:
+        """Skip videos already downloaded or known to have no transcript"""
+        if self.status.get(video_id) == NO_TRANSCRIPT:
             return False
+        if self.store:
+            return not self.store.has_transcript(video_id)
+        return not (Path(self.transcript_folder) / (video_id + ".json.vtt")).exists()
 
-        return True
+    async def get_transcript(self, playlist_item: dict, limiter: AdaptiveLimiter, journal: object) -> None:
+        """Get the transcript for a video, retrying transient failures with exponential backoff"""
 
-    def process_queue(self) -> None:
-        """process the queue"""
-        while not q.empty():
-            video = q.get()
+        video_id = playlist_item["snippet"]["resourceId"]["videoId"]
+        error = ""
 
-            self.count.increment()
+        for attempt in range(1, self.max_retries + 1):
+            retry_after = None
+            try:
+                async with limiter:
+                    transcript = await self.fetch_transcript(video_id)
+                limiter.success()
+            except TranscriptUnavailable as e:
+                logger.debug("Transcription not found for video: %s", video_id)
+                self.record_status(journal, video_id, NO_TRANSCRIPT, attempt, str(e))
+                return
+            except RetryableError as e:
+                error = str(e)
+                retry_after = e.retry_after
+                limiter.throttled()
+                outcome = "throttled" if e.throttled else "failed"
+                logger.warning(
+                    "Attempt %d for %s %s: %s (concurrency %.1f)", attempt, video_id, outcome, e, limiter.limit
+                )
+            else:
+                self.save_transcript(video_id, transcript)
+                self.gen_metadata(playlist_item)
+                logger.debug("Transcription download completed: %s", video_id)
+                self.record_status(journal, video_id, DOWNLOADED, attempt)
+                return
+
+            if attempt < self.max_retries:
+                # Retry-After is a floor: the jitter that spreads retries out only ever adds to it
+                delay = max(retry_after or 0.0, min(RETRY_BASE_DELAY * 2 ** (attempt - 1), RETRY_MAX_DELAY))
+                await asyncio.sleep(random.uniform(delay, delay * 1.5))
+
+        logger.error("Giving up on %s after %d attempts: %s", video_id, self.max_retries, error)
+        self.record_status(journal, video_id, FAILED_RETRYABLE, self.max_retries, error)
+
+    async def page_playlist(self, client: httpx.AsyncClient, items: asyncio.Queue) -> None:
+        """Queue playlist items page by page, so downloads start while later pages are still being fetched"""
+        params = {
+            "part": "snippet",
+            "playlistId": YOUTUBE_PLAYLIST_ID,
+            "maxResults": MAX_RESULTS,
+            "key": GOOGLE_DEVELOPER_API_KEY,
+        }
+        total = 0
 
-            if self.get_transcript(video, self.count.value):
-                self.gen_metadata(video)
-            q.task_done()
+        # Loop through the pages of results until there is no next page token
+        while True:
+            for attempt in range(1, self.max_retries + 1):
+                try:
+                    response = await client.get(f"{YOUTUBE_API_BASE_URL}/playlistItems", params=params)
+                    raise_for_retryable(response)
+                    response.raise_for_status()
+                    break
+                except (RetryableError, httpx.TransportError) as e:
+                    if attempt == self.max_retries:
+                        raise
+                    logger.warning("Playlist page attempt %d failed: %s", attempt, e)
+                    await asyncio.sleep(min(RETRY_BASE_DELAY * 2 ** (attempt - 1), RETRY_MAX_DELAY))
+
+            page = response.json()
+            for item in page.get("items", []):
+                if self.needs_download(item["snippet"]["resourceId"]["videoId"]):
+                    await items.put(item)
+                    total += 1
+                else:
+                    self.skipped += 1
+
+            logger.info("Total transcriptions to be downloaded so far: %s", total)
+
+            next_page_token = page.get("nextPageToken")
+            if not next_page_token:
+                return
+            params["pageToken"] = next_page_token
+
+    async def download(self) -> None:
+        """Page the playlist and download transcripts concurrently."""
+        limiter = AdaptiveLimiter(min(INITIAL_CONCURRENCY, self.max_concurrency), maximum=self.max_concurrency)
+        self.limiter = limiter
+        items = asyncio.Queue(maxsize=self.max_concurrency * 2)
+
+        async with httpx.AsyncClient(timeout=30.0, transport=self.transport) as client:
+            if self.fetch_transcript is None:
+                self.fetch_transcript = (
+                    HttpTranscriptFetcher(client, TRANSCRIPT_API_BASE_URL)
+                    if TRANSCRIPT_API_BASE_URL
+                    else fetch_youtube_transcript
+                )
+
+            with self.status_file.open("a", encoding="utf-8") as journal:
+
+                async def worker() -> None:
+                    while (item := await items.get()) is not None:
+                        try:
+                            await self.get_transcript(item, limiter, journal)
+                        except Exception as e:
+                            logger.error("An error occurred during processing: %s", e)
+
+                workers = [asyncio.create_task(worker()) for _ in range(self.max_concurrency)]
+                try:
+                    await self.page_playlist(client, items)
+                except (RetryableError, httpx.HTTPError) as e:
+                    logger.error("An HTTP error occurred: %s", e)
+                finally:
+                    for _ in workers:
+                        await items.put(None)
+                    await asyncio.gather(*workers)
 
     def start_download(self) -> None:
         """Start the download process."""
         logger.debug("Transcription folder: %s", self.transcript_folder)
-
-        youtube = googleapiclient.discovery.build(
-            GOOGLE_API_SERVICE_NAME, GOOGLE_API_VERSION, developerKey=GOOGLE_DEVELOPER_API_KEY
-        )
-
-        # Create a request object with the playlist ID and the max results
-        request = youtube.playlistItems().list(part="snippet", playlistId=YOUTUBE_PLAYLIST_ID, maxResults=MAX_RESULTS)
-
-        # Loop through the pages of results until there is no next page token
-        while request:
-            try:
-                response = request.execute()
-
-                # Batch process the items in the response
-                items = response.get("items", [])
-                for item in items:
-                    q.put(item)
-
-                logger.info("Total transcriptions to be downloaded so far: %s", q.qsize())
-
-                # Get the next page token from the response and create a new request object
-                next_page_token = response.get("nextPageToken")
-                if next_page_token:
-                    request = youtube.playlistItems().list(
-                        part="snippet",
-                        playlistId=YOUTUBE_PLAYLIST_ID,
-                        maxResults=MAX_RESULTS,
-                        pageToken=next_page_token,
-                    )
-                else:
-                    request = None
-
-            except googleapiclient.errors.HttpError as e:
-                logger.error("An HTTP error occurred: %s", e)
-                break
+        Path(self.transcript_folder).mkdir(parents=True, exist_ok=True)
+        self.load_status()
+        if self.use_store:
+            self.store = TranscriptStore(store_path(self.transcript_folder))
 
         start_time = time.time()
 
         logger.info("Downloading transcriptions")
-
-        # Using ThreadPoolExecutor to manage threads
-        with ThreadPoolExecutor(max_workers=PROCESSING_THREADS) as executor:
-            futures = [executor.submit(self.process_queue) for _ in range(PROCESSING_THREADS)]
-            for future in as_completed(futures):
-                try:
-                    future.result()  # To catch any exceptions that occurred during processing
-                except Exception as e:
-                    logger.error("An error occurred during processing: %s", e)
+        try:
+            asyncio.run(self.download())
+        finally:
+            if self.store:
+                self.store.close()
 
         finish_time = time.time()
-        logger.debug("Total time taken: %.2f seconds", finish_time - start_time)
+        logger.info(
+            "Downloaded %d, no transcript %d, failed %d, skipped %d in %.2f seconds",
+            self.counts[DOWNLOADED],
+            self.counts[NO_TRANSCRIPT],
+            self.counts[FAILED_RETRYABLE],
+            self.skipped,
+            finish_time - start_time,
+        )
@@ -1,21 +1,43 @@
 import os
+import asyncio
 import logging
+import time
 from pathlib import Path
 import re
-import json
 import tiktoken
-from ollama import Client
+from ollama import AsyncClient
+
+from embedding_cache import EmbeddingCache, DEFAULT_MAX_ENTRIES
+from manifest import Manifest, fingerprint
+from master_file import MasterWriter, count_segments, iter_batches
 
 OLLAMA_EMBEDDING_ENDPOINT = os.getenv("OLLAMA_EMBEDDING_ENDPOINT")
 OLLAMA_EMBEDDING_MODEL = os.getenv("OLLAMA_EMBEDDING_MODEL")
-TRANSCRIPT_MASTER_FILE = "master_transcriptions.json"
+EMBEDDING_CACHE_FILE = "embedding_cache.db"
 
 
 class EMBED_TRANSCRIPTS:
-    def __init__(self: "EMBED_TRANSCRIPTS", folder: str, verbose: bool = False) -> None:
-
-        self.PROCESSING_THREADS = 1
+    def __init__(
+        self: "EMBED_TRANSCRIPTS",
+        folder: str,
+        verbose: bool = False,
+        workers: int = 4,
+        batch_size: int = 32,
+        max_in_flight: int | None = None,
+        use_cache: bool = True,
+        cache_max_entries: int = DEFAULT_MAX_ENTRIES,
+        incremental: bool = False,
+    ) -> None:
+
+        self.PROCESSING_THREADS = workers
+        self.BATCH_SIZE = batch_size
         self.OPENAI_REQUEST_TIMEOUT = 60
+        self.MAX_RETRIES = 5
+        self.RETRY_BASE_DELAY = 1.0
+        self.RETRY_MAX_DELAY = 30.0
+        self.max_in_flight = max_in_flight or workers
+        # Segments read from the master file at a time; bounds memory while keeping every worker busy
+        self.WINDOW_SIZE = batch_size * workers * 4
 
         self.logger = self.setup_logger(verbose)
         self.folder = folder
@@ -23,20 +45,18 @@ class EMBED_TRANSCRIPTS:
 
         self.total_segments = 0
         self.current_segment = 0
-        self.output_segments = []
         self.remote_host = OLLAMA_EMBEDDING_ENDPOINT
         self.model = OLLAMA_EMBEDDING_MODEL
 
-        self.segments = self.load_segments()
-        self.custom_client = Client(host=self.remote_host, timeout=10)
-
-    def load_master(self: "EMBED_TRANSCRIPTS") -> list:
-        """Load segments from the JSON file."""
-        input_file = Path(self.folder) / "output" / TRANSCRIPT_MASTER_FILE
-        with input_file.open("r", encoding="utf-8") as f:
-            segments = json.load(f)
-        self.total_segments = len(segments)
-        return segments
+        self.start_time = 0.0
+        self.incremental = incremental
+        self.manifest = None
+        self.video_ids = set()
+        self.reused_segments = 0
+        self.cache = None
+        self.cache_max_entries = cache_max_entries
+        if use_cache:
+            self.cache = EmbeddingCache(Path(folder) / "output" / EMBEDDING_CACHE_FILE)
 
     def setup_logger(self: "EMBED_TRANSCRIPTS", verbose: bool) -> logging.Logger:
         """Set up the logger with the desired verbosity level."""
@@ -46,23 +66,16 @@ class EMBED_TRANSCRIPTS:
             logger.setLevel(logging.DEBUG)
         return logger
 
-    def load_segments(self: "EMBED_TRANSCRIPTS") -> list:
-        """Load segments from the JSON file."""
-        input_file = Path(self.folder) / "output" / TRANSCRIPT_MASTER_FILE
-        with input_file.open("r", encoding="utf-8") as f:
-            segments = json.load(f)
-        self.total_segments = len(segments)
-        return segments
-
-    def get_text_embedding(self: "EMBED_TRANSCRIPTS", prompt: str) -> list:
-        max_retry = 3
-
-        for i in range(max_retry):
+    async def embed_batch(self: "EMBED_TRANSCRIPTS", client: AsyncClient, texts: list) -> list:
+        """Embed a batch of texts with one /api/embed request, retrying with exponential backoff."""
+        for attempt in range(self.MAX_RETRIES):
             try:
-                embedding_result = self.custom_client.embeddings(model=self.model, prompt=prompt)
-                return embedding_result["embedding"]
+                embedding_result = await client.embed(model=self.model, input=texts)
+                return embedding_result["embeddings"]
             except Exception as e:
-                print(f"Error: {e}")
+                self.logger.warning("Embedding attempt %d failed: %s", attempt + 1, e)
+                if attempt + 1 < self.MAX_RETRIES:
+                    await asyncio.sleep(min(self.RETRY_BASE_DELAY * 2**attempt, self.RETRY_MAX_DELAY))
         return []
 
     def normalize_text(self: "EMBED_TRANSCRIPTS", s: str, sep_token: str = " \n ") -> str:
@@ -75,54 +88,153 @@ class EMBED_TRANSCRIPTS:
         s = s.strip()
         return s
 
-    def process_segment(self: "EMBED_TRANSCRIPTS", segment: dict) -> None:
-        """Process the queue."""
+    def prepare_segment(self: "EMBED_TRANSCRIPTS", segment: dict) -> bool:
+        """Normalize the segment text, returning False if it is too long to embed."""
 
         self.logger.debug(segment["title"])
         text = segment["text"]
 
         if len(self.tokenizer.encode(text)) > 8191:
-            self.output_segments.append(segment.copy())
-            return
-
-        text = self.normalize_text(text)
-        segment["text"] = text
-
-        embedding = self.get_text_embedding(text)
-        if embedding is None:
-            self.output_segments.append(segment.copy())
-            return
-
-        segment["ada_v2"] = embedding.copy()
-        self.output_segments.append(segment.copy())
-
-    def convert_time_to_seconds(self: "EMBED_TRANSCRIPTS", value: str) -> int:
-        """Convert time '00:01:20' to seconds."""
-        time_value = value.split(":")
-        if len(time_value) == 3:
-            h, m, s = time_value
-            return int(h) * 3600 + int(m) * 60 + int(s)
-        return 0
-
-    def save_embeddings(self: "EMBED_TRANSCRIPTS") -> None:
-        """Save the embeddings to a JSON file."""
-        output_file = Path(self.folder) / "output" / TRANSCRIPT_MASTER_FILE
-        with Path(output_file).open("w", encoding="utf-8") as f:
-            json.dump(self.output_segments, f)
+            return False
+
+        segment["text"] = self.normalize_text(text)
+        return True
+
+    async def embedding_worker(
+        self: "EMBED_TRANSCRIPTS", client: AsyncClient, batches: asyncio.Queue, in_flight: asyncio.Semaphore
+    ) -> None:
+        """Take batches of segments off the queue and attach their embeddings."""
+        while True:
+            batch, done = await batches.get()
+            try:
+                async with in_flight:
+                    embeddings = await self.embed_batch(client, [segment["text"] for segment in batch])
+
+                if len(embeddings) != len(batch):
+                    self.logger.error("Embedding failed for a batch of %d segments", len(batch))
+                    continue
+
+                for segment, embedding in zip(batch, embeddings):
+                    segment["ada_v2"] = embedding
+
+                if self.cache:
+                    self.cache.put_many(self.model, [segment["text"] for segment in batch], embeddings)
+
+                self.current_segment += len(batch)
+                elapsed = time.perf_counter() - self.start_time
+                self.logger.info(
+                    "Embedded %d of %d segments (%.1f segments/s)",
+                    self.current_segment,
+                    self.total_segments,
+                    self.current_segment / elapsed,
+                )
+            finally:
+                done.set_result(None)
+                batches.task_done()
+
+    async def queue_uncached(self: "EMBED_TRANSCRIPTS", batch: list, batches: asyncio.Queue) -> asyncio.Future:
+        """Fill embeddings from the cache and queue the remaining segments, returning a future for the batch."""
+        done = asyncio.get_running_loop().create_future()
+
+        if self.cache:
+            cached = self.cache.get_many(self.model, [segment["text"] for segment in batch])
+            for segment, embedding in zip(batch, cached):
+                if embedding is not None:
+                    segment["ada_v2"] = embedding
+            batch = [segment for segment, embedding in zip(batch, cached) if embedding is None]
+
+        if batch:
+            await batches.put((batch, done))
+        else:
+            done.set_result(None)
+        return done
+
+    def embed_fingerprint(self: "EMBED_TRANSCRIPTS", video_id: str) -> str:
+        """Fingerprint of a video's segments and the embedding model"""
+        return fingerprint(self.manifest.get("bucket", video_id), self.model)
+
+    def reuse_embedding(self: "EMBED_TRANSCRIPTS", segment: dict) -> bool:
+        """In incremental mode, keep the previous embedding of a segment whose video has not changed."""
+        if not self.incremental or "ada_v2" not in segment:
+            return False
+        video_id = segment["videoId"]
+        if self.manifest.unchanged("embed", video_id, self.embed_fingerprint(video_id)):
+            return True
+        del segment["ada_v2"]
+        return False
+
+    async def queue_window(self: "EMBED_TRANSCRIPTS", window: list, batches: asyncio.Queue) -> list:
+        """Split a window of segments into embedding batches, returning a future per batch."""
+        done = []
+        batch = []
+        for segment in window:
+            self.video_ids.add(segment["videoId"])
+            if self.reuse_embedding(segment):
+                self.reused_segments += 1
+                continue
+            if not self.prepare_segment(segment):
+                continue
+            batch.append(segment)
+            if len(batch) == self.BATCH_SIZE:
+                done.append(await self.queue_uncached(batch, batches))
+                batch = []
+        if batch:
+            done.append(await self.queue_uncached(batch, batches))
+        return done
+
+    async def embed_master(self: "EMBED_TRANSCRIPTS", writer: MasterWriter) -> None:
+        """Stream the master file through a pool of embedding workers, writing segments back in input order."""
+        client = AsyncClient(host=self.remote_host, timeout=self.OPENAI_REQUEST_TIMEOUT)
+
+        # A bounded queue applies backpressure so reading never runs far ahead of the workers
+        batches = asyncio.Queue(maxsize=self.PROCESSING_THREADS * 2)
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        workers = [
+            asyncio.create_task(self.embedding_worker(client, batches, in_flight))
+            for _ in range(self.PROCESSING_THREADS)
+        ]
+
+        # Windows are written in the order they were read once all of their batches are embedded
+        windows = asyncio.Queue(maxsize=2)
+
+        async def write_windows() -> None:
+            while (item := await windows.get()) is not None:
+                window, done = item
+                await asyncio.gather(*done)
+                writer.write_many(window)
+
+        window_writer = asyncio.create_task(write_windows())
+
+        self.start_time = time.perf_counter()
+        try:
+            for window in iter_batches(self.folder, self.WINDOW_SIZE, with_vectors=self.incremental):
+                await windows.put((window, await self.queue_window(window, batches)))
+            await windows.put(None)
+            await window_writer
+        finally:
+            for worker in [*workers, window_writer]:
+                worker.cancel()
+            await asyncio.gather(*workers, window_writer, return_exceptions=True)
 
     def process_segments(self: "EMBED_TRANSCRIPTS") -> None:
         """Process segments to enrich embeddings."""
 
-        master_segments = self.load_master()
+        # Segments stay in the (videoId, start) order BUCKET_TRANSCRIPTS wrote them in
+        self.total_segments = count_segments(self.folder)
+        self.logger.debug("Total segments to be processed: %s", self.total_segments)
+        self.manifest = Manifest(self.folder)
 
-        self.logger.debug("Total segments to be processed: %s", len(master_segments))
+        with MasterWriter(self.folder, vectors=True) as writer:
+            asyncio.run(self.embed_master(writer))
 
-        for count, segment in enumerate(master_segments, start=1):
-            print(count)
-            self.process_segment(segment)
+        for video_id in self.video_ids:
+            self.manifest.mark("embed", video_id, self.embed_fingerprint(video_id))
+        self.manifest.forget("embed", self.manifest.video_ids("embed") - self.video_ids)
+        self.manifest.save()
+        self.logger.info("Reused %d unchanged embeddings", self.reused_segments)
 
-        # Sort the output segments by videoId and start
-        self.output_segments.sort(key=lambda x: (x["videoId"], self.convert_time_to_seconds(x["start"])))
-        self.logger.debug("Total segments processed: %s", len(self.output_segments))
+        if self.cache:
+            self.logger.info("Embedding cache: %s", self.cache.stats())
+            self.cache.close(self.cache_max_entries)
 
-        self.save_embeddings()
+        self.logger.debug("Total segments processed: %s", writer.count)
@@ -0,0 +1,94 @@
+""" Persistent embedding cache keyed by model name and a hash of the normalized text. """
+
+import argparse
+import hashlib
+import time
+from array import array
+
+from sqlite_cache import SqliteCache
+
+DEFAULT_MAX_ENTRIES = 1_000_000
+
+
+def text_hash(text: str) -> str:
+    """Hash normalized text for use as a cache key."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache(SqliteCache):
+    """SQLite backed embedding store with least-recently-used eviction"""
+
+    TABLE = "embeddings"
+    LAST_USED = "last_used"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS embeddings (
+            model TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (model, text_hash)
+        );
+        CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+    """
+
+    def get_many(self, model: str, texts: list) -> list:
+        """Return the cached embedding (or None) for each text, in order"""
+        hashes = [text_hash(text) for text in texts]
+        found = {}
+        for offset in range(0, len(hashes), 500):
+            chunk = hashes[offset : offset + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.db.execute(
+                f"SELECT text_hash, embedding FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [model, *chunk],
+            )
+            for key, blob in rows:
+                found[key] = array("f", blob).tolist()
+
+        if found:
+            now = time.time()
+            self.db.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                [(now, model, key) for key in found],
+            )
+            self.db.commit()
+
+        results = [found.get(key) for key in hashes]
+        hits = len(results) - results.count(None)
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    def put_many(self, model: str, texts: list, embeddings: list) -> None:
+        """Store embeddings for texts"""
+        now = time.time()
+        self.db.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, embedding, last_used) VALUES (?, ?, ?, ?)",
+            [
+                (model, text_hash(text), array("f", embedding).tobytes(), now)
+                for text, embedding in zip(texts, embeddings)
+            ],
+        )
+        self.db.commit()
+
+    def invalidate(self, model: str) -> int:
+        """Remove every entry for a model, returning the number removed"""
+        removed = self.db.execute("DELETE FROM embeddings WHERE model = ?", (model,)).rowcount
+        self.db.commit()
+        return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or invalidate the embedding cache")
+    parser.add_argument("path", help="Path to the embedding cache database")
+    parser.add_argument("--invalidate", metavar="MODEL", help="Remove all entries for a model")
+    parser.add_argument(
+        "--max-entries", type=int, help="Evict least recently used entries beyond this many, as the embedder does"
+    )
+    args = parser.parse_args()
+
+    cache = EmbeddingCache(args.path)
+    if args.invalidate:
+        print(f"Removed {cache.invalidate(args.invalidate)} entries for {args.invalidate}")
+    print(cache.stats())
+    cache.close(args.max_entries)
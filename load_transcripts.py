@@ -1,18 +1,76 @@
 import os
-from pathlib import Path
 import asyncio
-import json
+import time
+from collections import defaultdict
+from typing import Iterable
 import asyncpg
 
-TRANSCRIPT_MASTER_FILE = "master_transcriptions.json"
+from manifest import Manifest, fingerprint
+from master_file import iter_batches, iter_segments
+from pgvector_codec import register_vector_codec
+
 POSTGRES_CONNECTION_STRING = os.getenv("POSTGRES_CONNECTION_STRING")
+DEFAULT_BATCH_SIZE = 500
+
+# video_catalog holds one row per video; the foreign key is checked once the whole statement has run
+INSERT_COMBINED_QUERY = """
+    WITH upserted_video AS (
+        INSERT INTO public."video_catalog"
+        (videoid, speaker, title, description)
+        VALUES ($8, $6, $7, $9)
+        ON CONFLICT (videoid) DO UPDATE
+        SET speaker = EXCLUDED.speaker, title = EXCLUDED.title, description = EXCLUDED.description
+    )
+    INSERT INTO public."video_embeddings"
+    (videoid, embedding, start, seconds, text, summary)
+    VALUES ($8, $1, $2, $3, $4, $5)
+"""
+
+# Every video of a batch in one statement, before its segments are copied
+UPSERT_CATALOG_QUERY = """
+    INSERT INTO public.video_catalog (videoid, speaker, title, description)
+    SELECT * FROM unnest($1::varchar[], $2::varchar[], $3::varchar[], $4::varchar[])
+    ON CONFLICT (videoid) DO UPDATE
+    SET speaker = EXCLUDED.speaker, title = EXCLUDED.title, description = EXCLUDED.description
+"""
+
+BUMP_CATALOG_VERSION_QUERY = "UPDATE public.catalog_version SET version = version + 1"
+
+# video_embeddings.videoid references video_catalog.videoid, so embeddings are deleted first
+DELETE_EMBEDDINGS_QUERY = "DELETE FROM public.video_embeddings WHERE videoid = ANY($1::varchar[])"
+DELETE_CATALOG_QUERY = "DELETE FROM public.video_catalog WHERE videoid = ANY($1::varchar[])"
+
+# id is filled in by its sequence default
+EMBEDDING_COLUMNS = ["videoid", "embedding", "start", "seconds", "text", "summary"]
+
+
+def segment_outputs(segments: Iterable[dict]) -> tuple[int, int, int]:
+    """Numbers of segments, of segments with an embedding and of segments with a summary"""
+    total = embedded = summarized = 0
+    for segment in segments:
+        total += 1
+        embedded += "ada_v2" in segment or "vector_index" in segment
+        summarized += bool(segment.get("summary"))
+    return total, embedded, summarized
 
 
 class LOAD_TRANSCRIPTS:
-    def __init__(self: "LOAD_TRANSCRIPTS", folder: str) -> None:
+    def __init__(
+        self: "LOAD_TRANSCRIPTS",
+        folder: str,
+        bulk: bool = True,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        incremental: bool = False,
+    ) -> None:
         # Load environment variables for database connection
         self.connection = None
         self.folder = folder
+        self.bulk = bulk
+        self.batch_size = batch_size
+        self.incremental = incremental
+        self.manifest = None
+        # Videos with a row that could not be inserted; they are not recorded as loaded so the next run retries them
+        self.failed_videos = set()
 
     async def connect(self: "LOAD_TRANSCRIPTS") -> bool:
         """Establish a connection to the database."""
@@ -23,58 +81,37 @@ class LOAD_TRANSCRIPTS:
                 print("Connection failed")
                 return False
 
+            await register_vector_codec(self.connection)
+
             print("Connection successful")
             return True
         except Exception as e:
             print(f"An error occurred while connecting to the database: {e}")
             return False
 
-    async def load_data(self: "LOAD_TRANSCRIPTS") -> None:
-        """Load data from JSON file and insert it into the database."""
-        if not await self.connect():
-            return
+    async def bump_catalog_version(self: "LOAD_TRANSCRIPTS") -> None:
+        """Bump the catalog version so query services drop cached search results.
+        Errors propagate: a failure swallowed inside a transaction leaves it aborted, and its COMMIT then rolls back
+        everything loaded in it."""
+        await self.connection.execute(BUMP_CATALOG_VERSION_QUERY)
 
+    async def try_bump_catalog_version(self: "LOAD_TRANSCRIPTS") -> None:
+        """Bump the catalog version outside a transaction, where a failure only delays cache invalidation."""
         try:
-            input_file = Path(self.folder) / "output" / TRANSCRIPT_MASTER_FILE
-            with input_file.open("r", encoding="utf-8") as f:
-                master = json.load(f)
-
-            # SQL query for inserting data
-            insert_query = """
-                INSERT INTO public."video_embeddings" 
-                (embedding, start, seconds, text, summary) 
-                VALUES ($1, $2, $3, $4, $5)
-                RETURNING id
-            """
-
-            insert_video_query = """
-                INSERT INTO public."video_catalog" 
-                (id, speaker, title, videoId, description) 
-                VALUES ($1, $2, $3, $4, $5)
-            """
-
-            insert_combined_query = """
-                WITH inserted_embedding AS (
-                    INSERT INTO public."video_embeddings" 
-                    (embedding, start, seconds, text, summary) 
-                    VALUES ($1, $2, $3, $4, $5)
-                    RETURNING id
-                )
-                INSERT INTO public."video_catalog" 
-                (id, speaker, title, videoId, description) 
-                VALUES (
-                    (SELECT id FROM inserted_embedding), 
-                    $6, $7, $8, $9
-                )
-            """
-
-            # Insert data into the database
-            for r in master:
-                try:
-                    vector_string = "[{}]".format(", ".join(map(str, r["ada_v2"])))
+            await self.bump_catalog_version()
+        except Exception as e:
+            print(f"An error occurred while updating the catalog version: {e}")
+
+    async def insert_rows(self: "LOAD_TRANSCRIPTS", rows: Iterable[dict]) -> int:
+        """Insert rows one at a time, reporting each row that fails. Returns the number inserted.
+        Each row has its own transaction, a savepoint inside an enclosing one, so a failure only undoes that row."""
+        inserted = 0
+        for r in rows:
+            try:
+                async with self.connection.transaction():
                     await self.connection.execute(
-                        insert_combined_query,
-                        vector_string,
+                        INSERT_COMBINED_QUERY,
+                        r["ada_v2"],
                         r["start"],
                         r["seconds"],
                         r["text"],
@@ -84,29 +121,138 @@ class LOAD_TRANSCRIPTS:
                         r["videoId"],
                         r["description"],
                     )
-                    
-                    # vector_string = "[{}]".format(", ".join(map(str, r["ada_v2"])))
-                    # id = await self.connection.fetchval(
-                    #     insert_query,
-                    #     vector_string,
-                    #     r["start"],
-                    #     r["seconds"],
-                    #     r["text"],
-                    #     r["summary"],
-                    # )
-                    # print(f"Inserted data with ID: {id}")
-
-                    # await self.connection.execute(
-                    #     insert_video_query,
-                    #     id,
-                    #     r["speaker"],
-                    #     r["title"],
-                    #     r["videoId"],
-                    #     r["description"],
-                    # )
-
-                except Exception:
-                    print(f"An error occurred while inserting data: {r['summary']}")
+                inserted += 1
+            except Exception as e:
+                print(f"An error occurred while inserting data: {r.get('summary')} ({e!r})")
+                self.failed_videos.add(r.get("videoId"))
+        return inserted
+
+    async def load_batch(self: "LOAD_TRANSCRIPTS", rows: list) -> int:
+        """COPY a batch, falling back to row-by-row inserts if it fails. Returns the number of rows inserted."""
+        try:
+            await self.copy_batch(rows)
+            return len(rows)
+        except Exception as e:
+            print(f"Batch of {len(rows)} rows failed, retrying row by row: {e!r}")
+            return await self.insert_rows(rows)
+
+    async def copy_batch(self: "LOAD_TRANSCRIPTS", rows: list) -> None:
+        """Upsert the batch's videos into video_catalog and COPY its rows into video_embeddings in one transaction."""
+        videos = list({r["videoId"]: r for r in rows}.values())
+        async with self.connection.transaction():
+            await self.connection.execute(
+                UPSERT_CATALOG_QUERY,
+                [v["videoId"] for v in videos],
+                [v["speaker"] for v in videos],
+                [v["title"] for v in videos],
+                [v["description"] for v in videos],
+            )
+            await self.connection.copy_records_to_table(
+                "video_embeddings",
+                schema_name="public",
+                columns=EMBEDDING_COLUMNS,
+                records=[(r["videoId"], r["ada_v2"], r["start"], r["seconds"], r["text"], r["summary"]) for r in rows],
+            )
+
+    async def bulk_load(self: "LOAD_TRANSCRIPTS") -> tuple[int, int]:
+        """Stream the master file in batches, falling back to row-by-row inserts for a batch that fails.
+        Returns the number of rows inserted and read."""
+        inserted = 0
+        offset = 0
+        for batch in iter_batches(self.folder, self.batch_size, with_vectors=True):
+            inserted += await self.load_batch(batch)
+            offset += len(batch)
+        return inserted, offset
+
+    def load_fingerprint(self: "LOAD_TRANSCRIPTS", video_id: str, outputs: tuple) -> str:
+        """Fingerprint of the embeddings and summaries loaded for a video.
+        The embed and summarize entries are recorded even when some segments failed, so outputs, the video's
+        segment_outputs, makes a later successful retry change the fingerprint."""
+        return fingerprint(self.manifest.get("embed", video_id), self.manifest.get("summarize", video_id), *outputs)
+
+    def master_outputs(self: "LOAD_TRANSCRIPTS") -> dict:
+        """segment_outputs of every video in the master file"""
+        counts = defaultdict(lambda: [0, 0, 0])
+        for segment in iter_segments(self.folder):
+            for i, count in enumerate(segment_outputs([segment])):
+                counts[segment["videoId"]][i] += count
+        return {video_id: tuple(video_counts) for video_id, video_counts in counts.items()}
+
+    def mark_loaded(self: "LOAD_TRANSCRIPTS", outputs: dict, removed: set) -> None:
+        """Record the videos now in the database in the manifest, except those with rows that failed."""
+        for video_id, video_outputs in outputs.items():
+            if video_id not in self.failed_videos:
+                self.manifest.mark("load", video_id, self.load_fingerprint(video_id, video_outputs))
+        self.manifest.forget("load", removed)
+        self.manifest.save()
+
+    async def incremental_load(self: "LOAD_TRANSCRIPTS") -> tuple[int, int]:
+        """Replace the rows of new and changed videos and delete removed videos in one transaction.
+        Returns the number of rows inserted and the number of videos changed or removed."""
+        current = self.manifest.video_ids("bucket")
+        outputs = self.master_outputs()
+        changed = {
+            video_id
+            for video_id in current
+            if not self.manifest.unchanged("load", video_id, self.load_fingerprint(video_id, outputs.get(video_id, ())))
+        }
+        removed = self.manifest.video_ids("load") - current
+        print(f"{len(changed)} new or changed videos, {len(removed)} removed videos")
+        if not changed and not removed:
+            return 0, 0
+
+        inserted = 0
+        async with self.connection.transaction():
+            affected = sorted(changed | removed)
+            await self.connection.execute(DELETE_EMBEDDINGS_QUERY, affected)
+            await self.connection.execute(DELETE_CATALOG_QUERY, affected)
+
+            for batch in iter_batches(self.folder, self.batch_size, with_vectors=True):
+                rows = [r for r in batch if r["videoId"] in changed]
+                if rows:
+                    # copy_batch's transaction is a savepoint here, so a failed COPY leaves the deletes in place
+                    inserted += await self.load_batch(rows)
+
+            # raises on failure, so the transaction rolls back and nothing is recorded as loaded
+            await self.bump_catalog_version()
+
+        if self.failed_videos:
+            print(f"{len(self.failed_videos)} videos had rows that failed and will be retried on the next run")
+        self.mark_loaded({video_id: outputs.get(video_id, ()) for video_id in changed}, removed)
+        return inserted, len(changed) + len(removed)
+
+    async def load_data(self: "LOAD_TRANSCRIPTS") -> None:
+        """Load data from the master file and insert it into the database."""
+        if not await self.connect():
+            return
+
+        try:
+            start_time = time.perf_counter()
+            self.manifest = Manifest(self.folder)
+
+            if self.incremental:
+                inserted, videos = await self.incremental_load()
+                elapsed = time.perf_counter() - start_time
+                print(f"Inserted {inserted} rows for {videos} videos in {elapsed:.2f}s")
+                return
+
+            if self.bulk:
+                inserted, total = await self.bulk_load()
+            else:
+                segments = list(iter_segments(self.folder, with_vectors=True))
+                inserted, total = await self.insert_rows(segments), len(segments)
+            # once per load: every bump makes the query services drop their cached results
+            await self.try_bump_catalog_version()
+
+            current = self.manifest.video_ids("bucket")
+            outputs = self.master_outputs()
+            self.mark_loaded(
+                {video_id: outputs.get(video_id, ()) for video_id in current}, self.manifest.video_ids("load") - current
+            )
+
+            elapsed = time.perf_counter() - start_time
+            rate = inserted / elapsed if elapsed > 0 else 0
+            print(f"Inserted {inserted} of {total} rows in {elapsed:.2f}s ({rate:.0f} rows/s)")
 
         except Exception as e:
             print(f"An error occurred while loading data: {e}")
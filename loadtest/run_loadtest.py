@@ -0,0 +1,231 @@
+""" Replay PromptRequest payloads against query_service and report throughput, latency percentiles and errors.
+
+    python -m loadtest.run_loadtest --url http://localhost:8000 --concurrency 32 --duration 60
+    python -m loadtest.run_loadtest --url http://localhost:8000 --rate 200 --duration 60 --output report.json
+    python -m loadtest.run_loadtest --url http://localhost:8000 --concurrency 32 --baseline report.json
+
+--concurrency runs a closed loop: each worker sends its next request when the previous one returns.
+--rate runs an open loop: requests start on a fixed schedule whether or not earlier ones have finished, and latency
+is measured from the scheduled start so a stalled service is not hidden by the generator slowing down.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+from loadtest.vectors import UNIQUE_MARKER
+
+DEFAULT_PROMPTS = "loadtest/prompts.jsonl"
+
+
+class Recorder:
+    """Latencies of successful requests and counts of failures by cause"""
+
+    def __init__(self) -> None:
+        self.latencies = []
+        self.errors = Counter()
+        self.start = 0.0
+        self.end = 0.0
+
+    def success(self, seconds: float) -> None:
+        self.latencies.append(seconds)
+
+    def failure(self, cause: str) -> None:
+        self.errors[cause] += 1
+
+    def report(self) -> dict:
+        latencies = sorted(self.latencies)
+        duration = self.end - self.start
+        total = len(latencies) + sum(self.errors.values())
+
+        def percentile(p: float) -> float:
+            # nearest-rank percentile in milliseconds
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, max(0, int(round(p / 100 * len(latencies))) - 1))] * 1000
+
+        return {
+            "requests": total,
+            "succeeded": len(latencies),
+            "errors": dict(self.errors),
+            "error_rate": sum(self.errors.values()) / total if total else 0.0,
+            "duration_s": duration,
+            "qps": len(latencies) / duration if duration > 0 else 0.0,
+            "latency_ms": {
+                "p50": percentile(50),
+                "p95": percentile(95),
+                "p99": percentile(99),
+                "max": latencies[-1] * 1000 if latencies else 0.0,
+                "mean": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+            },
+        }
+
+
+def load_payloads(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def payload_stream(payloads: list, unique: bool) -> object:
+    """Endless payloads, optionally made unique to bypass result caches"""
+    counter = itertools.count()
+    for payload in itertools.cycle(payloads):
+        if unique:
+            payload = {**payload, "prompt": f"{payload['prompt']}{UNIQUE_MARKER}{next(counter)}"}
+        yield payload
+
+
+def batched(payloads: object, batch_size: int) -> object:
+    """Endless lists of batch_size payloads for /get-videos/batch"""
+    while True:
+        yield [next(payloads) for _ in range(batch_size)]
+
+
+async def send(client: httpx.AsyncClient, path: str, payload: object, recorder: Recorder, started: float) -> None:
+    try:
+        response = await client.post(path, json=payload)
+    except httpx.TimeoutException:
+        recorder.failure("timeout")
+        return
+    except httpx.HTTPError as e:
+        recorder.failure(type(e).__name__)
+        return
+    if response.status_code == 200:
+        recorder.success(time.perf_counter() - started)
+    else:
+        recorder.failure(f"HTTP {response.status_code}")
+
+
+async def closed_loop(
+    client: httpx.AsyncClient, path: str, payloads: object, args: argparse.Namespace, recorder: Recorder
+) -> None:
+    deadline = time.perf_counter() + args.duration
+    remaining = itertools.count(args.requests, -1) if args.requests else itertools.repeat(1)
+
+    async def worker() -> None:
+        while time.perf_counter() < deadline and next(remaining) > 0:
+            started = time.perf_counter()
+            await send(client, path, next(payloads), recorder, started)
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+
+async def open_loop(
+    client: httpx.AsyncClient, path: str, payloads: object, args: argparse.Namespace, recorder: Recorder
+) -> None:
+    interval = 1.0 / args.rate
+    total = args.requests or int(args.duration * args.rate)
+    in_flight = set()
+    start = time.perf_counter()
+
+    for index in range(total):
+        scheduled = start + index * interval
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(in_flight) >= args.max_in_flight:
+            # the service has fallen this far behind; count the request instead of queueing without bound
+            recorder.failure("dropped (max in flight)")
+            continue
+        task = asyncio.create_task(send(client, path, next(payloads), recorder, scheduled))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    await asyncio.gather(*in_flight)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    payloads = payload_stream(load_payloads(args.prompts), args.unique)
+    path = "/get-videos/"
+    if args.batch_size > 1:
+        payloads = batched(payloads, args.batch_size)
+        path = "/get-videos/batch"
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        if args.warmup:
+            warmup = Recorder()
+            await asyncio.gather(
+                *(send(client, path, next(payloads), warmup, time.perf_counter()) for _ in range(args.warmup))
+            )
+
+        recorder = Recorder()
+        recorder.start = time.perf_counter()
+        if args.rate:
+            await open_loop(client, path, payloads, args, recorder)
+        else:
+            await closed_loop(client, path, payloads, args, recorder)
+        recorder.end = time.perf_counter()
+
+    report = recorder.report()
+    report["config"] = {
+        "url": args.url,
+        "mode": f"open loop at {args.rate}/s" if args.rate else f"closed loop x{args.concurrency}",
+        "batch_size": args.batch_size,
+        "unique": args.unique,
+    }
+    return report
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions beyond tolerance (a fraction) against a baseline report"""
+    regressions = []
+    if report["qps"] < baseline["qps"] * (1 - tolerance):
+        regressions.append(f"qps {report['qps']:.1f} < baseline {baseline['qps']:.1f}")
+    for key in ("p50", "p95", "p99"):
+        current, previous = report["latency_ms"][key], baseline["latency_ms"][key]
+        if current > previous * (1 + tolerance):
+            regressions.append(f"{key} {current:.1f}ms > baseline {previous:.1f}ms")
+    if report["error_rate"] > baseline["error_rate"] + 0.01:
+        regressions.append(f"error rate {report['error_rate']:.2%} > baseline {baseline['error_rate']:.2%}")
+    return regressions
+
+
+def print_report(report: dict) -> None:
+    latency = report["latency_ms"]
+    print(f"{report['config']['mode']}, batch size {report['config']['batch_size']}")
+    print(f"{report['requests']} requests in {report['duration_s']:.1f}s, {report['qps']:.1f} successful req/s")
+    print(
+        f"latency ms: p50 {latency['p50']:.1f}  p95 {latency['p95']:.1f}  p99 {latency['p99']:.1f}  "
+        f"max {latency['max']:.1f}  mean {latency['mean']:.1f}"
+    )
+    print(f"errors: {report['error_rate']:.2%} {report['errors'] or ''}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000", help="query_service base URL")
+    parser.add_argument("--prompts", default=DEFAULT_PROMPTS, help="JSONL file of PromptRequest payloads")
+    parser.add_argument("--concurrency", type=int, default=16, help="Closed loop workers")
+    parser.add_argument("--rate", type=float, help="Open loop requests per second (overrides --concurrency)")
+    parser.add_argument("--max-in-flight", type=int, default=10000, help="Open loop: drop requests beyond this")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    parser.add_argument("--requests", type=int, help="Stop after this many requests instead")
+    parser.add_argument("--warmup", type=int, default=0, help="Requests sent before measuring")
+    parser.add_argument("--batch-size", type=int, default=1, help="Prompts per request; >1 uses /get-videos/batch")
+    parser.add_argument("--unique", action="store_true", help="Make every prompt unique to bypass result caches")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds")
+    parser.add_argument("--output", help="Write the report as JSON")
+    parser.add_argument("--baseline", help="Exit non-zero if the report regresses against this JSON report")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression against the baseline")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,64 @@
+""" Stand-in for Ollama's /api/embed that returns deterministic vectors after a configurable delay.
+
+    python -m loadtest.stub_embedding_server --port 11435 --latency-ms 20 --jitter-ms 5
+
+then point query_service at it with OLLAMA_EMBEDDING_ENDPOINT=http://localhost:11435/api/embed
+"""
+
+import argparse
+import asyncio
+import random
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+from loadtest.vectors import DIMENSIONS, text_vector
+
+
+class EmbedRequest(BaseModel):
+    model: str = ""
+    input: str | list[str]
+
+
+class StubSettings:
+    latency_ms = 0.0
+    jitter_ms = 0.0
+    error_rate = 0.0
+    dimensions = DIMENSIONS
+
+
+settings = StubSettings()
+app = FastAPI()
+
+
+@app.post("/api/embed")
+async def embed(request: EmbedRequest) -> dict:
+    delay = settings.latency_ms + random.uniform(-settings.jitter_ms, settings.jitter_ms)
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+    if random.random() < settings.error_rate:
+        raise HTTPException(status_code=503, detail="Injected failure")
+
+    texts = [request.input] if isinstance(request.input, str) else request.input
+    return {
+        "model": request.model,
+        "embeddings": [text_vector(text, settings.dimensions).tolist() for text in texts],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay added to every request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Uniform +/- variation of the delay")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 503")
+    parser.add_argument("--dimensions", type=int, default=DIMENSIONS)
+    args = parser.parse_args()
+
+    settings.latency_ms = args.latency_ms
+    settings.jitter_ms = args.jitter_ms
+    settings.error_rate = args.error_rate
+    settings.dimensions = args.dimensions
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,142 @@
+""" Stand-in for the YouTube Data API playlistItems endpoint and a transcript endpoint, with configurable
+throttling and failures for exercising download_transcripts.
+
+    python -m loadtest.stub_transcript_server --port 11436 --videos 500 --max-in-flight 8 --error-rate 0.02
+
+then point the downloader at it with
+YOUTUBE_API_BASE_URL=http://localhost:11436/youtube/v3 and TRANSCRIPT_API_BASE_URL=http://localhost:11436/transcripts
+
+GET /transcripts/{video_id} follows the protocol of download_transcripts.HttpTranscriptFetcher: a JSON list of
+{"text", "start", "duration"} captions, 404 when the video has no transcript, 429 with Retry-After when more than
+max_in_flight requests are running, and 503 for injected failures.
+"""
+
+import argparse
+import asyncio
+import random
+from collections import Counter
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+
+
+class StubSettings:
+    videos = 120
+    latency_ms = 0.0
+    jitter_ms = 0.0
+    # every Nth video has no transcript, 0 for none
+    no_transcript_every = 10
+    # concurrent transcript requests beyond this many are answered with a 429, 0 for no limit
+    max_in_flight = 0
+    retry_after = 0.0
+    error_rate = 0.0
+    # videos whose transcript requests always fail with a 503
+    failing = frozenset()
+
+
+class StubStats:
+    def __init__(self) -> None:
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.throttled = 0
+        self.errors = 0
+        self.requests = Counter()
+
+
+settings = StubSettings()
+stats = StubStats()
+app = FastAPI()
+
+
+def video_id(index: int) -> str:
+    return f"video{index:05d}"
+
+
+def has_transcript(index: int) -> bool:
+    return not settings.no_transcript_every or (index + 1) % settings.no_transcript_every != 0
+
+
+def reset(**overrides: object) -> None:
+    """Restore the default settings, apply overrides and clear the stats"""
+    global settings, stats
+    settings = StubSettings()
+    for name, value in overrides.items():
+        if not hasattr(settings, name):
+            raise AttributeError(f"Unknown stub setting {name}")
+        setattr(settings, name, value)
+    stats = StubStats()
+
+
+@app.get("/youtube/v3/playlistItems")
+async def playlist_items(maxResults: int = 50, pageToken: str = "") -> dict:  # noqa: N803
+    start = int(pageToken or 0)
+    end = min(start + maxResults, settings.videos)
+    page = {
+        "items": [
+            {
+                "snippet": {
+                    "title": f"Video {index}",
+                    "description": f"Description of video {index}",
+                    "resourceId": {"videoId": video_id(index)},
+                }
+            }
+            for index in range(start, end)
+        ]
+    }
+    if end < settings.videos:
+        page["nextPageToken"] = str(end)
+    return page
+
+
+@app.get("/transcripts/{requested_id}")
+async def transcript(requested_id: str) -> list:
+    stats.requests[requested_id] += 1
+    stats.in_flight += 1
+    stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+    try:
+        if settings.max_in_flight and stats.in_flight > settings.max_in_flight:
+            stats.throttled += 1
+            raise HTTPException(status_code=429, headers={"Retry-After": str(settings.retry_after)})
+
+        delay = settings.latency_ms + random.uniform(-settings.jitter_ms, settings.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+        if requested_id in settings.failing or random.random() < settings.error_rate:
+            stats.errors += 1
+            raise HTTPException(status_code=503, detail="Injected failure")
+
+        index = int(requested_id.removeprefix("video"))
+        if index >= settings.videos or not has_transcript(index):
+            raise HTTPException(status_code=404, detail="No transcript")
+        return [
+            {"text": f"Caption {caption} of {requested_id}\nsecond line", "start": caption * 4.0, "duration": 4.0}
+            for caption in range(20)
+        ]
+    finally:
+        stats.in_flight -= 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11436)
+    parser.add_argument("--videos", type=int, default=StubSettings.videos, help="Number of videos in the playlist")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay added to every transcript request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Uniform +/- variation of the delay")
+    parser.add_argument("--no-transcript-every", type=int, default=StubSettings.no_transcript_every)
+    parser.add_argument("--max-in-flight", type=int, default=0, help="Answer 429 beyond this many concurrent requests")
+    parser.add_argument("--retry-after", type=float, default=0.0, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 503")
+    args = parser.parse_args()
+
+    reset(
+        videos=args.videos,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        no_transcript_every=args.no_transcript_every,
+        max_in_flight=args.max_in_flight,
+        retry_after=args.retry_after,
+        error_rate=args.error_rate,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,26 @@
+""" Deterministic embeddings shared by the stub embedding server and the database seeder. """
+
+import hashlib
+
+import numpy as np
+
+DIMENSIONS = 768
+
+# Anything after UNIQUE_MARKER is ignored, so the load generator can make prompts unique to bypass
+# query_service's caches while they still embed close to the rows seeded for them
+UNIQUE_MARKER = " #"
+
+
+def text_vector(text: str, dimensions: int = DIMENSIONS) -> np.ndarray:
+    """Unit-length float32 vector seeded from a hash of the text"""
+    base = text.split(UNIQUE_MARKER, 1)[0]
+    seed = int.from_bytes(hashlib.sha256(base.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def near_vector(vector: np.ndarray, noise: float, rng: np.random.Generator) -> np.ndarray:
+    """Unit-length vector a cosine distance of roughly noise**2 / 2 from vector"""
+    offset = rng.standard_normal(len(vector)).astype(np.float32) * (noise / np.sqrt(len(vector)))
+    result = vector + offset
+    return result / np.linalg.norm(result)
@@ -1,34 +1,6 @@
-import os
-from pathlib import Path
-from dotenv import load_dotenv
+""" Run the transcript pipeline. See pipeline.py, or python main.py --help, for stage selection and options. """
 
-from download_transcripts import DOWNLOAD_TRANSCRIPT
-from bucket_transcripts import BUCKET_TRANSCRIPTS
-from embed_transcripts import EMBED_TRANSCRIPTS
-from summarize_transcripts import SUMMARIZE_TRANSCRIPTS
-from load_transcripts import LOAD_TRANSCRIPTS
+from pipeline import main
 
-# Load environment variables from .env file
-load_dotenv()
-
-TRANSCRIPT_FOLDER = os.environ["TRANSCRIPT_FOLDER"]
-
-
-# does the transcript folder exist?
-if not Path(TRANSCRIPT_FOLDER).exists():
-    Path(TRANSCRIPT_FOLDER).mkdir()
-
-dl = DOWNLOAD_TRANSCRIPT(TRANSCRIPT_FOLDER)
-# dl.start_download()
-
-bt = BUCKET_TRANSCRIPTS(TRANSCRIPT_FOLDER, 5)
-# bt.process_transcripts()
-
-embedded_transcripts = EMBED_TRANSCRIPTS(folder=TRANSCRIPT_FOLDER, verbose=False)
-# embedded_transcripts.process_segments()
-
-summarize_transcripts = SUMMARIZE_TRANSCRIPTS(folder=TRANSCRIPT_FOLDER)
-# summarize_transcripts.summarize_text()
-
-loader = LOAD_TRANSCRIPTS(folder=TRANSCRIPT_FOLDER)
-loader.start_load()
+if __name__ == "__main__":
+    main()
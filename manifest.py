@@ -0,0 +1,73 @@
+""" Per-video fingerprints recording what each pipeline stage last produced, for incremental runs. """
+
+import hashlib
+import json
+from pathlib import Path
+
+MANIFEST_FILE = "manifest.json"
+
+STAGES = ("bucket", "embed", "summarize", "load")
+
+
+def fingerprint(*parts: object) -> str:
+    """Hash the parts (strings, numbers or other fingerprints) that determine a stage's output for a video"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def source_hash(folder: str, video_id: str) -> str:
+    """Hash a video's metadata and transcript files as downloaded"""
+    digest = hashlib.sha256()
+    for suffix in (".json", ".json.vtt"):
+        path = Path(folder) / (video_id + suffix)
+        digest.update(path.read_bytes() if path.exists() else b"")
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class Manifest:
+    """JSON file mapping videoId -> stage -> fingerprint of the inputs that stage last completed with.
+
+    A stage compares the fingerprint it would produce for a video against the recorded one and skips the video
+    when they match. Each stage's fingerprint includes the previous stage's, so a change upstream (a new
+    transcript, different bucketing parameters, another model) invalidates every later stage for that video.
+    """
+
+    def __init__(self, folder: str) -> None:
+        """load the manifest for a transcript folder, starting empty if there is none"""
+        self.path = Path(folder) / "output" / MANIFEST_FILE
+        self.videos = {}
+        if self.path.exists():
+            with self.path.open("r", encoding="utf-8") as f:
+                self.videos = json.load(f)
+
+    def get(self, stage: str, video_id: str) -> str | None:
+        """Fingerprint the stage last completed with for a video"""
+        return self.videos.get(video_id, {}).get(stage)
+
+    def unchanged(self, stage: str, video_id: str, value: str) -> bool:
+        """True if the stage already completed for the video with this fingerprint"""
+        return self.get(stage, video_id) == value
+
+    def mark(self, stage: str, video_id: str, value: str) -> None:
+        """Record the fingerprint a stage completed with for a video"""
+        self.videos.setdefault(video_id, {})[stage] = value
+
+    def forget(self, stage: str, video_ids: set) -> None:
+        """Drop a stage's fingerprint for videos, removing videos that have no stage left"""
+        for video_id in video_ids:
+            entry = self.videos.get(video_id, {})
+            entry.pop(stage, None)
+            if not entry:
+                self.videos.pop(video_id, None)
+
+    def video_ids(self, stage: str) -> set:
+        """Videos with a recorded fingerprint for a stage"""
+        return {video_id for video_id, entry in self.videos.items() if stage in entry}
+
+    def save(self) -> None:
+        """Write the manifest, replacing the previous one atomically"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        partial = self.path.with_name(self.path.name + ".partial")
+        with partial.open("w", encoding="utf-8") as f:
+            json.dump(self.videos, f, indent=1, sort_keys=True)
+        partial.replace(self.path)
@@ -0,0 +1,261 @@
+""" Streaming reader and writer for the master transcription file shared by every pipeline stage. """
+
+import json
+import logging
+import os
+import uuid
+from itertools import groupby, islice
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TRANSCRIPT_MASTER_FILE = "master_transcriptions.jsonl"
+LEGACY_MASTER_FILE = "master_transcriptions.json"
+VECTOR_FILE = "master_embeddings.npy"
+PARTIAL_SUFFIX = ".partial"
+
+# Fixed size .npy header so the row count can be patched in place once all vectors are written
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+NPY_HEADER_SIZE = 128
+
+# The master file's first line and the last bytes of the sidecar carry the same generation, so a master file
+# is never read against a sidecar from another run (the two are renamed into place one after the other)
+GENERATION_KEY = "master_generation"
+GENERATION_PREFIX = b'{"' + GENERATION_KEY.encode() + b'"'
+GENERATION_BYTES = 16
+
+
+def master_path(folder: str) -> Path:
+    """Path of the master transcription file for a transcript folder"""
+    return Path(folder) / "output" / TRANSCRIPT_MASTER_FILE
+
+
+def partial_path(folder: str) -> Path:
+    """Path the master file is written to until the writing stage completes"""
+    path = master_path(folder)
+    return path.with_name(path.name + PARTIAL_SUFFIX)
+
+
+def vector_path(folder: str) -> Path:
+    """Path of the float32 embedding sidecar for a transcript folder"""
+    return Path(folder) / "output" / VECTOR_FILE
+
+
+def vector_generation(path: Path) -> str | None:
+    """Generation written after the vectors of a sidecar, or None for a sidecar without one"""
+    if not path.exists():
+        return None
+    with path.open("rb") as f:
+        np.lib.format.read_magic(f)
+        shape, _, _ = np.lib.format.read_array_header_1_0(f)
+        end = f.tell() + int(np.prod(shape)) * 4
+        f.seek(end)
+        trailer = f.read(GENERATION_BYTES + 1)
+    return trailer.hex() if len(trailer) == GENERATION_BYTES else None
+
+
+def master_generation(folder: str) -> str | None:
+    """Generation recorded on the first line of the master file, or None for a master file without one"""
+    path = master_path(folder)
+    if not path.exists():
+        return None
+    with path.open("rb") as f:
+        line = f.readline()
+    return json.loads(line)[GENERATION_KEY] if line.startswith(GENERATION_PREFIX) else None
+
+
+def load_vectors(folder: str) -> np.ndarray:
+    """Memory-map the embedding sidecar as a read-only (segments, dimensions) float32 array"""
+    path = vector_path(folder)
+    if not path.exists():
+        return np.zeros((0, 0), dtype=np.float32)
+    with path.open("rb") as f:
+        np.lib.format.read_magic(f)
+        shape, _, _ = np.lib.format.read_array_header_1_0(f)
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=np.float32)
+    return np.load(path, mmap_mode="r")
+
+
+def read_segments(folder: str) -> Iterator[dict]:
+    """Yield segments as stored in the master file, falling back to the legacy JSON file"""
+    path = master_path(folder)
+
+    if not path.exists():
+        legacy = path.with_name(LEGACY_MASTER_FILE)
+        logger.warning("Reading legacy master file %s", legacy)
+        with legacy.open("r", encoding="utf-8") as f:
+            yield from json.load(f)
+        return
+
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                segment = json.loads(line)
+                if GENERATION_KEY not in segment:
+                    yield segment
+
+
+def iter_segments(folder: str, with_vectors: bool = False) -> Iterator[dict]:
+    """Yield segments one at a time from the master file.
+
+    With with_vectors=True, each embedded segment's ada_v2 is a zero-copy view into the memory-mapped sidecar.
+    """
+    if not with_vectors:
+        yield from read_segments(folder)
+        return
+
+    expected = master_generation(folder)
+    if expected is not None and vector_generation(vector_path(folder)) != expected:
+        raise ValueError(
+            f"{vector_path(folder)} was not written with {master_path(folder)}; rerun the embed stage to rebuild both"
+        )
+    vectors = load_vectors(folder)
+    for segment in read_segments(folder):
+        if "vector_index" in segment:
+            segment["ada_v2"] = vectors[segment["vector_index"]]
+        yield segment
+
+
+def iter_batches(folder: str, batch_size: int, with_vectors: bool = False) -> Iterator[list]:
+    """Yield lists of up to batch_size segments from the master file"""
+    segments = iter_segments(folder, with_vectors=with_vectors)
+    while batch := list(islice(segments, batch_size)):
+        yield batch
+
+
+def count_segments(folder: str) -> int:
+    """Count segments in the master file without parsing them"""
+    path = master_path(folder)
+    if not path.exists():
+        return sum(1 for _ in iter_segments(folder))
+    with path.open("rb") as f:
+        return sum(1 for line in f if line.strip() and not line.startswith(GENERATION_PREFIX))
+
+
+class VideoCursor:
+    """Walks segments grouped by videoId in ascending order, handing back each requested video's segments"""
+
+    def __init__(self, segments: Iterator[dict]) -> None:
+        self.videos = groupby(segments, key=lambda segment: segment["videoId"])
+        self.current = next(self.videos, None)
+
+    def take(self, video_id: str) -> list:
+        """Return the segments for video_id, skipping earlier videos; ids must be requested in ascending order"""
+        while self.current is not None and self.current[0] < video_id:
+            self.current = next(self.videos, None)
+        if self.current is None or self.current[0] != video_id:
+            return []
+        segments = list(self.current[1])
+        self.current = next(self.videos, None)
+        return segments
+
+
+class VectorWriter:
+    """Append-only writer for a float32 .npy file whose row count is only known when it is closed"""
+
+    def __init__(self, path: Path) -> None:
+        """open the file and reserve space for the header"""
+        self.path = path
+        self.file = path.open("wb")
+        self.file.write(self.header(0, 0))
+        self.rows = 0
+        self.dimensions = 0
+
+    @staticmethod
+    def header(rows: int, dimensions: int) -> bytes:
+        """.npy version 1.0 header padded to NPY_HEADER_SIZE bytes"""
+        descr = repr({"descr": "<f4", "fortran_order": False, "shape": (rows, dimensions)})
+        length = NPY_HEADER_SIZE - len(NPY_MAGIC) - 2
+        return NPY_MAGIC + length.to_bytes(2, "little") + descr.ljust(length - 1).encode("latin1") + b"\n"
+
+    def write(self, vector: object) -> int:
+        """append a vector, returning its row index"""
+        row = np.asarray(vector, dtype="<f4")
+        if self.rows == 0:
+            self.dimensions = len(row)
+        elif len(row) != self.dimensions:
+            raise ValueError(f"Expected a {self.dimensions} dimension vector, got {len(row)}")
+        self.file.write(row.tobytes())
+        self.rows += 1
+        return self.rows - 1
+
+    def close(self, generation: str) -> None:
+        """append the generation, write the final shape into the header and close the file once it is on disk"""
+        self.file.write(bytes.fromhex(generation))
+        self.file.seek(0)
+        self.file.write(self.header(self.rows, self.dimensions))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+
+class MasterWriter:
+    """Append-only writer for the master file.
+
+    Segments go to a .partial file that replaces the master file when the writer is closed without error,
+    so a stage can read the previous master while writing its own. With vectors=True, ada_v2 embeddings are
+    moved out of the JSON into the float32 sidecar and each segment records its vector_index instead, and both
+    files get a new generation; otherwise the segments keep their vector_index and the existing sidecar's generation.
+    """
+
+    def __init__(self, folder: str, vectors: bool = False) -> None:
+        """open the partial master file (and vector sidecar) for writing"""
+        self.path = master_path(folder)
+        self.partial = partial_path(folder)
+        self.partial.parent.mkdir(parents=True, exist_ok=True)
+        self.file = self.partial.open("w", encoding="utf-8")
+        self.count = 0
+
+        self.vector_path = vector_path(folder)
+        self.vectors = None
+        if vectors:
+            self.vectors = VectorWriter(self.vector_path.with_name(self.vector_path.name + PARTIAL_SUFFIX))
+            self.generation = uuid.uuid4().hex
+        else:
+            self.generation = vector_generation(self.vector_path)
+        if self.generation is not None:
+            self.file.write(json.dumps({GENERATION_KEY: self.generation}) + "\n")
+
+    def write(self, segment: dict) -> None:
+        """append one segment"""
+        if self.vectors:
+            vector = segment.get("ada_v2")
+            segment = {key: value for key, value in segment.items() if key not in ("ada_v2", "vector_index")}
+            if vector is not None:
+                segment["vector_index"] = self.vectors.write(vector)
+        self.file.write(json.dumps(segment, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def write_many(self, segments: list) -> None:
+        """append segments and flush them"""
+        for segment in segments:
+            self.write(segment)
+        self.file.flush()
+
+    def close(self, commit: bool = True) -> None:
+        """close the file, replacing the master file when commit is True and discarding it otherwise"""
+        # both files are on disk before either is renamed, so a crash cannot commit one without the other's data
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        if self.vectors:
+            self.vectors.close(self.generation)
+            if commit:
+                self.vectors.path.replace(self.vector_path)
+            else:
+                self.vectors.path.unlink(missing_ok=True)
+
+        if commit:
+            self.partial.replace(self.path)
+        else:
+            self.partial.unlink(missing_ok=True)
+
+    def __enter__(self) -> "MasterWriter":
+        return self
+
+    def __exit__(self, exc_type: type | None, exc: BaseException | None, traceback: object) -> None:
+        self.close(commit=exc_type is None)
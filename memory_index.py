@@ -0,0 +1,113 @@
+""" In-process exact cosine search over the video catalog, loaded from Postgres into a NumPy matrix. """
+
+import asyncio
+import logging
+import time
+
+import asyncpg
+import numpy as np
+
+# vector_send returns pgvector's binary format, so vectors arrive as raw float4 bytes without text parsing
+LOAD_QUERY = """
+    SELECT
+        public.vector_send(ve.embedding::public.vector) AS embedding, ve.seconds, ve.text, vc.title, vc.videoid, vc.speaker
+    FROM public.video_embeddings ve
+    JOIN public.video_catalog vc ON vc.videoid = ve.videoid
+"""
+VECTOR_HEADER_BYTES = 4
+
+
+class MemoryIndex:
+    """Unit-normalized float32 matrix of every embedding plus the catalog fields a search returns"""
+
+    def __init__(self, vectors: np.ndarray, rows: list, speakers: list) -> None:
+        self.vectors = vectors
+        self.rows = rows
+        # Columns the search filters on, as arrays so a filter is one vectorized comparison
+        self.videoids = np.array([row["videoid"] for row in rows], dtype=object)
+        self.speakers = np.array(speakers, dtype=object)
+        self.seconds = np.array([row["seconds"] for row in rows], dtype=np.int64)
+
+    @classmethod
+    async def load(cls, connection: asyncpg.Connection) -> "MemoryIndex":
+        start = time.perf_counter()
+        vectors = []
+        rows = []
+        speakers = []
+        async with connection.transaction():
+            async for record in connection.cursor(LOAD_QUERY, prefetch=10000):
+                vectors.append(np.frombuffer(record["embedding"], dtype=">f4", offset=VECTOR_HEADER_BYTES))
+                rows.append(
+                    {
+                        "title": record["title"],
+                        "videoid": record["videoid"],
+                        "seconds": record["seconds"],
+                        "text": record["text"],
+                    }
+                )
+                speakers.append(record["speaker"])
+
+        # Stacking and normalizing the whole catalog takes long enough to stall searches on the event loop
+        index = await asyncio.to_thread(cls.build, vectors, rows, speakers)
+        logging.info(f"Loaded {len(rows)} embeddings into memory in {time.perf_counter() - start:.1f}s")
+        return index
+
+    @classmethod
+    def build(cls, vectors: list, rows: list, speakers: list) -> "MemoryIndex":
+        """Stack the vectors into a unit-normalized matrix"""
+        matrix = np.array(vectors, dtype=np.float32) if vectors else np.zeros((0, 0), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        return cls(matrix, rows, speakers)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def filter_mask(self, filters: dict) -> np.ndarray | None:
+        """Rows matching the speaker, videoids and seconds range filters, or None when nothing is filtered"""
+        mask = None
+        if filters.get("speaker") is not None:
+            mask = self.speakers == filters["speaker"]
+        if filters.get("videoids") is not None:
+            matches = np.isin(self.videoids, filters["videoids"])
+            mask = matches if mask is None else mask & matches
+        if filters.get("min_seconds") is not None:
+            matches = self.seconds >= filters["min_seconds"]
+            mask = matches if mask is None else mask & matches
+        if filters.get("max_seconds") is not None:
+            matches = self.seconds <= filters["max_seconds"]
+            mask = matches if mask is None else mask & matches
+        return mask
+
+    def search_many(self, queries: list, max_distance: list, limit: list, filters: list | None = None) -> list:
+        """Cosine search for each query vector, returning rows ordered by distance like get_similar_videos"""
+        if not self.rows:
+            return [[] for _ in queries]
+
+        matrix = np.array(queries, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        distances = 1.0 - matrix @ self.vectors.T
+
+        results = []
+        for row_distances, cutoff, count, row_filters in zip(
+            distances, max_distance, limit, filters or [{}] * len(queries)
+        ):
+            mask = self.filter_mask(row_filters)
+            if mask is not None:
+                # filtered-out rows sort last and fail every distance cutoff
+                row_distances[~mask] = np.inf
+            count = min(count, len(self.rows))
+            nearest = np.argpartition(row_distances, count - 1)[:count]
+            nearest = nearest[np.argsort(row_distances[nearest])]
+            results.append(
+                [
+                    {**self.rows[index], "distance": float(row_distances[index])}
+                    for index in nearest
+                    if row_distances[index] < cutoff
+                ]
+            )
+        return results
+
+    def search(self, query: list, max_distance: float, limit: int, filters: dict | None = None) -> list:
+        return self.search_many([query], [max_distance], [limit], [filters or {}])[0]
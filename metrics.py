@@ -0,0 +1,164 @@
+""" Dependency-free latency histograms, scrape-time gauges and Prometheus text exposition for query_service. """
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator
+
+# Seconds; fine-grained at the low end where pool acquisition and cached requests land
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Phase durations of the current request, for the Server-Timing header; None outside a request
+request_timings: ContextVar[list | None] = ContextVar("request_timings", default=None)
+
+
+def escape_label(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label value"""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: tuple = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        # label value -> [per-bucket counts (+Inf last), sum]
+        self.series: dict[str, list] = {}
+
+    def observe(self, label_value: str, value: float) -> None:
+        series = self.series.get(label_value)
+        if series is None:
+            series = self.series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_value, (counts, total) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts, strict=True):
+                cumulative += count
+                labels = format_labels({self.label: label_value, "le": bound})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels({self.label: label_value})
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Collector:
+    """Gauges or counters whose values are read from a callback when scraped"""
+
+    def __init__(self, name: str, help_text: str, kind: str, collect: Callable[[], Any]) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        # collect returns a number, or a list of (labels dict, number) pairs
+        self.collect = collect
+
+    def render(self) -> list:
+        try:
+            values = self.collect()
+        except (AttributeError, LookupError, TypeError, ValueError):
+            # a failing callback (e.g. app.state before startup completes) must not break the whole scrape
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, list):
+            values = [({}, values)]
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{self.name}{format_labels(labels)} {float(value)}" for labels, value in values)
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: list = []
+
+    def histogram(self, name: str, help_text: str, label: str) -> Histogram:
+        metric = Histogram(name, help_text, label)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, collect: Callable[[], Any]) -> None:
+        self.metrics.append(Collector(name, help_text, "gauge", collect))
+
+    def counter(self, name: str, help_text: str, collect: Callable[[], Any]) -> None:
+        self.metrics.append(Collector(name, help_text, "counter", collect))
+
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+phase_seconds = registry.histogram(
+    "query_service_phase_seconds", "Time spent in each phase of serving a search", "phase"
+)
+request_seconds = registry.histogram("query_service_request_seconds", "End to end request latency", "route")
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """Record the duration of a phase in the phase histogram and the current request's Server-Timing"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        phase_seconds.observe(phase, elapsed)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.append((phase, elapsed))
+
+
+def server_timing(timings: list, total: float) -> bytes:
+    """Server-Timing header value, durations in milliseconds"""
+    parts = [f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in timings]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts).encode("latin-1")
+
+
+class TimingMiddleware:
+    """ASGI middleware timing every HTTP request by route, optionally adding a Server-Timing header"""
+
+    def __init__(self, app: Any, routes: set, server_timing_header: bool = False) -> None:
+        self.app = app
+        self.routes = routes
+        self.server_timing_header = server_timing_header
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings = []
+        token = request_timings.set(timings)
+
+        async def send_with_timing(message: dict) -> None:
+            if message["type"] == "http.response.start" and self.server_timing_header:
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(timings, time.perf_counter() - start)))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_timings.reset(token)
+            # unknown paths share one series so scanners cannot create unbounded label values
+            route = scope["path"] if scope["path"] in self.routes else "other"
+            request_seconds.observe(route, time.perf_counter() - start)
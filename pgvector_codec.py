@@ -0,0 +1,60 @@
+""" Binary encoding of pgvector vector and halfvec values for asyncpg. """
+
+import struct
+import sys
+from array import array
+from typing import Sequence
+
+import asyncpg
+
+# pgvector binary wire format: int16 dimensions, int16 unused, then big-endian float4 (halfvec: float2) values
+VECTOR_HEADER = struct.Struct(">HH")
+
+
+def encode_vector(value: Sequence[float]) -> bytes:
+    """Encode a sequence of floats (or a NumPy array) in pgvector's binary send format."""
+    if hasattr(value, "astype"):
+        # NumPy arrays, including memory-mapped views, convert without going through Python floats
+        return VECTOR_HEADER.pack(len(value), 0) + value.astype(">f4").tobytes()
+
+    values = array("f", value)
+    if sys.byteorder == "little":
+        values.byteswap()
+    return VECTOR_HEADER.pack(len(values), 0) + values.tobytes()
+
+
+def decode_vector(data: bytes) -> list:
+    """Decode pgvector's binary receive format into a list of floats."""
+    dim, _ = VECTOR_HEADER.unpack_from(data)
+    values = array("f")
+    values.frombytes(data[VECTOR_HEADER.size : VECTOR_HEADER.size + dim * 4])
+    if sys.byteorder == "little":
+        values.byteswap()
+    return values.tolist()
+
+
+def encode_halfvec(value: Sequence[float]) -> bytes:
+    """Encode a sequence of floats (or a NumPy array) in pgvector's halfvec binary send format."""
+    if hasattr(value, "astype"):
+        return VECTOR_HEADER.pack(len(value), 0) + value.astype(">f2").tobytes()
+    return VECTOR_HEADER.pack(len(value), 0) + struct.pack(f">{len(value)}e", *value)
+
+
+def decode_halfvec(data: bytes) -> list:
+    """Decode pgvector's halfvec binary receive format into a list of floats."""
+    dim, _ = VECTOR_HEADER.unpack_from(data)
+    return list(struct.unpack_from(f">{dim}e", data, VECTOR_HEADER.size))
+
+
+async def register_vector_codec(connection: asyncpg.Connection) -> None:
+    """Register the binary pgvector codec on a connection (use as a pool init callback)."""
+    await connection.set_type_codec(
+        "vector", schema="public", encoder=encode_vector, decoder=decode_vector, format="binary"
+    )
+    try:
+        # halfvec storage (database/migrations/004_halfvec_storage.sql) needs pgvector 0.7+
+        await connection.set_type_codec(
+            "halfvec", schema="public", encoder=encode_halfvec, decoder=decode_halfvec, format="binary"
+        )
+    except ValueError:
+        pass
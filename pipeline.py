@@ -0,0 +1,539 @@
+""" Run the transcript pipeline: download, then bucket -> embed -> summarize -> load as a streaming pipeline.
+
+Videos flow between stages through bounded asyncio queues, so the first videos are embedded, summarized and in the
+database while later ones are still being bucketed, and a slow stage applies backpressure to the stages before it.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from dotenv import load_dotenv
+from ollama import AsyncClient
+
+# Stage modules read their endpoints and models from the environment when they are imported
+load_dotenv()
+
+from bucket_transcripts import BUCKET_TRANSCRIPTS
+from embed_transcripts import EMBED_TRANSCRIPTS
+from load_transcripts import (
+    DELETE_CATALOG_QUERY,
+    DELETE_EMBEDDINGS_QUERY,
+    LOAD_TRANSCRIPTS,
+    segment_outputs,
+)
+from manifest import Manifest
+from master_file import MasterWriter, VideoCursor, iter_segments, master_path
+from summarize_transcripts import SUMMARIZE_TRANSCRIPTS, SYSTEM_MESSAGE, summary_endpoint
+
+STREAMING_STAGES = ["bucket", "embed", "summarize", "load"]
+ALL_STAGES = ["download", *STREAMING_STAGES]
+# Every catalog version bump empties the query services' result caches, so a long load bumps at most this often
+CATALOG_BUMP_SECONDS = 30.0
+
+
+@dataclass
+class Video:
+    """One video's segments moving through the pipeline"""
+
+    index: int
+    video_id: str
+    segments: list
+    # stages whose output for this video is carried over from the previous run
+    reused: set = field(default_factory=set)
+    loaded: bool = False
+
+
+class StageStats:
+    """Videos and segments a stage has finished, for live throughput reporting"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.videos = 0
+        self.segments = 0
+        self.start = time.perf_counter()
+
+    def done(self, video: Video) -> None:
+        self.videos += 1
+        self.segments += len(video.segments)
+
+    def report(self) -> str:
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return f"{self.name} {self.videos} videos ({self.segments / elapsed:.1f} seg/s)"
+
+
+class PIPELINE:
+    def __init__(
+        self: "PIPELINE",
+        folder: str,
+        stages: list,
+        bucket_workers: int = 1,
+        embed_workers: int = 4,
+        summarize_workers: int = 4,
+        load_batch_size: int = 500,
+        queue_size: int = 16,
+        report_interval: float = 5.0,
+        incremental: bool = False,
+        use_store: bool = False,
+    ) -> None:
+        self.folder = folder
+        self.stages = [stage for stage in STREAMING_STAGES if stage in stages]
+        self.download = "download" in stages
+        self.embed_workers = embed_workers
+        self.summarize_workers = summarize_workers
+        self.load_batch_size = load_batch_size
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.incremental = incremental
+        self.use_store = use_store
+        # Bucketing alone leaves embeddings in the existing sidecar; any later stage rewrites it
+        self.vectors = self.stages != ["bucket"]
+
+        self.bucketer = BUCKET_TRANSCRIPTS(folder, 5, workers=bucket_workers, use_store=use_store)
+        self.embedder = EMBED_TRANSCRIPTS(folder=folder, workers=embed_workers) if "embed" in stages else None
+        self.summarizer = (
+            SUMMARIZE_TRANSCRIPTS(folder=folder, concurrency=summarize_workers) if "summarize" in stages else None
+        )
+        self.loader = LOAD_TRANSCRIPTS(folder=folder, batch_size=load_batch_size) if "load" in stages else None
+
+        self.manifest = None
+        self.source_ids = set()
+        self.stats = {}
+        self.queues = {}
+        # The bucket generator is only ever advanced and closed from this one thread
+        self.bucketed = None
+        self.bucket_thread = None
+        self.missing_embeddings = 0
+        # The sink holds videos that finish out of order until the ones before them arrive; sources run at most
+        # reorder_limit videos ahead of the sink so that buffer stays bounded
+        self.reorder_limit = queue_size * max(embed_workers, summarize_workers, 1)
+        self.next_index = 0
+        self.sink_advanced = asyncio.Condition()
+
+    def validate(self: "PIPELINE") -> None:
+        """Streaming stages must be a contiguous run of bucket -> embed -> summarize -> load"""
+        if not self.stages:
+            return
+        first = STREAMING_STAGES.index(self.stages[0])
+        if self.stages != STREAMING_STAGES[first : first + len(self.stages)]:
+            raise ValueError(f"Stages must be consecutive, got {', '.join(self.stages)}")
+        if self.stages[0] != "bucket" and not master_path(self.folder).exists():
+            raise ValueError(f"No master file in {self.folder} to start from {self.stages[0]}")
+
+    def fingerprint(self: "PIPELINE", stage: str, video: Video) -> str:
+        """The fingerprint a stage would record for a video"""
+        if stage == "embed":
+            return self.embedder.embed_fingerprint(video.video_id)
+        if stage == "summarize":
+            return self.summarizer.summary_fingerprint(video.video_id)
+        return self.loader.load_fingerprint(video.video_id, segment_outputs(video.segments))
+
+    def reuse(self: "PIPELINE", video: Video, bucket_reused: bool) -> None:
+        """Decide which stages can keep the previous run's output for a video, stripping output that cannot"""
+        reusing = self.incremental and bucket_reused
+        for stage in self.stages:
+            if stage == "bucket":
+                continue
+            if stage == "embed":
+                complete = all("ada_v2" in segment for segment in video.segments)
+            elif stage == "summarize":
+                complete = all(segment.get("summary") for segment in video.segments)
+            else:
+                complete = True
+            reusing = (
+                reusing
+                and complete
+                and self.manifest.unchanged(stage, video.video_id, self.fingerprint(stage, video))
+            )
+            if reusing:
+                video.reused.add(stage)
+            else:
+                key = {"embed": "ada_v2", "summarize": "summary"}.get(stage)
+                for segment in video.segments:
+                    segment.pop(key, None)
+
+    async def bucket_source(self: "PIPELINE", output: asyncio.Queue) -> None:
+        """Bucket videos in videoId order, reusing the previous master file's segments for unchanged videos"""
+        videos = self.bucketer.list_videos()
+        fingerprints = {video_id: self.bucketer.bucket_fingerprint(video_id) for _, video_id in videos}
+        self.source_ids = set(fingerprints)
+
+        reusable = set()
+        if self.incremental and master_path(self.folder).exists():
+            reusable = {
+                video_id
+                for video_id, value in fingerprints.items()
+                if self.manifest.unchanged("bucket", video_id, value)
+            }
+        for video_id, value in fingerprints.items():
+            self.manifest.mark("bucket", video_id, value)
+        print(f"Videos to bucket: {len(videos) - len(reusable)} of {len(videos)}")
+
+        previous = VideoCursor(iter_segments(self.folder, with_vectors=self.vectors)) if reusable else None
+        self.bucketed = self.bucketer.bucket_files([source for source, video_id in videos if video_id not in reusable])
+        self.bucket_thread = ThreadPoolExecutor(max_workers=1)
+        loop = asyncio.get_running_loop()
+
+        for index, (_, video_id) in enumerate(videos):
+            await self.wait_for_sink(index)
+            if video_id in reusable:
+                video = Video(index, video_id, previous.take(video_id), reused={"bucket"})
+            else:
+                # bucketing is CPU bound, so the generator (and its process pool) is driven from a thread
+                segments = await loop.run_in_executor(self.bucket_thread, next, self.bucketed)
+                video = Video(index, video_id, segments or [])
+            self.reuse(video, "bucket" in video.reused)
+            self.stats["bucket"].done(video)
+            await output.put(video)
+
+    async def master_source(self: "PIPELINE", output: asyncio.Queue) -> None:
+        """Read videos from the master file when the pipeline starts after bucketing"""
+        cursor = VideoCursor(iter_segments(self.folder, with_vectors=self.vectors))
+        index = 0
+        while cursor.current is not None:
+            await self.wait_for_sink(index)
+            video_id = cursor.current[0]
+            video = Video(index, video_id, cursor.take(video_id))
+            self.source_ids.add(video_id)
+            self.reuse(video, True)
+            await output.put(video)
+            index += 1
+
+    async def wait_for_sink(self: "PIPELINE", index: int) -> None:
+        """Wait until the video at index is within reorder_limit of the next one the sink writes"""
+        async with self.sink_advanced:
+            await self.sink_advanced.wait_for(lambda: index - self.next_index < self.reorder_limit)
+
+    async def embed_video(self: "PIPELINE", client: AsyncClient, video: Video) -> None:
+        """Embed a video's segments in batches, filling what it can from the embedding cache"""
+        embedder = self.embedder
+        pending = [segment for segment in video.segments if embedder.prepare_segment(segment)]
+        if embedder.cache:
+            cached = embedder.cache.get_many(embedder.model, [segment["text"] for segment in pending])
+            for segment, embedding in zip(pending, cached, strict=True):
+                if embedding is not None:
+                    segment["ada_v2"] = embedding
+            pending = [segment for segment, embedding in zip(pending, cached, strict=True) if embedding is None]
+
+        for start in range(0, len(pending), embedder.BATCH_SIZE):
+            batch = pending[start : start + embedder.BATCH_SIZE]
+            embeddings = await embedder.embed_batch(client, [segment["text"] for segment in batch])
+            if len(embeddings) != len(batch):
+                print(f"Embedding failed for a batch of {len(batch)} segments of {video.video_id}")
+                continue
+            for segment, embedding in zip(batch, embeddings, strict=True):
+                segment["ada_v2"] = embedding
+            if embedder.cache:
+                embedder.cache.put_many(embedder.model, [segment["text"] for segment in batch], embeddings)
+
+    async def summarize_video(self: "PIPELINE", client: AsyncClient, video: Video, limit: asyncio.Semaphore) -> None:
+        """Summarize a video's segments, sharing the summarize concurrency limit with the other workers"""
+        summarizer = self.summarizer
+
+        async def summarize(segment: dict) -> None:
+            if summarizer.resolve_summary(segment, {}):
+                return
+            async with limit:
+                segment["summary"], _ = await summarizer.get_summary(client, segment["text"])
+            if segment["summary"] and summarizer.cache:
+                summarizer.cache.put(summarizer.model, SYSTEM_MESSAGE, segment["text"], segment["summary"])
+
+        await asyncio.gather(*(summarize(segment) for segment in video.segments))
+
+    async def stage_worker(
+        self: "PIPELINE", stage: str, work: object, source: asyncio.Queue, output: asyncio.Queue
+    ) -> None:
+        """Apply work to each video from source that cannot reuse the stage's previous output"""
+        while (video := await source.get()) is not None:
+            if stage not in video.reused:
+                await work(video)
+            self.stats[stage].done(video)
+            await output.put(video)
+
+    async def load_worker(self: "PIPELINE", source: asyncio.Queue, output: asyncio.Queue) -> None:
+        """Replace the database rows of each changed video, batching videos up to load_batch_size rows"""
+        loader = self.loader
+        finished = False
+        last_bump = time.monotonic()
+        unannounced = False
+        while not finished:
+            videos = []
+            video = await source.get()
+            while video is not None:
+                videos.append(video)
+                if sum(len(v.segments) for v in videos) >= self.load_batch_size or source.empty():
+                    break
+                video = source.get_nowait()
+            finished = video is None
+
+            changed = [v for v in videos if "load" not in v.reused]
+            rows = [segment for v in changed for segment in v.segments if "ada_v2" in segment]
+            # Segments the embed stage failed on cannot be loaded; their videos stay unmarked so a later run retries
+            incomplete = {v.video_id: sum("ada_v2" not in segment for segment in v.segments) for v in changed}
+            incomplete = {video_id: missing for video_id, missing in incomplete.items() if missing}
+            for video_id, missing in incomplete.items():
+                print(f"Loading {video_id} without {missing} segments that have no embedding")
+            self.missing_embeddings += sum(incomplete.values())
+            if changed:
+                try:
+                    bump = time.monotonic() - last_bump >= CATALOG_BUMP_SECONDS
+                    async with loader.connection.transaction():
+                        video_ids = [v.video_id for v in changed]
+                        await loader.connection.execute(DELETE_EMBEDDINGS_QUERY, video_ids)
+                        await loader.connection.execute(DELETE_CATALOG_QUERY, video_ids)
+                        if rows:
+                            await loader.load_batch(rows)
+                        if bump:
+                            # raises on failure: the transaction then rolls back rather than committing an aborted one
+                            await loader.bump_catalog_version()
+                    if bump:
+                        last_bump = time.monotonic()
+                    unannounced = not bump
+                    for v in changed:
+                        v.loaded = v.video_id not in incomplete and v.video_id not in loader.failed_videos
+                except Exception as e:
+                    # the batch was rolled back, so its videos stay unloaded and a later run retries them
+                    print(f"Loading {len(changed)} videos failed: {e}")
+
+            for v in videos:
+                self.stats["load"].done(v)
+                await output.put(v)
+
+        if unannounced:
+            await loader.try_bump_catalog_version()
+
+    async def sink(self: "PIPELINE", source: asyncio.Queue, writer: MasterWriter | None) -> None:
+        """Write finished videos to the master file in source order and record them in the manifest"""
+        waiting = {}
+        while (video := await source.get()) is not None:
+            waiting[video.index] = video
+            while self.next_index in waiting:
+                video = waiting.pop(self.next_index)
+                self.next_index += 1
+                if writer:
+                    writer.write_many(video.segments)
+                self.mark(video)
+            async with self.sink_advanced:
+                self.sink_advanced.notify_all()
+
+    def mark(self: "PIPELINE", video: Video) -> None:
+        """Record the stages a video completed in the manifest"""
+        for stage in self.stages:
+            if stage == "bucket" or (stage == "load" and not (video.loaded or "load" in video.reused)):
+                continue
+            self.manifest.mark(stage, video.video_id, self.fingerprint(stage, video))
+
+    async def report(self: "PIPELINE") -> None:
+        """Print each stage's throughput and the depth of the queue feeding it"""
+        while True:
+            await asyncio.sleep(self.report_interval)
+            parts = []
+            for stage in self.stats:
+                queue = self.queues.get(stage)
+                depth = f" [queue {queue.qsize()}/{queue.maxsize}]" if queue else ""
+                parts.append(self.stats[stage].report() + depth)
+            print(" | ".join(parts))
+
+    async def delete_removed(self: "PIPELINE") -> None:
+        """Delete videos that are no longer in the source from the database"""
+        removed = self.manifest.video_ids("load") - self.source_ids
+        if removed:
+            try:
+                async with self.loader.connection.transaction():
+                    await self.loader.connection.execute(DELETE_EMBEDDINGS_QUERY, sorted(removed))
+                    await self.loader.connection.execute(DELETE_CATALOG_QUERY, sorted(removed))
+                    await self.loader.bump_catalog_version()
+            except Exception as e:
+                # rolled back: keep the videos in the manifest so the next run deletes them again
+                print(f"Deleting {len(removed)} removed videos failed: {e}")
+                return
+            print(f"Deleted {len(removed)} removed videos")
+        self.manifest.forget("load", removed)
+
+    async def stream(self: "PIPELINE", writer: MasterWriter | None) -> None:
+        """Connect the selected stages with bounded queues and run them to completion"""
+        embed_client = AsyncClient(host=self.embedder.remote_host, timeout=60) if self.embedder else None
+        summary_client = AsyncClient(host=summary_endpoint, timeout=60) if self.summarizer else None
+        summary_limit = asyncio.Semaphore(self.summarize_workers)
+
+        # (stage, worker count, work) for every stage after the source
+        steps = []
+        if self.embedder:
+            steps.append(("embed", self.embed_workers, lambda video: self.embed_video(embed_client, video)))
+        if self.summarizer:
+            steps.append(
+                (
+                    "summarize",
+                    self.summarize_workers,
+                    lambda video: self.summarize_video(summary_client, video, summary_limit),
+                )
+            )
+        if self.loader:
+            steps.append(("load", 1, None))
+
+        source = self.bucket_source if self.stages[0] == "bucket" else self.master_source
+        if self.stages[0] == "bucket":
+            self.stats["bucket"] = StageStats("bucket")
+
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        tasks = []
+        producers = [asyncio.create_task(source(queue))]
+        for stage, workers, work in steps:
+            self.stats[stage] = StageStats(stage)
+            self.queues[stage] = queue
+            output = asyncio.Queue(maxsize=self.queue_size)
+            if stage == "load":
+                stage_tasks = [asyncio.create_task(self.load_worker(queue, output))]
+            else:
+                stage_tasks = [
+                    asyncio.create_task(self.stage_worker(stage, work, queue, output)) for _ in range(workers)
+                ]
+            tasks.append((producers, queue, stage_tasks))
+            producers, queue = stage_tasks, output
+
+        tasks.append((producers, queue, []))
+        sink = asyncio.create_task(self.sink(queue, writer))
+        reporter = asyncio.create_task(self.report())
+        running = [task for stage_producers, _, _ in tasks for task in stage_producers] + [sink]
+
+        async def close_queues() -> None:
+            # When every producer of a queue is done, send one stop marker per consumer
+            for stage_producers, stage_queue, consumers in tasks:
+                await asyncio.gather(*stage_producers)
+                for _ in consumers or [sink]:
+                    await stage_queue.put(None)
+
+        try:
+            # gather fails as soon as any stage raises, instead of leaving the stages before it blocked on a full queue
+            await asyncio.gather(close_queues(), *running)
+
+            if self.loader and self.stages[0] == "bucket":
+                await self.delete_removed()
+        finally:
+            reporter.cancel()
+            for task in running:
+                task.cancel()
+            await asyncio.gather(reporter, *running, return_exceptions=True)
+            await self.close_bucketing()
+
+        print(" | ".join(stats.report() for stats in self.stats.values()))
+        if self.missing_embeddings:
+            print(f"{self.missing_embeddings} segments without embeddings were not loaded")
+
+    async def close_bucketing(self: "PIPELINE") -> None:
+        """Close the bucket generator, and with it the process pool, once any next() still running has returned"""
+        if self.bucketed is None:
+            return
+        await asyncio.get_running_loop().run_in_executor(self.bucket_thread, self.bucketed.close)
+        self.bucket_thread.shutdown()
+        self.bucketed = None
+
+    async def execute(self: "PIPELINE") -> None:
+        """Connect to the database, then stream into a new master file unless only loading"""
+        # Connect first: a failure must leave the previous master file and the manifest untouched
+        if self.loader and not await self.loader.connect():
+            raise ConnectionError("Unable to connect to the database")
+        try:
+            # Only load writes nothing to the master file; every other stage rewrites it with its output
+            if self.stages == ["load"]:
+                await self.stream(None)
+            else:
+                with MasterWriter(self.folder, vectors=self.vectors) as writer:
+                    await self.stream(writer)
+        finally:
+            if self.loader and self.loader.connection and not self.loader.connection.is_closed():
+                await self.loader.connection.close()
+
+    def run(self: "PIPELINE") -> None:
+        """Download, then stream the selected stages"""
+        self.validate()
+
+        if self.download:
+            from download_transcripts import DOWNLOAD_TRANSCRIPT
+
+            DOWNLOAD_TRANSCRIPT(self.folder, use_store=self.use_store).start_download()
+
+        if not self.stages:
+            return
+
+        self.manifest = Manifest(self.folder)
+        for stage in (self.embedder, self.summarizer, self.loader):
+            if stage:
+                stage.manifest = self.manifest
+
+        start = time.perf_counter()
+        asyncio.run(self.execute())
+
+        if self.stages[0] == "bucket":
+            for stage in self.stages:
+                self.manifest.forget(stage, self.manifest.video_ids(stage) - self.source_ids)
+        self.manifest.save()
+
+        if self.embedder and self.embedder.cache:
+            self.embedder.cache.close(self.embedder.cache_max_entries)
+        if self.summarizer and self.summarizer.cache:
+            self.summarizer.cache.close()
+        print(f"Pipeline finished in {time.perf_counter() - start:.1f}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", default=os.getenv("TRANSCRIPT_FOLDER"), help="Transcript folder")
+    parser.add_argument(
+        "--stages",
+        default=",".join(STREAMING_STAGES),
+        help=f"Comma separated stages to run, from {', '.join(ALL_STAGES)} (default: all but download)",
+    )
+    parser.add_argument("--bucket-workers", type=int, default=os.cpu_count(), help="Bucketing processes")
+    parser.add_argument("--embed-workers", type=int, default=4, help="Videos embedded concurrently")
+    parser.add_argument("--summarize-workers", type=int, default=4, help="Concurrent summary requests")
+    parser.add_argument("--load-batch-size", type=int, default=500, help="Rows per load transaction")
+    parser.add_argument("--queue-size", type=int, default=16, help="Videos buffered between stages")
+    parser.add_argument("--report-interval", type=float, default=5.0, help="Seconds between progress lines")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=os.environ.get("INCREMENTAL", "false").lower() == "true",
+        help="Only process videos that are new or changed since the last run",
+    )
+    parser.add_argument(
+        "--use-store",
+        action="store_true",
+        default=os.environ.get("USE_TRANSCRIPT_STORE", "false").lower() == "true",
+        help="Read and write transcripts in the consolidated transcript store",
+    )
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(ALL_STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+    if not args.folder:
+        parser.error("--folder or TRANSCRIPT_FOLDER is required")
+
+    Path(args.folder).mkdir(parents=True, exist_ok=True)
+    pipeline = PIPELINE(
+        args.folder,
+        stages,
+        bucket_workers=args.bucket_workers,
+        embed_workers=args.embed_workers,
+        summarize_workers=args.summarize_workers,
+        load_batch_size=args.load_batch_size,
+        queue_size=args.queue_size,
+        report_interval=args.report_interval,
+        incremental=args.incremental,
+        use_store=args.use_store,
+    )
+    try:
+        pipeline.validate()
+    except ValueError as e:
+        parser.error(str(e))
+    pipeline.run()
+
+
+if __name__ == "__main__":
+    main()
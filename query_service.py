@@ -6,8 +6,12 @@
 # the directional similarity between them, irrespective of their magnitude.
 
 import os
+import asyncio
+import json
 import logging
-from typing import Any, AsyncGenerator, List
+import time
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Awaitable, Callable, Hashable, List
 from contextlib import asynccontextmanager
 import httpx
 
@@ -15,8 +19,13 @@ from dotenv import load_dotenv
 import asyncpg
 import uvicorn
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel, Field
 
+from memory_index import MemoryIndex
+from metrics import TimingMiddleware, registry, timed
+from pgvector_codec import register_vector_codec
+
 logging.basicConfig(level=logging.INFO)  # You can set the desired logging level
 
 # Load environment variables from .env file
@@ -26,39 +35,422 @@ load_dotenv()
 OLLAMA_EMBEDDING_ENDPOINT = os.getenv("OLLAMA_EMBEDDING_ENDPOINT")
 POSTGRES_CONNECTION_STRING = os.getenv("POSTGRES_CONNECTION_STRING")
 OLLAMA_EMBEDDING_MODEL = os.getenv("OLLAMA_EMBEDDING_MODEL")
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+HTTPX_TIMEOUT_SECONDS = float(os.getenv("HTTPX_TIMEOUT_SECONDS", "10"))
+HTTPX_MAX_CONNECTIONS = int(os.getenv("HTTPX_MAX_CONNECTIONS", "100"))
+HTTPX_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTPX_MAX_KEEPALIVE_CONNECTIONS", "20"))
+MAX_BATCH_PROMPTS = int(os.getenv("MAX_BATCH_PROMPTS", "64"))
+# "database" searches with get_similar_videos, "memory" searches an in-process copy reloaded on catalog changes
+SERVING_MODE = os.getenv("SERVING_MODE", "database")
+# >0 searches the binary-quantized index for this many candidates and re-ranks them exactly
+# (database/migrations/005_binary_quantization.sql); 0 searches the full-precision index
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "0"))
+# hnsw.ef_search caps how many candidates an HNSW scan can return
+MAX_RERANK_CANDIDATES = 1000
+# Filtered searches let the HNSW/IVFFlat scan continue until enough rows pass the filter: relaxed_order or
+# strict_order, or off. Only used with pgvector 0.8+, whose version is checked at startup
+ITERATIVE_SCAN = os.getenv("ITERATIVE_SCAN", "relaxed_order")
+# Adds a Server-Timing header with the per-phase breakdown to every response, readable in browser dev tools
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() == "true"
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "3600"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "10000"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "300"))
+CATALOG_VERSION_POLL_SECONDS = float(os.getenv("CATALOG_VERSION_POLL_SECONDS", "5"))
+# In memory mode, the least time between rebuilds of the index while a load keeps bumping the catalog version
+MEMORY_INDEX_RELOAD_SECONDS = float(os.getenv("MEMORY_INDEX_RELOAD_SECONDS", "60"))
+
+# Column-explicit query; asyncpg prepares it once per pooled connection and reuses it from the statement cache
+SIMILAR_VIDEOS_QUERY = """
+    SELECT title, videoid, seconds, text, distance
+    FROM public.get_similar_videos(
+        $1::public.vector, $2, $3, filter_speaker => $4, filter_videoids => $5, min_seconds => $6, max_seconds => $7
+    )
+"""
+RERANKED_SIMILAR_VIDEOS_QUERY = """
+    SELECT title, videoid, seconds, text, distance
+    FROM public.get_similar_videos_reranked(
+        $1::public.vector, $2, $3, $8, filter_speaker => $4, filter_videoids => $5, min_seconds => $6, max_seconds => $7
+    )
+"""
+
+# Every prompt of a batch in one round trip, rows tagged with the (1-based) position of their prompt
+# Arrays cannot hold ragged arrays, so each prompt's videoids filter travels as a JSON array (or NULL)
+BATCH_SIMILAR_VIDEOS_QUERY = """
+    SELECT q.request_index, r.title, r.videoid, r.seconds, r.text, r.distance
+    FROM unnest(
+        $1::public.vector[], $2::double precision[], $3::integer[],
+        $4::varchar[], $5::jsonb[], $6::integer[], $7::integer[]
+    ) WITH ORDINALITY AS q(
+        query_vector, max_distance, limit_count, speaker, videoids, min_seconds, max_seconds, request_index
+    )
+    CROSS JOIN LATERAL public.get_similar_videos(
+        q.query_vector, q.max_distance, q.limit_count,
+        filter_speaker => q.speaker,
+        filter_videoids => NULLIF(ARRAY(SELECT jsonb_array_elements_text(q.videoids)), '{}')::varchar[],
+        min_seconds => q.min_seconds,
+        max_seconds => q.max_seconds
+    ) r
+    ORDER BY q.request_index, r.distance
+"""
+BATCH_RERANKED_SIMILAR_VIDEOS_QUERY = """
+    SELECT q.request_index, r.title, r.videoid, r.seconds, r.text, r.distance
+    FROM unnest(
+        $1::public.vector[], $2::double precision[], $3::integer[],
+        $4::varchar[], $5::jsonb[], $6::integer[], $7::integer[], $8::integer[]
+    ) WITH ORDINALITY AS q(
+        query_vector, max_distance, limit_count, speaker, videoids, min_seconds, max_seconds, candidate_count,
+        request_index
+    )
+    CROSS JOIN LATERAL public.get_similar_videos_reranked(
+        q.query_vector, q.max_distance, q.limit_count, q.candidate_count,
+        filter_speaker => q.speaker,
+        filter_videoids => NULLIF(ARRAY(SELECT jsonb_array_elements_text(q.videoids)), '{}')::varchar[],
+        min_seconds => q.min_seconds,
+        max_seconds => q.max_seconds
+    ) r
+    ORDER BY q.request_index, r.distance
+"""
+VECTOR_VERSION_QUERY = "SELECT extversion FROM pg_extension WHERE extname = 'vector'"
 
 # Create a persistent client instance
-httpx_client = httpx.AsyncClient(timeout=10.0, limits=httpx.Limits(max_connections=100, max_keepalive_connections=20))
+httpx_client = httpx.AsyncClient(
+    timeout=HTTPX_TIMEOUT_SECONDS,
+    limits=httpx.Limits(
+        max_connections=HTTPX_MAX_CONNECTIONS, max_keepalive_connections=HTTPX_MAX_KEEPALIVE_CONNECTIONS
+    ),
+)
+
+
+class LoadCancelled(Exception):
+    """The caller loading a key was cancelled rather than the load failing, so waiting callers retry it"""
+
+
+class AsyncTTLCache:
+    """Size and TTL bounded LRU cache where concurrent misses for the same key share one load"""
+
+    def __init__(self, max_size: int, ttl_seconds: float) -> None:
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.in_flight: dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: Hashable) -> Any:
+        """Return the cached value or None if missing or expired"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Store a value, evicting the least recently used entries beyond max_size"""
+        self.entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def lookup(self, key: Hashable) -> Any:
+        """get() that counts a hit or a miss, for callers that load and put misses themselves"""
+        value = self.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value, or load it once no matter how many callers are waiting on the same key"""
+        while True:
+            value = self.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+
+            if key not in self.in_flight:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(self.in_flight[key])
+            except LoadCancelled:
+                # the first waiter to get here takes over the load and the rest wait on it; a waiter that takes over
+                # counts as the miss that loads rather than as coalesced as well
+                self.coalesced -= 1
+                continue
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            value = await loader()
+        except Exception as e:
+            future.set_exception(e)
+            # waiters re-raise the error; mark it retrieved so an unawaited future does not log a warning
+            future.exception()
+            raise
+        except BaseException:
+            # cancelling the future would cancel every waiter along with the caller that was loading
+            future.set_exception(LoadCancelled())
+            future.exception()
+            raise
+        finally:
+            del self.in_flight[key]
+
+        future.set_result(value)
+        self.put(key, value)
+        return value
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+
+class PoolStats:
+    """Tracks callers waiting on the database pool and how long acquisition takes"""
+
+    def __init__(self) -> None:
+        self.waiting = 0
+        self.acquisitions = 0
+        self.total_acquire_seconds = 0.0
+        self.max_acquire_seconds = 0.0
+
+    def record_acquire(self, seconds: float) -> None:
+        self.acquisitions += 1
+        self.total_acquire_seconds += seconds
+        self.max_acquire_seconds = max(self.max_acquire_seconds, seconds)
+
+    def stats(self, pool: asyncpg.Pool) -> dict:
+        size = pool.get_size()
+        return {
+            "size": size,
+            "min_size": pool.get_min_size(),
+            "max_size": pool.get_max_size(),
+            "in_use": size - pool.get_idle_size(),
+            "waiting": self.waiting,
+            "acquisitions": self.acquisitions,
+            "avg_acquire_ms": self.total_acquire_seconds / self.acquisitions * 1000 if self.acquisitions else 0.0,
+            "max_acquire_ms": self.max_acquire_seconds * 1000,
+        }
+
+
+pool_stats = PoolStats()
+embedding_cache = AsyncTTLCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL_SECONDS)
+result_cache = AsyncTTLCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL_SECONDS)
 
 
 class PromptRequest(BaseModel):
     prompt: str = "What is the best way to learn about cognitive services."
     distance: float = Field(default=0.4, ge=0.0, le=1.0)
     limit: int = Field(default=4, ge=1, le=100)
+    # Optional per-request recall/latency trade-off for the HNSW or IVFFlat index
+    ef_search: int | None = Field(default=None, ge=1, le=1000)
+    probes: int | None = Field(default=None, ge=1, le=1000)
+    # Optional filters applied inside the vector search, so limit counts matching rows
+    speaker: str | None = None
+    videoids: List[str] | None = Field(default=None, min_length=1, max_length=1000)
+    # Range of segment start times, in seconds into the video
+    min_seconds: int | None = Field(default=None, ge=0)
+    max_seconds: int | None = Field(default=None, ge=0)
+
+    def filters(self) -> dict:
+        return {
+            "speaker": self.speaker,
+            "videoids": self.videoids,
+            "min_seconds": self.min_seconds,
+            "max_seconds": self.max_seconds,
+        }
+
+    def is_filtered(self) -> bool:
+        return any(value is not None for value in self.filters().values())
+
+
+async def refresh_catalog_version(app: FastAPI) -> None:
+    """Read the catalog version LOAD_TRANSCRIPTS bumps on every load, dropping cached results when it changes"""
+    try:
+        version = await app.state.db_pool.fetchval("SELECT version FROM public.catalog_version")
+    except (asyncpg.exceptions.PostgresError, OSError) as e:
+        logging.warning(f"Unable to read the catalog version: {e}")
+        return
+
+    if version != app.state.catalog_version:
+        logging.info(f"Catalog version changed from {app.state.catalog_version} to {version}")
+        # Swap in the new index before publishing the version so new cache keys never see old results
+        if SERVING_MODE == "memory":
+            if app.state.memory_index is not None and (
+                time.monotonic() - app.state.memory_index_loaded_at < MEMORY_INDEX_RELOAD_SECONDS
+            ):
+                # keep serving the current version until a later poll is due a reload
+                return
+            await reload_memory_index(app)
+        app.state.catalog_version = version
+        result_cache.clear()
+
+
+async def reload_memory_index(app: FastAPI) -> None:
+    """Build a fresh in-memory index and swap it in, keeping the current one if loading fails"""
+    app.state.memory_index_loaded_at = time.monotonic()
+    try:
+        async with app.state.db_pool.acquire() as connection:
+            app.state.memory_index = await MemoryIndex.load(connection)
+    except (asyncpg.exceptions.PostgresError, OSError) as e:
+        if app.state.memory_index is None:
+            raise
+        logging.error(f"Unable to reload the in-memory index, still serving the previous catalog: {e}")
+
+
+async def poll_catalog_version(app: FastAPI) -> None:
+    while True:
+        await asyncio.sleep(CATALOG_VERSION_POLL_SECONDS)
+        await refresh_catalog_version(app)
+
+
+async def detect_iterative_scan(app: FastAPI) -> str:
+    """ITERATIVE_SCAN if the installed pgvector supports iterative index scans, which came in 0.8, otherwise off"""
+    if ITERATIVE_SCAN == "off":
+        return "off"
+    version = await app.state.db_pool.fetchval(VECTOR_VERSION_QUERY)
+    try:
+        supported = version is not None and tuple(int(part) for part in version.split(".")[:2]) >= (0, 8)
+    except ValueError:
+        supported = False
+    if not supported:
+        logging.warning(f"pgvector {version} does not support iterative index scans, ITERATIVE_SCAN is ignored")
+        return "off"
+    return ITERATIVE_SCAN
+
+
+async def init_connection(connection: asyncpg.Connection) -> None:
+    """Send and receive pgvector values in binary instead of text on every pooled connection"""
+    await register_vector_codec(connection)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[Any, Any]:
-    app.state.db_pool = await asyncpg.create_pool(dsn=POSTGRES_CONNECTION_STRING, min_size=1, max_size=10)
+    app.state.db_pool = await asyncpg.create_pool(
+        dsn=POSTGRES_CONNECTION_STRING,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        init=init_connection,
+    )
+    app.state.catalog_version = None
+    app.state.memory_index = None
+    app.state.memory_index_loaded_at = 0.0
+    app.state.iterative_scan = await detect_iterative_scan(app)
+    await refresh_catalog_version(app)
+    if SERVING_MODE == "memory" and app.state.memory_index is None:
+        await reload_memory_index(app)
+    catalog_version_poller = asyncio.create_task(poll_catalog_version(app))
     try:
         yield
     finally:
+        catalog_version_poller.cancel()
         await app.state.db_pool.close()
         await httpx_client.aclose()
 
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(
+    TimingMiddleware,
+    routes={"/get-videos/", "/get-videos/batch", "/stats/", "/metrics"},
+    server_timing_header=SERVER_TIMING,
+)
+
+
+def pool_gauge(key: str) -> Callable[[], int]:
+    return lambda: pool_stats.stats(app.state.db_pool)[key]
+
+
+def httpx_connection_limits() -> list:
+    # httpx has no public accessor for its pool's live connections, so report the limits it was configured with
+    return [
+        ({"limit": "max_connections"}, HTTPX_MAX_CONNECTIONS),
+        ({"limit": "max_keepalive_connections"}, HTTPX_MAX_KEEPALIVE_CONNECTIONS),
+    ]
+
+
+def cache_counter(key: str) -> Callable[[], list]:
+    return lambda: [
+        ({"cache": "embedding"}, embedding_cache.stats()[key]),
+        ({"cache": "result"}, result_cache.stats()[key]),
+    ]
+
+
+registry.gauge("query_service_db_pool_size", "Open database connections", pool_gauge("size"))
+registry.gauge("query_service_db_pool_in_use", "Database connections checked out", pool_gauge("in_use"))
+registry.gauge("query_service_db_pool_waiting", "Callers waiting for a database connection", pool_gauge("waiting"))
+registry.counter(
+    "query_service_db_pool_acquisitions_total", "Database connections acquired", pool_gauge("acquisitions")
+)
+registry.gauge(
+    "query_service_httpx_connection_limit", "Connection limits for the embedding service", httpx_connection_limits
+)
+registry.gauge("query_service_cache_size", "Cached entries", cache_counter("size"))
+registry.counter("query_service_cache_hits_total", "Cache hits", cache_counter("hits"))
+registry.counter("query_service_cache_misses_total", "Cache misses", cache_counter("misses"))
+registry.counter(
+    "query_service_cache_coalesced_total",
+    "Cache misses that waited on a load already in flight",
+    cache_counter("coalesced"),
+)
+registry.gauge("query_service_catalog_version", "Catalog version being served", lambda: app.state.catalog_version)
+registry.gauge(
+    "query_service_memory_index_segments",
+    "Segments held by the in-memory index",
+    lambda: len(app.state.memory_index) if app.state.memory_index is not None else None,
+)
+
+
+@asynccontextmanager
+async def acquire_connection() -> AsyncGenerator[asyncpg.Connection, None]:
+    """Acquire a pooled connection, recording wait time and the number of waiting callers"""
+    pool_stats.waiting += 1
+    start = time.perf_counter()
+    try:
+        with timed("pool_acquire"):
+            connection = await app.state.db_pool.acquire()
+    finally:
+        pool_stats.waiting -= 1
+    pool_stats.record_acquire(time.perf_counter() - start)
+
+    try:
+        yield connection
+    finally:
+        await app.state.db_pool.release(connection)
 
 
 async def get_vector_data_async(prompt: str) -> List[float]:
     '''Using httpx async posts to the OLLAMA embedding service'''
+    return (await get_vectors_data_async([prompt]))[0]
+
+
+async def get_vectors_data_async(prompts: List[str]) -> List[List[float]]:
+    '''Embed several prompts with a single post to the OLLAMA embedding service'''
     try:
-        response = await httpx_client.post(
-            OLLAMA_EMBEDDING_ENDPOINT, json={"model": OLLAMA_EMBEDDING_MODEL, "input": prompt}, timeout=10.0
-        )
-        response.raise_for_status()
+        with timed("embed"):
+            response = await httpx_client.post(
+                OLLAMA_EMBEDDING_ENDPOINT, json={"model": OLLAMA_EMBEDDING_MODEL, "input": prompts}
+            )
+            response.raise_for_status()
         embedding_result = response.json()
-        return embedding_result["embeddings"][0]
+        return embedding_result["embeddings"]
     except httpx.TimeoutException as e:
         logging.error(f"Timeout error occurred: {e}")
         raise
@@ -70,36 +462,227 @@ async def get_vector_data_async(prompt: str) -> List[float]:
         raise
 
 
+def format_results(results: list) -> list:
+    return [
+        {
+            "title": result["title"],
+            "distance": result["distance"],
+            "youtube_link": f'https://youtu.be/{result["videoid"]}&t={result["seconds"]}',
+            "text": result["text"],
+        }
+        for result in results
+    ]
+
+
+def result_cache_key(request: PromptRequest) -> tuple:
+    # The catalog version is part of the key so results from before a reload are never served
+    return (
+        app.state.catalog_version,
+        request.prompt,
+        request.distance,
+        request.limit,
+        request.ef_search,
+        request.probes,
+        request.speaker,
+        tuple(request.videoids) if request.videoids is not None else None,
+        request.min_seconds,
+        request.max_seconds,
+    )
+
+
+async def set_search_options(
+    connection: asyncpg.Connection, ef_search: int | None, probes: int | None, filtered: bool = False
+) -> None:
+    # set_config(..., true) only lasts for the current transaction, so pooled connections keep the defaults
+    if ef_search is not None:
+        await connection.execute("SELECT set_config('hnsw.ef_search', $1, true)", str(ef_search))
+    if probes is not None:
+        await connection.execute("SELECT set_config('ivfflat.probes', $1, true)", str(probes))
+    if filtered and app.state.iterative_scan != "off":
+        # IVFFlat only supports relaxed ordering; get_similar_videos re-sorts the rows it returns either way
+        await connection.execute(
+            "SELECT set_config('hnsw.iterative_scan', $1, true), "
+            "set_config('ivfflat.iterative_scan', 'relaxed_order', true)",
+            app.state.iterative_scan,
+        )
+
+
+def rerank_candidates(limit: int) -> int:
+    return min(max(RERANK_CANDIDATES, limit), MAX_RERANK_CANDIDATES)
+
+
+def rerank_ef_search(ef_search: int | None, candidates: int) -> int:
+    # the bit index must be allowed to return every candidate, whatever the request asked for
+    return max(ef_search or 0, candidates)
+
+
+def search_options(request: PromptRequest) -> tuple:
+    """The ef_search, probes and filtered arguments of set_search_options for a request's database search"""
+    ef_search = request.ef_search
+    if RERANK_CANDIDATES:
+        ef_search = rerank_ef_search(ef_search, rerank_candidates(request.limit))
+    return ef_search, request.probes, request.is_filtered()
+
+
+async def search_videos(request: PromptRequest) -> list:
+    # Embed before acquiring a connection so a slow embedding call never pins a pooled connection
+    vector = await embedding_cache.get_or_load(request.prompt, lambda: get_vector_data_async(request.prompt))
+
+    if app.state.memory_index is not None:
+        # NumPy releases the GIL during the matrix product, so searching in a thread keeps the event loop free
+        index = app.state.memory_index
+        with timed("memory_search"):
+            results = await asyncio.to_thread(index.search, vector, request.distance, request.limit, request.filters())
+    else:
+        query = SIMILAR_VIDEOS_QUERY
+        arguments = [
+            vector,
+            request.distance,
+            request.limit,
+            request.speaker,
+            request.videoids,
+            request.min_seconds,
+            request.max_seconds,
+        ]
+        if RERANK_CANDIDATES:
+            query = RERANKED_SIMILAR_VIDEOS_QUERY
+            arguments.append(rerank_candidates(request.limit))
+
+        async with acquire_connection() as connection, connection.transaction():
+            await set_search_options(connection, *search_options(request))
+            with timed("query"):
+                results = await connection.fetch(query, *arguments)
+
+    with timed("format"):
+        return format_results(results)
+
+
+async def search_videos_batch(requests: List[PromptRequest]) -> List[list]:
+    """Search for several prompts with one embedding call and a database round trip per set of index options"""
+    vectors = [embedding_cache.get(request.prompt) for request in requests]
+    missing = list(dict.fromkeys(request.prompt for request, vector in zip(requests, vectors, strict=True) if vector is None))
+    if missing:
+        embedded = dict(zip(missing, await get_vectors_data_async(missing), strict=True))
+        for prompt, vector in embedded.items():
+            embedding_cache.put(prompt, vector)
+        vectors = [embedded[request.prompt] if vector is None else vector for request, vector in zip(requests, vectors, strict=True)]
+
+    if app.state.memory_index is not None:
+        with timed("memory_search"):
+            results = await asyncio.to_thread(
+                app.state.memory_index.search_many,
+                vectors,
+                [request.distance for request in requests],
+                [request.limit for request in requests],
+                [request.filters() for request in requests],
+            )
+        with timed("format"):
+            return [format_results(result) for result in results]
+
+    # Index options apply to the whole statement, so requests run in one statement per distinct set of options
+    # and each gets the results it would get on its own, which is what the result cache stores them under
+    groups = {}
+    for index, request in enumerate(requests):
+        groups.setdefault(search_options(request), []).append(index)
+
+    grouped = [[] for _ in requests]
+    async with acquire_connection() as connection:
+        for options, indexes in groups.items():
+            query = BATCH_SIMILAR_VIDEOS_QUERY
+            batch = [requests[index] for index in indexes]
+            arguments = [
+                [vectors[index] for index in indexes],
+                [request.distance for request in batch],
+                [request.limit for request in batch],
+                [request.speaker for request in batch],
+                [json.dumps(request.videoids) if request.videoids is not None else None for request in batch],
+                [request.min_seconds for request in batch],
+                [request.max_seconds for request in batch],
+            ]
+            if RERANK_CANDIDATES:
+                query = BATCH_RERANKED_SIMILAR_VIDEOS_QUERY
+                arguments.append([rerank_candidates(request.limit) for request in batch])
+
+            async with connection.transaction():
+                await set_search_options(connection, *options)
+                with timed("query"):
+                    rows = await connection.fetch(query, *arguments)
+            for row in rows:
+                grouped[indexes[row["request_index"] - 1]].append(row)
+
+    with timed("format"):
+        return [format_results(results) for results in grouped]
+
+
 @app.post("/get-videos/")
 async def get_videos(request: PromptRequest) -> list:
     if not request.prompt:
         raise HTTPException(status_code=400, detail="Prompt cannot be empty")
 
-    async with app.state.db_pool.acquire() as connection:
-        try:
-            vector = await get_vector_data_async(request.prompt)
-            vector_string = f"[{', '.join(map(str, vector))}]"
-
-            select_query = "SELECT * FROM public.get_similar_videos($1, $2, $3)"
-            results = await connection.fetch(select_query, vector_string, request.distance, request.limit)
-
-            return [
-                {
-                    "title": result["title"],
-                    "distance": result["distance"],
-                    "youtube_link": f'https://youtu.be/{result["videoid"]}&t={result["seconds"]}',
-                    "text": result["text"],
-                }
-                for result in results
-            ]
+    try:
+        return await result_cache.get_or_load(result_cache_key(request), lambda: search_videos(request))
 
-        except asyncpg.exceptions.PostgresError as e:
-            logging.error(f"An error occurred while executing the Postgres query: {e}")
-            raise HTTPException(status_code=500, detail="Internal server error") from e
+    except asyncpg.exceptions.PostgresError as e:
+        logging.error(f"An error occurred while executing the Postgres query: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error") from e
 
-        except Exception as e:
-            logging.error(f"An error occurred while fetching data: {e}")
-            raise HTTPException(status_code=500, detail="Internal server error") from e
+    except Exception as e:
+        logging.error(f"An error occurred while fetching data: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error") from e
+
+
+@app.post("/get-videos/batch")
+async def get_videos_batch(requests: List[PromptRequest]) -> List[list]:
+    if not requests:
+        return []
+    if len(requests) > MAX_BATCH_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"A batch can contain at most {MAX_BATCH_PROMPTS} prompts")
+    if any(not request.prompt for request in requests):
+        raise HTTPException(status_code=400, detail="Prompt cannot be empty")
+
+    keys = [result_cache_key(request) for request in requests]
+    responses = [result_cache.lookup(key) for key in keys]
+    pending = [index for index, response in enumerate(responses) if response is None]
+
+    try:
+        if pending:
+            results = await search_videos_batch([requests[index] for index in pending])
+            for index, result in zip(pending, results, strict=True):
+                responses[index] = result
+                result_cache.put(keys[index], result)
+        return responses
+
+    except asyncpg.exceptions.PostgresError as e:
+        logging.error(f"An error occurred while executing the Postgres query: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error") from e
+
+    except Exception as e:
+        logging.error(f"An error occurred while fetching data: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error") from e
+
+
+@app.get("/stats/")
+async def get_stats() -> dict:
+    return {
+        "catalog_version": app.state.catalog_version,
+        "serving_mode": SERVING_MODE,
+        "rerank_candidates": RERANK_CANDIDATES,
+        "iterative_scan": app.state.iterative_scan,
+        "memory_index_size": len(app.state.memory_index) if app.state.memory_index is not None else None,
+        "embedding_cache": embedding_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "db_pool": pool_stats.stats(app.state.db_pool),
+        "httpx": {
+            "max_connections": HTTPX_MAX_CONNECTIONS,
+            "max_keepalive_connections": HTTPX_MAX_KEEPALIVE_CONNECTIONS,
+            "timeout_seconds": HTTPX_TIMEOUT_SECONDS,
+        },
+    }
+
+
+@app.get("/metrics")
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,151 @@
+""" Recall and latency of full-precision HNSW search against binary-quantized search with exact re-ranking.
+
+    python recall_report.py --queries 200 --limit 10 --ef-search 40 100 200 --candidates 40 100 200 400
+
+Query vectors are stored embeddings with a little noise added. Ground truth is an exact sequential scan, so
+recall@limit measures what the indexes lose. Also prints the storage type and table and index sizes.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import asyncpg
+import numpy as np
+from dotenv import load_dotenv
+
+from pgvector_codec import register_vector_codec
+from vector_index import COLUMN_TYPE_QUERY
+
+load_dotenv()
+
+POSTGRES_CONNECTION_STRING = os.getenv("POSTGRES_CONNECTION_STRING")
+
+SAMPLE_QUERY = "SELECT embedding::public.vector FROM public.video_embeddings ORDER BY random() LIMIT $1"
+EXACT_QUERY = """
+    SELECT ve.videoid, ve.seconds
+    FROM public.video_embeddings ve
+    ORDER BY ve.embedding::public.vector <=> $1::public.vector
+    LIMIT $2
+"""
+HNSW_QUERY = "SELECT videoid, seconds FROM public.get_similar_videos($1::public.vector, 2.0, $2)"
+RERANKED_QUERY = "SELECT videoid, seconds FROM public.get_similar_videos_reranked($1::public.vector, 2.0, $2, $3)"
+# By name only: 007_filtered_search.sql adds parameters to the signature from 005
+RERANKED_EXISTS_QUERY = "SELECT to_regproc('public.get_similar_videos_reranked') IS NOT NULL"
+SIZES_QUERY = """
+    SELECT 'table' AS name, pg_table_size('public.video_embeddings') AS bytes
+    UNION ALL
+    SELECT indexrelname, pg_relation_size(indexrelid)
+    FROM pg_stat_user_indexes
+    WHERE relname = 'video_embeddings'
+"""
+
+
+def query_vectors(samples: list, noise: float, seed: int) -> list:
+    """Stored embeddings nudged off their own row, so the nearest neighbour is not always an exact match"""
+    rng = np.random.default_rng(seed)
+    vectors = np.array(samples, dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors += rng.standard_normal(vectors.shape).astype(np.float32) * noise / np.sqrt(vectors.shape[1])
+    return list(vectors)
+
+
+async def ground_truth(connection: asyncpg.Connection, vectors: list, limit: int) -> list:
+    async with connection.transaction():
+        # no index may answer the exact query
+        await connection.execute("SET LOCAL enable_indexscan = off")
+        return [
+            {(r["videoid"], r["seconds"]) for r in await connection.fetch(EXACT_QUERY, vector, limit)}
+            for vector in vectors
+        ]
+
+
+async def measure(
+    connection: asyncpg.Connection, label: str, ef_search: int, query: str, arguments: list, truth: list
+) -> dict:
+    """Mean recall and latency percentiles of one configuration over every query vector"""
+    latencies = []
+    recalls = []
+    for (vector, *rest), expected in zip(arguments, truth):
+        async with connection.transaction():
+            await connection.execute("SELECT set_config('hnsw.ef_search', $1, true)", str(ef_search))
+            start = time.perf_counter()
+            rows = await connection.fetch(query, vector, *rest)
+            latencies.append(time.perf_counter() - start)
+        found = {(r["videoid"], r["seconds"]) for r in rows}
+        recalls.append(len(found & expected) / len(expected) if expected else 1.0)
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "config": label,
+        "recall": float(np.mean(recalls)),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+    }
+
+
+async def report(args: argparse.Namespace) -> dict:
+    connection = await asyncpg.connect(POSTGRES_CONNECTION_STRING)
+    await register_vector_codec(connection)
+    try:
+        column_type = await connection.fetchval(COLUMN_TYPE_QUERY)
+        sizes = {r["name"]: r["bytes"] for r in await connection.fetch(SIZES_QUERY)}
+        print(f"Storage: {column_type}")
+        for name, size in sizes.items():
+            print(f"    {name}: {size / 2**20:.1f} MiB")
+
+        samples = [r[0] for r in await connection.fetch(SAMPLE_QUERY, args.queries)]
+        if not samples:
+            print("video_embeddings is empty")
+            return {}
+        vectors = query_vectors(samples, args.noise, args.seed)
+        truth = await ground_truth(connection, vectors, args.limit)
+
+        results = []
+        for ef_search in args.ef_search:
+            arguments = [(vector, args.limit) for vector in vectors]
+            results.append(
+                await measure(connection, f"hnsw ef_search={ef_search}", ef_search, HNSW_QUERY, arguments, truth)
+            )
+
+        if await connection.fetchval(RERANKED_EXISTS_QUERY):
+            for candidates in args.candidates:
+                # as in query_service, ef_search must let the bit index return every candidate
+                arguments = [(vector, args.limit, candidates) for vector in vectors]
+                label = f"bits+rerank candidates={candidates}"
+                results.append(await measure(connection, label, candidates, RERANKED_QUERY, arguments, truth))
+        else:
+            print("get_similar_videos_reranked not found, apply database/migrations/005_binary_quantization.sql")
+
+        print(f"\n{'config':<36} {'recall@' + str(args.limit):>10} {'p50 ms':>8} {'p95 ms':>8}")
+        for result in results:
+            print(f"{result['config']:<36} {result['recall']:>10.3f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f}")
+
+        return {
+            "storage": column_type,
+            "sizes": sizes,
+            "queries": len(vectors),
+            "limit": args.limit,
+            "results": results,
+        }
+    finally:
+        await connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=100, help="Number of query vectors")
+    parser.add_argument("--limit", type=int, default=10, help="Results per query, recall is measured at this depth")
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[40, 100, 200])
+    parser.add_argument("--candidates", type=int, nargs="+", default=[40, 100, 200, 400])
+    parser.add_argument("--noise", type=float, default=0.5, help="Gaussian noise added to query vectors")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(report(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,61 @@
+""" SQLite storage shared by the embedding and summary caches. """
+
+import logging
+import sqlite3
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteCache:
+    """A cache table in an SQLite database, with hit/miss counters for this session.
+
+    Subclasses set TABLE, the CREATE statements in SCHEMA, and LAST_USED, the column eviction orders by.
+    """
+
+    TABLE = ""
+    SCHEMA = ""
+    LAST_USED = ""
+
+    def __init__(self, path: str | Path) -> None:
+        """open (or create) the cache database"""
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(self.SCHEMA)
+        self.db.commit()
+
+    def evict(self, max_entries: int) -> int:
+        """Drop least recently used entries beyond max_entries, returning the number removed"""
+        (count,) = self.db.execute(f"SELECT COUNT(*) FROM {self.TABLE}").fetchone()
+        excess = count - max_entries
+        if excess <= 0:
+            return 0
+        oldest = f"SELECT rowid FROM {self.TABLE} ORDER BY {self.LAST_USED} LIMIT ?"
+        self.db.execute(f"DELETE FROM {self.TABLE} WHERE rowid IN ({oldest})", (excess,))
+        self.db.commit()
+        return excess
+
+    def stats(self) -> dict:
+        """Entry counts per model plus hit/miss counters for this session"""
+        models = dict(self.db.execute(f"SELECT model, COUNT(*) FROM {self.TABLE} GROUP BY model").fetchall())
+        lookups = self.hits + self.misses
+        return {
+            "entries": sum(models.values()),
+            "models": models,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self, max_entries: int | None = None) -> None:
+        """Evict down to max_entries, when given, and close the database"""
+        if max_entries is not None:
+            evicted = self.evict(max_entries)
+            if evicted:
+                logger.info("Evicted %d entries from %s", evicted, self.path)
+        self.db.close()
@@ -1,12 +1,20 @@
 import os
+import asyncio
+import hashlib
+import random
+import time
 from pathlib import Path
-from ollama import Client
+from ollama import AsyncClient
 import json
-from time import sleep
+
+from manifest import Manifest, fingerprint
+from master_file import MasterWriter, count_segments, iter_batches
+from summary_cache import SummaryCache
 
 summary_endpoint = os.environ.get("OLLAMA_SUMMARY_ENDPOINT")
 model = os.environ.get("OLLAMA_SUMMARY_MODEL")
-TRANSCRIPT_MASTER_FILE = "master_transcriptions.json"
+PROGRESS_JOURNAL_FILE = "summary_progress.jsonl"
+SUMMARY_CACHE_FILE = "summary_cache.db"
 
 SYSTEM_MESSAGE = (
     "You're an AI Assistant for video transcripts. "
@@ -16,55 +24,181 @@ SYSTEM_MESSAGE = (
 
 
 class SUMMARIZE_TRANSCRIPTS:
-    def __init__(self: "SUMMARIZE_TRANSCRIPTS", folder: str, timeout: int = 60) -> None:
+    def __init__(
+        self: "SUMMARIZE_TRANSCRIPTS",
+        folder: str,
+        timeout: int = 60,
+        concurrency: int = 4,
+        use_cache: bool = True,
+        incremental: bool = False,
+    ) -> None:
         self.folder = folder
         self.model = model
         self.timeout = timeout
-        self.master_segments = []
+        self.concurrency = concurrency
+        self.max_retry = 10
+        self.retry_base_delay = 2.0
+        self.retry_max_delay = 60.0
+        self.window_size = concurrency * 64
         self.total_segments = 0
-        self.custom_client = Client(host=summary_endpoint, timeout=self.timeout)
-
-    def load_master(self: "SUMMARIZE_TRANSCRIPTS") -> list:
-        """Load segments from the JSON file."""
-        input_file = Path(self.folder) / "output" / TRANSCRIPT_MASTER_FILE
-        with input_file.open("r", encoding="utf-8") as f:
-            segments = json.load(f)
-        self.total_segments = len(segments)
-        return segments
-
-    def save_master(self: "SUMMARIZE_TRANSCRIPTS") -> None:
-        """Save the embeddings to a JSON file."""
-        output_file = Path(self.folder) / "output" / TRANSCRIPT_MASTER_FILE
-        with output_file.open("w", encoding="utf-8") as f:
-            json.dump(self.master_segments, f)
-
-    def get_summary(self: "SUMMARIZE_TRANSCRIPTS", text: str) -> str:
-        max_retry = 10
-
-        for attempt in range(max_retry):
+        self.completed = 0
+        self.resumed = 0
+        self.generated_tokens = 0
+        self.start_time = 0.0
+        self.incremental = incremental
+        self.manifest = None
+        self.video_ids = set()
+        self.journal_file = Path(self.folder) / "output" / PROGRESS_JOURNAL_FILE
+        self.cache = SummaryCache(Path(self.folder) / "output" / SUMMARY_CACHE_FILE) if use_cache else None
+
+    def segment_key(self: "SUMMARIZE_TRANSCRIPTS", segment: dict) -> str:
+        """Identify a segment by video, start time and text so edited segments are not resumed."""
+        text_hash = hashlib.sha256(segment["text"].encode("utf-8")).hexdigest()
+        return f'{segment["videoId"]}|{segment["start"]}|{text_hash}'
+
+    def load_journal(self: "SUMMARIZE_TRANSCRIPTS") -> dict:
+        """Load summaries completed by a previous, interrupted run."""
+        completed = {}
+        if not self.journal_file.exists():
+            return completed
+
+        with self.journal_file.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line may be partial if the previous run was killed mid-write
+                    continue
+                completed[entry["key"]] = entry["summary"]
+        return completed
+
+    async def get_summary(self: "SUMMARIZE_TRANSCRIPTS", client: AsyncClient, text: str) -> tuple[str, int]:
+        """Summarize text, returning the summary and the number of tokens generated."""
+        for attempt in range(self.max_retry):
             try:
-                ollama_response = self.custom_client.chat(
+                ollama_response = await client.chat(
                     model=self.model,
                     messages=[
                         {"role": "system", "content": SYSTEM_MESSAGE},
                         {"role": "user", "content": text},
                     ],
                 )
-                return ollama_response["message"]["content"].strip()
+                return ollama_response["message"]["content"].strip(), ollama_response.get("eval_count", 0)
             except Exception as error:
                 print(f"Attempt {attempt + 1} failed with error: {error}")
-                sleep(10)
-        else:
-            print("All retry attempts failed.")
-            return ""
+                if attempt + 1 < self.max_retry:
+                    delay = min(self.retry_base_delay * 2**attempt, self.retry_max_delay)
+                    await asyncio.sleep(random.uniform(delay / 2, delay))
+
+        print("All retry attempts failed.")
+        return "", 0
+
+    async def summary_worker(
+        self: "SUMMARIZE_TRANSCRIPTS", client: AsyncClient, pending: asyncio.Queue, journal: object
+    ) -> None:
+        """Summarize queued segments and append each result to the progress journal."""
+        while True:
+            segment, done = await pending.get()
+            try:
+                segment["summary"], tokens = await self.get_summary(client, segment["text"])
+
+                # failed summaries are not journaled so the next run retries them
+                if segment["summary"]:
+                    journal.write(json.dumps({"key": self.segment_key(segment), "summary": segment["summary"]}) + "\n")
+                    journal.flush()
+                    if self.cache:
+                        self.cache.put(self.model, SYSTEM_MESSAGE, segment["text"], segment["summary"])
+
+                self.completed += 1
+                self.generated_tokens += tokens
+                elapsed = time.perf_counter() - self.start_time
+                print(
+                    f"Summarized {self.completed + self.resumed} of {self.total_segments} segments "
+                    f"({self.completed / elapsed * 60:.1f} segments/min, {self.generated_tokens / elapsed:.1f} tokens/s)"
+                )
+            finally:
+                done.set_result(None)
+                pending.task_done()
+
+    def summary_fingerprint(self: "SUMMARIZE_TRANSCRIPTS", video_id: str) -> str:
+        """Fingerprint of a video's segments, the summary model and the prompt."""
+        return fingerprint(self.manifest.get("bucket", video_id), self.model, SYSTEM_MESSAGE)
+
+    def resolve_summary(self: "SUMMARIZE_TRANSCRIPTS", segment: dict, completed: dict) -> bool:
+        """Keep the summary of an unchanged video in incremental mode, or fill it from the progress journal or
+        cache, returning False if it must be generated."""
+        video_id = segment["videoId"]
+        if (
+            self.incremental
+            and segment.get("summary")
+            and self.manifest.unchanged("summarize", video_id, self.summary_fingerprint(video_id))
+        ):
+            return True
+
+        summary = completed.get(self.segment_key(segment))
+        if summary is None and self.cache:
+            summary = self.cache.get(self.model, SYSTEM_MESSAGE, segment["text"])
+        if summary is None:
+            return False
+        segment["summary"] = summary
+        return True
+
+    async def summarize_master(self: "SUMMARIZE_TRANSCRIPTS", writer: MasterWriter, completed: dict) -> None:
+        """Stream the master file through a bounded number of concurrent LLM requests, preserving order."""
+        client = AsyncClient(host=summary_endpoint, timeout=self.timeout)
+        pending = asyncio.Queue(maxsize=self.concurrency * 2)
+        loop = asyncio.get_running_loop()
+
+        # Windows are written in the order they were read once all of their segments are summarized
+        windows = asyncio.Queue(maxsize=2)
+
+        async def write_windows() -> None:
+            while (item := await windows.get()) is not None:
+                window, done = item
+                await asyncio.gather(*done)
+                writer.write_many(window)
+
+        self.start_time = time.perf_counter()
+        with self.journal_file.open("a", encoding="utf-8") as journal:
+            workers = [
+                asyncio.create_task(self.summary_worker(client, pending, journal)) for _ in range(self.concurrency)
+            ]
+            window_writer = asyncio.create_task(write_windows())
+            try:
+                for window in iter_batches(self.folder, self.window_size):
+                    done = []
+                    for r in window:
+                        self.video_ids.add(r["videoId"])
+                        if self.resolve_summary(r, completed):
+                            self.resumed += 1
+                            continue
+                        future = loop.create_future()
+                        await pending.put((r, future))
+                        done.append(future)
+                    await windows.put((window, done))
+                await windows.put(None)
+                await window_writer
+            finally:
+                for worker in [*workers, window_writer]:
+                    worker.cancel()
+                await asyncio.gather(*workers, window_writer, return_exceptions=True)
 
     def summarize_text(self: "SUMMARIZE_TRANSCRIPTS") -> None:
-        count = 0
-        self.master_segments = self.load_master()
+        self.total_segments = count_segments(self.folder)
+        completed = self.load_journal()
+        self.manifest = Manifest(self.folder)
+
+        with MasterWriter(self.folder) as writer:
+            asyncio.run(self.summarize_master(writer, completed))
 
-        for count, r in enumerate(self.master_segments, start=1):
-            print(count)
+        for video_id in self.video_ids:
+            self.manifest.mark("summarize", video_id, self.summary_fingerprint(video_id))
+        self.manifest.forget("summarize", self.manifest.video_ids("summarize") - self.video_ids)
+        self.manifest.save()
 
-            r["summary"] = self.get_summary(r["text"])
+        print(f"{self.resumed} summaries reused from the journal, cache or previous run, {self.completed} generated")
+        self.journal_file.unlink(missing_ok=True)
 
-        self.save_master()
+        if self.cache:
+            print(f"Summary cache: {self.cache.stats()}")
+            self.cache.close()
@@ -0,0 +1,77 @@
+""" Persistent summary cache keyed by model, prompt version and a hash of the segment text. """
+
+import argparse
+import hashlib
+import time
+from typing import Iterable
+
+from master_file import iter_segments
+from sqlite_cache import SqliteCache
+
+
+def content_hash(text: str) -> str:
+    """Hash text for use as a cache key."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class SummaryCache(SqliteCache):
+    """SQLite backed store of generated summaries"""
+
+    TABLE = "summaries"
+    LAST_USED = "created"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS summaries (
+            model TEXT NOT NULL,
+            prompt_hash TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            created REAL NOT NULL,
+            PRIMARY KEY (model, prompt_hash, text_hash)
+        );
+    """
+
+    def get(self, model: str, prompt: str, text: str) -> str | None:
+        """Return the cached summary for text, or None"""
+        row = self.db.execute(
+            "SELECT summary FROM summaries WHERE model = ? AND prompt_hash = ? AND text_hash = ?",
+            (model, content_hash(prompt), content_hash(text)),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, model: str, prompt: str, text: str, summary: str) -> None:
+        """Store a summary for text"""
+        self.db.execute(
+            "INSERT OR REPLACE INTO summaries (model, prompt_hash, text_hash, summary, created) VALUES (?, ?, ?, ?, ?)",
+            (model, content_hash(prompt), content_hash(text), summary, time.time()),
+        )
+        self.db.commit()
+
+    def prune(self, texts: Iterable[str]) -> int:
+        """Remove entries whose text is not in texts, returning the number removed"""
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS referenced (text_hash TEXT PRIMARY KEY)")
+        self.db.execute("DELETE FROM referenced")
+        self.db.executemany("INSERT OR IGNORE INTO referenced VALUES (?)", [(content_hash(text),) for text in texts])
+        removed = self.db.execute(
+            "DELETE FROM summaries WHERE text_hash NOT IN (SELECT text_hash FROM referenced)"
+        ).rowcount
+        self.db.commit()
+        return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or prune the summary cache")
+    parser.add_argument("path", help="Path to the summary cache database")
+    parser.add_argument(
+        "--prune", metavar="FOLDER", help="Remove entries for text no longer in this transcript folder's master file"
+    )
+    args = parser.parse_args()
+
+    cache = SummaryCache(args.path)
+    if args.prune:
+        print(f"Pruned {cache.prune(segment['text'] for segment in iter_segments(args.prune))} entries")
+    print(cache.stats())
+    cache.close()
@@ -0,0 +1,173 @@
+""" Segment boundaries of BUCKET_TRANSCRIPTS.parse_transcript against the implementation it replaced, which
+re-encoded the accumulated text at every step and took the overlap from word splits.
+
+The tokenizer is a small byte-level BPE with cl100k's split pattern, so the test runs without downloading cl100k
+and still sees tokens merge across caption boundaries and multibyte characters span several tokens.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+import pytest
+import tiktoken
+
+import bucket_transcripts
+from bucket_transcripts import BUCKET_TRANSCRIPTS, VttSegment
+
+CL100K_PATTERN = (
+    r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}++|\p{N}{1,3}+| ?[^\s\p{L}\p{N}]++[\r\n]*+|\s++$|\s*[\r\n]|"""
+    r"""\s+(?!\S)|\s"""
+)
+MERGES = [b"  ", b"\n ", b" \n", b"th", b" t", b" th", b"he", b" the", b"in", b"ing", b"er", b"an", b"on", b"es",
+          b"or", b" a", b" w", b"\xc3\xa9", b"\xe6\x97", b"..", b". "]  # fmt: skip
+
+WORDS = ["the", "thing", "answer", "on", "water", "reason", "naïve", "café", "日本語", "😀", "ok.", "12345", "it's"]
+
+METADATA = {"speaker": "Ada Lovelace", "title": "On the engine", "description": "Notes &#39;n", "videoId": "v1"}
+
+
+def offline_encoding() -> tiktoken.Encoding:
+    ranks = {bytes([i]): i for i in range(256)}
+    for merge in MERGES:
+        ranks[merge] = len(ranks)
+    return tiktoken.Encoding("offline_bpe", pat_str=CL100K_PATTERN, mergeable_ranks=ranks, special_tokens={})
+
+
+@pytest.fixture(autouse=True)
+def tokenizer(monkeypatch: pytest.MonkeyPatch) -> tiktoken.Encoding:
+    encoding = offline_encoding()
+    monkeypatch.setattr(bucket_transcripts.tiktoken, "encoding_for_model", lambda _model: encoding)
+    return encoding
+
+
+def captions(seed: int, count: int) -> list:
+    """A transcript whose captions end in spaces, newlines and multibyte characters"""
+    rng = random.Random(seed)
+    seconds = rng.randint(1, 5)
+    result = []
+    for _ in range(count):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 12)))
+        text += rng.choice(["", "", " ", "\n", "  ", ".", " 😀"])
+        result.append({"text": text, "start": seconds, "duration": 2.0})
+        seconds += rng.randint(1, 8)
+    return result
+
+
+def previous_segments(bucketer: BUCKET_TRANSCRIPTS, json_vtt: list, metadata: dict) -> list:
+    """parse_json_vtt_transcript before captions were tokenized once"""
+    segments = []
+    encode = bucketer.tokenizer.encode
+
+    def append_text_to_previous_segment(text: str) -> None:
+        if len(segments) > 0:
+            words = text.split(" ")
+            word_count = len(words)
+            if word_count > 0:
+                segments[-1]["text"] += " ".join(words[0 : int(word_count * bucketer.PERCENTAGE_OVERLAP)])
+
+    def add_new_segment(text: str, segment_begin_seconds: int) -> None:
+        metadata["start"] = (datetime.min + timedelta(seconds=segment_begin_seconds)).strftime("%H:%M:%S")
+        metadata["seconds"] = segment_begin_seconds
+        metadata["text"] = text
+        segments.append(metadata.copy())
+
+    text = ""
+    seg_begin_seconds = None
+    seg_finish_seconds = None
+    first_segment = True
+    for key in ["speaker", "title", "description"]:
+        if key in metadata and metadata[key] != "":
+            metadata[key] = bucketer.clean_text(metadata.get(key))
+            text += f"{metadata.get(key)}. "
+    current_token_length = len(encode(text))
+
+    for segment in json_vtt:
+        seg = VttSegment(segment)
+        current_seconds = int(seg.start)
+        current_text = seg.text
+        if seg_begin_seconds is None:
+            seg_begin_seconds = current_seconds
+            seg_finish_seconds = seg_begin_seconds + bucketer.segment_length_minutes * 60
+
+        total_tokens = len(encode(current_text)) + current_token_length
+        if current_seconds < seg_finish_seconds and total_tokens < bucketer.MAX_TOKENS:
+            text += current_text + " "
+            current_token_length = total_tokens
+        else:
+            if not first_segment:
+                append_text_to_previous_segment(text)
+            first_segment = False
+            add_new_segment(text, seg_begin_seconds)
+            text = current_text + " "
+            seg_begin_seconds = None
+            seg_finish_seconds = None
+            current_token_length = len(encode(text))
+
+    if seg_begin_seconds and text != "":
+        if first_segment:
+            add_new_segment(text, seg_begin_seconds)
+            return segments
+        if len(encode(segments[-1]["text"])) + len(encode(text)) < bucketer.MAX_TOKENS:
+            segments[-1]["text"] += text
+        else:
+            append_text_to_previous_segment(text)
+            add_new_segment(text, seg_begin_seconds)
+    return segments
+
+
+def bucket(json_vtt: list, minutes: int, max_tokens: int, overlap: float, previous: bool = False) -> list:
+    bucketer = BUCKET_TRANSCRIPTS("transcripts", minutes)
+    bucketer.MAX_TOKENS = max_tokens
+    bucketer.PERCENTAGE_OVERLAP = overlap
+    if previous:
+        return previous_segments(bucketer, json_vtt, dict(METADATA))
+    bucketer.parse_transcript(json_vtt, dict(METADATA))
+    return bucketer.segments
+
+
+CASES = [
+    # seed, captions, minutes, max tokens: segments cut on time, on tokens, tails merged and tails kept separate
+    (1, 400, 5, 2048),
+    (2, 400, 1, 2048),
+    (3, 300, 5, 256),
+    (4, 120, 2, 300),
+    (5, 61, 1, 4096),
+    (6, 3, 5, 2048),
+    *[(seed, 40 + seed, 1, 200) for seed in range(7, 27)],
+]
+
+
+@pytest.mark.parametrize(("seed", "count", "minutes", "max_tokens"), CASES)
+def test_segments_match_previous_implementation(seed: int, count: int, minutes: int, max_tokens: int) -> None:
+    json_vtt = captions(seed, count)
+    # without overlap the two implementations must produce the same segments, text included
+    assert bucket(json_vtt, minutes, max_tokens, 0) == bucket(json_vtt, minutes, max_tokens, 0, previous=True)
+
+
+@pytest.mark.parametrize(("seed", "count", "minutes", "max_tokens"), CASES)
+def test_boundaries_match_previous_implementation_with_overlap(
+    seed: int, count: int, minutes: int, max_tokens: int
+) -> None:
+    json_vtt = captions(seed, count)
+    own_text = [segment["text"] for segment in bucket(json_vtt, minutes, max_tokens, 0)]
+    segments = bucket(json_vtt, minutes, max_tokens, BUCKET_TRANSCRIPTS.PERCENTAGE_OVERLAP)
+    previous = bucket(json_vtt, minutes, max_tokens, BUCKET_TRANSCRIPTS.PERCENTAGE_OVERLAP, previous=True)
+
+    assert [s["seconds"] for s in segments] == [s["seconds"] for s in previous]
+    assert len(segments) == len(own_text)
+    for segment, text in zip(segments, own_text):
+        assert segment["text"].startswith(text)
+
+
+@pytest.mark.parametrize("overlap", [0.03, 0.05, 0.07, 0.11, 0.13])
+def test_overlap_keeps_whole_characters(overlap: float) -> None:
+    json_vtt = [{"text": "日本語 😀 café " * 6, "start": start, "duration": 2.0} for start in range(1, 400, 4)]
+    segments = bucket(json_vtt, 1, 2048, overlap)
+    own_text = [segment["text"] for segment in bucket(json_vtt, 1, 2048, 0)]
+
+    assert len(segments) > 2
+    for segment, text, following in zip(segments, own_text, own_text[1:]):
+        assert "\ufffd" not in segment["text"]
+        appended = segment["text"][len(text) :]
+        assert appended
+        assert following.startswith(appended)
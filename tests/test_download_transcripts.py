@@ -0,0 +1,141 @@
+""" DOWNLOAD_TRANSCRIPT against loadtest/stub_transcript_server.py, served in process through httpx's ASGI transport:
+AIMD backoff on 429s and 503s, and resuming from the status journal.
+"""
+
+import json
+import os
+from pathlib import Path
+
+import httpx
+import pytest
+
+os.environ.setdefault("GOOGLE_DEVELOPER_API_KEY", "test-key")
+os.environ.setdefault("YOUTUBE_PLAYLIST_ID", "test-playlist")
+
+import download_transcripts
+from download_transcripts import (
+    DOWNLOAD_TRANSCRIPT,
+    DOWNLOADED,
+    FAILED_RETRYABLE,
+    NO_TRANSCRIPT,
+    STATUS_FILE,
+    AdaptiveLimiter,
+)
+from loadtest import stub_transcript_server as stub
+
+
+class RecordingLimiter(AdaptiveLimiter):
+    """AdaptiveLimiter that remembers how far throttling brought the limit down"""
+
+    lowest = None
+
+    def throttled(self) -> None:
+        super().throttled()
+        RecordingLimiter.lowest = min(RecordingLimiter.lowest or self.limit, self.limit)
+
+
+@pytest.fixture(autouse=True)
+def stub_endpoints(monkeypatch: pytest.MonkeyPatch) -> None:
+    stub.reset()
+    RecordingLimiter.lowest = None
+    monkeypatch.setattr(download_transcripts, "YOUTUBE_API_BASE_URL", "http://stub/youtube/v3")
+    monkeypatch.setattr(download_transcripts, "TRANSCRIPT_API_BASE_URL", "http://stub/transcripts")
+    monkeypatch.setattr(download_transcripts, "RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setattr(download_transcripts, "AdaptiveLimiter", RecordingLimiter)
+
+
+def download(folder: Path, max_concurrency: int = 16, max_retries: int = 5) -> DOWNLOAD_TRANSCRIPT:
+    downloader = DOWNLOAD_TRANSCRIPT(
+        str(folder),
+        max_concurrency=max_concurrency,
+        max_retries=max_retries,
+        transport=httpx.ASGITransport(app=stub.app),
+    )
+    downloader.start_download()
+    return downloader
+
+
+def journal(folder: Path) -> list:
+    with (folder / STATUS_FILE).open(encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_limiter_aimd() -> None:
+    limiter = AdaptiveLimiter(initial=8, minimum=1, maximum=10)
+    for _ in range(8):
+        limiter.success()
+    assert limiter.limit == pytest.approx(9, abs=0.1)
+
+    limiter.throttled()
+    assert limiter.limit == pytest.approx(4.5, abs=0.1)
+    # a burst of throttled responses within a second halves the limit once
+    limiter.throttled()
+    assert limiter.limit == pytest.approx(4.5, abs=0.1)
+
+    limiter.last_decrease -= 1.0
+    for _ in range(5):
+        limiter.throttled()
+        limiter.last_decrease -= 1.0
+    assert limiter.limit == 1
+
+    for _ in range(1000):
+        limiter.success()
+    assert limiter.limit == 10
+
+
+def test_backs_off_on_throttling_and_server_errors(tmp_path: Path) -> None:
+    stub.reset(videos=150, latency_ms=5, max_in_flight=4, error_rate=0.1)
+    downloader = download(tmp_path, max_concurrency=16, max_retries=20)
+
+    assert stub.stats.throttled > 0
+    assert stub.stats.errors > 0
+    assert RecordingLimiter.lowest is not None
+    assert RecordingLimiter.lowest <= 4
+
+    without_transcript = sum(not stub.has_transcript(index) for index in range(150))
+    assert downloader.counts == {
+        DOWNLOADED: 150 - without_transcript,
+        NO_TRANSCRIPT: without_transcript,
+        FAILED_RETRYABLE: 0,
+    }
+    for index in range(150):
+        video_id = stub.video_id(index)
+        assert (tmp_path / f"{video_id}.json.vtt").exists() == stub.has_transcript(index)
+
+
+def test_backs_off_on_server_errors_alone(tmp_path: Path) -> None:
+    stub.reset(videos=60, error_rate=0.3)
+    downloader = download(tmp_path, max_concurrency=16, max_retries=20)
+
+    assert stub.stats.throttled == 0
+    assert stub.stats.errors > 0
+    # 503s halve the concurrency too, not only 429s
+    assert RecordingLimiter.lowest is not None
+    assert RecordingLimiter.lowest < download_transcripts.INITIAL_CONCURRENCY
+    assert downloader.counts[FAILED_RETRYABLE] == 0
+
+
+def test_resumes_from_status_journal(tmp_path: Path) -> None:
+    failing = frozenset({stub.video_id(3), stub.video_id(42)})
+    stub.reset(videos=60, failing=failing)
+    first = download(tmp_path, max_retries=2)
+
+    statuses = {entry["videoId"]: entry["status"] for entry in journal(tmp_path)}
+    assert {video_id for video_id, status in statuses.items() if status == FAILED_RETRYABLE} == failing
+    assert first.counts[NO_TRANSCRIPT] == 6
+    assert first.counts[DOWNLOADED] == 60 - 6 - len(failing)
+    assert all(stub.stats.requests[video_id] == 2 for video_id in failing)
+
+    # a run killed mid-write leaves a partial last line
+    with (tmp_path / STATUS_FILE).open("a", encoding="utf-8") as f:
+        f.write('{"videoId": "video000')
+
+    stub.reset(videos=60)
+    second = download(tmp_path)
+
+    # only the videos that failed are requested again; downloaded and no-transcript videos are skipped
+    assert set(stub.stats.requests) == failing
+    assert second.counts == {DOWNLOADED: len(failing), NO_TRANSCRIPT: 0, FAILED_RETRYABLE: 0}
+    assert second.skipped == 60 - len(failing)
+    for video_id in failing:
+        assert (tmp_path / f"{video_id}.json.vtt").exists()
@@ -0,0 +1,86 @@
+""" AsyncTTLCache.get_or_load: concurrent misses share one load, a failed load reaches every waiter, and a waiter
+takes over the load when the caller running it is cancelled.
+"""
+
+import asyncio
+
+import pytest
+
+from query_service import AsyncTTLCache
+
+
+def counters(cache: AsyncTTLCache) -> tuple:
+    return cache.hits, cache.misses, cache.coalesced
+
+
+def test_concurrent_misses_share_one_load() -> None:
+    cache = AsyncTTLCache(max_size=10, ttl_seconds=60)
+    calls = 0
+
+    async def loader() -> str:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def run() -> list:
+        results = await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(5)))
+        results.append(await cache.get_or_load("key", loader))
+        return results
+
+    assert asyncio.run(run()) == ["value"] * 6
+    assert calls == 1
+    assert counters(cache) == (1, 1, 4)
+    assert not cache.in_flight
+
+
+def test_failed_load_raises_in_every_waiter_and_is_not_cached() -> None:
+    cache = AsyncTTLCache(max_size=10, ttl_seconds=60)
+    calls = 0
+
+    async def failing() -> str:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise ValueError("embedding service down")
+
+    async def working() -> str:
+        return "value"
+
+    async def run() -> tuple:
+        results = await asyncio.gather(*(cache.get_or_load("key", failing) for _ in range(3)), return_exceptions=True)
+        return results, await cache.get_or_load("key", working)
+
+    results, retried = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert calls == 1
+    assert retried == "value"
+    assert counters(cache) == (0, 2, 2)
+    assert not cache.in_flight
+
+
+def test_waiter_takes_over_a_cancelled_load() -> None:
+    cache = AsyncTTLCache(max_size=10, ttl_seconds=60)
+    started = []
+
+    async def loader() -> str:
+        started.append(asyncio.current_task())
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def run() -> list:
+        first = asyncio.create_task(cache.get_or_load("key", loader))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(cache.get_or_load("key", loader)) for _ in range(3)]
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await asyncio.gather(*waiters)
+
+    assert asyncio.run(run()) == ["value"] * 3
+    assert len(started) == 2
+    # the cancelled caller and the waiter that took over are the two misses; the other two waiters coalesced
+    assert counters(cache) == (0, 2, 2)
+    assert cache.get("key") == "value"
+    assert not cache.in_flight
@@ -0,0 +1,147 @@
+""" Consolidated store of downloaded video metadata and zlib-compressed transcripts in one SQLite database. """
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+
+TRANSCRIPT_STORE_FILE = "transcripts.db"
+
+
+def store_path(folder: str) -> Path:
+    """Path of the transcript store for a transcript folder"""
+    return Path(folder) / TRANSCRIPT_STORE_FILE
+
+
+def compress(value: object) -> bytes:
+    """Compact JSON, zlib compressed"""
+    return zlib.compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def decompress(data: bytes) -> object:
+    """Inverse of compress"""
+    return json.loads(zlib.decompress(data))
+
+
+class TranscriptStore:
+    """SQLite table of one row per video: its metadata and, once downloaded, its compressed transcript"""
+
+    def __init__(self, path: str | Path) -> None:
+        """open (or create) the store"""
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        # the pipeline reads the store from a worker thread; access is never concurrent
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS videos (
+                video_id TEXT PRIMARY KEY,
+                metadata TEXT,
+                transcript BLOB,
+                updated REAL NOT NULL
+            )
+            """
+        )
+        self.db.commit()
+
+    def put_metadata(self, video_id: str, metadata: dict) -> None:
+        """Store a video's metadata"""
+        self.db.execute(
+            """
+            INSERT INTO videos (video_id, metadata, updated) VALUES (?, ?, ?)
+            ON CONFLICT (video_id) DO UPDATE SET metadata = excluded.metadata, updated = excluded.updated
+            """,
+            (video_id, json.dumps(metadata, ensure_ascii=False), time.time()),
+        )
+        self.db.commit()
+
+    def put_transcript(self, video_id: str, transcript: list) -> None:
+        """Store a video's transcript"""
+        self.db.execute(
+            """
+            INSERT INTO videos (video_id, transcript, updated) VALUES (?, ?, ?)
+            ON CONFLICT (video_id) DO UPDATE SET transcript = excluded.transcript, updated = excluded.updated
+            """,
+            (video_id, compress(transcript), time.time()),
+        )
+        self.db.commit()
+
+    def has_transcript(self, video_id: str) -> bool:
+        """True if the video's transcript has been stored"""
+        row = self.db.execute("SELECT transcript IS NOT NULL FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+        return bool(row and row[0])
+
+    def video_ids(self) -> list:
+        """Ids of videos with metadata, in ascending order"""
+        return [row[0] for row in self.db.execute("SELECT video_id FROM videos WHERE metadata IS NOT NULL ORDER BY 1")]
+
+    def get(self, video_id: str) -> tuple[dict | None, list | None]:
+        """A video's metadata and transcript, either of which may be None"""
+        row = self.db.execute("SELECT metadata, transcript FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+        if row is None:
+            return None, None
+        metadata, transcript = row
+        return (
+            json.loads(metadata) if metadata is not None else None,
+            decompress(transcript) if transcript is not None else None,
+        )
+
+    def source_hash(self, video_id: str) -> str:
+        """Hash of the stored metadata and compressed transcript, for change detection"""
+        row = self.db.execute("SELECT metadata, transcript FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+        metadata, transcript = row or (None, None)
+        digest = hashlib.sha256()
+        digest.update((metadata or "").encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(transcript or b"")
+        return digest.hexdigest()
+
+    def import_folder(self, folder: str) -> int:
+        """Import <id>.json metadata and <id>.json.vtt transcript files, returning the number of videos"""
+        rows = []
+        for file in sorted(glob.glob(os.path.join(folder, "*.json"))):
+            video_id = Path(file).stem
+            with open(file, encoding="utf-8") as f:
+                metadata = f.read()
+            vtt = Path(folder) / (video_id + ".json.vtt")
+            transcript = None
+            if vtt.exists():
+                with vtt.open(encoding="utf-8") as f:
+                    transcript = compress(json.load(f))
+            # round trip the metadata so it is stored exactly as put_metadata would
+            rows.append((video_id, json.dumps(json.loads(metadata), ensure_ascii=False), transcript, time.time()))
+
+        self.db.executemany("INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?)", rows)
+        self.db.commit()
+        return len(rows)
+
+    def stats(self) -> dict:
+        """Video and transcript counts and the total compressed transcript size"""
+        videos, transcripts, size = self.db.execute(
+            "SELECT COUNT(*), COUNT(transcript), COALESCE(SUM(LENGTH(transcript)), 0) FROM videos"
+        ).fetchone()
+        return {"videos": videos, "transcripts": transcripts, "compressed_bytes": size}
+
+    def close(self) -> None:
+        """close the database"""
+        self.db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the transcript store or import a transcript folder into it")
+    parser.add_argument("folder", help="Transcript folder; the store is <folder>/" + TRANSCRIPT_STORE_FILE)
+    parser.add_argument("--import", dest="import_files", action="store_true", help="Import the folder's .json files")
+    args = parser.parse_args()
+
+    store = TranscriptStore(store_path(args.folder))
+    if args.import_files:
+        print(f"Imported {store.import_folder(args.folder)} videos")
+    print(store.stats())
+    store.close()
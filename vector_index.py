@@ -0,0 +1,113 @@
+""" Build, inspect and drop the approximate nearest neighbour index on video_embeddings.embedding. """
+
+import argparse
+import asyncio
+import math
+import os
+
+import asyncpg
+from dotenv import load_dotenv
+
+load_dotenv()
+
+POSTGRES_CONNECTION_STRING = os.getenv("POSTGRES_CONNECTION_STRING")
+
+TABLE = "public.video_embeddings"
+INDEX_NAMES = {
+    "hnsw": "video_embeddings_embedding_hnsw_idx",
+    "ivfflat": "video_embeddings_embedding_ivfflat_idx",
+}
+
+STATUS_QUERY = """
+    SELECT
+        i.indexrelname AS name,
+        am.amname AS method,
+        pg_size_pretty(pg_relation_size(i.indexrelid)) AS size,
+        i.idx_scan AS scans,
+        pg_get_indexdef(i.indexrelid) AS definition
+    FROM pg_stat_user_indexes i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    JOIN pg_am am ON am.oid = c.relam
+    WHERE i.relname = 'video_embeddings' AND am.amname IN ('hnsw', 'ivfflat')
+"""
+
+# vector, or halfvec after database/migrations/004_halfvec_storage.sql
+COLUMN_TYPE_QUERY = """
+    SELECT t.typname
+    FROM pg_attribute a
+    JOIN pg_type t ON t.oid = a.atttypid
+    WHERE a.attrelid = 'public.video_embeddings'::regclass AND a.attname = 'embedding'
+"""
+
+
+def default_lists(rows: int) -> int:
+    """pgvector's guidance for IVFFlat: rows / 1000 up to 1M rows, sqrt(rows) beyond"""
+    if rows <= 1_000_000:
+        return max(rows // 1000, 1)
+    return int(math.sqrt(rows))
+
+
+async def create_index(connection: asyncpg.Connection, args: argparse.Namespace) -> None:
+    """Build the index concurrently so searches keep working while it is built"""
+    await connection.execute(f"SET maintenance_work_mem = '{args.maintenance_work_mem}'")
+
+    if args.method == "hnsw":
+        options = f"m = {args.m}, ef_construction = {args.ef_construction}"
+    else:
+        lists = args.lists or default_lists(await connection.fetchval(f"SELECT COUNT(*) FROM {TABLE}"))
+        options = f"lists = {lists}"
+
+    column_type = await connection.fetchval(COLUMN_TYPE_QUERY)
+    name = INDEX_NAMES[args.method]
+    print(f"Building {name} on {column_type} with ({options})")
+    await connection.execute(f"DROP INDEX CONCURRENTLY IF EXISTS public.{name}")
+    await connection.execute(
+        f"CREATE INDEX CONCURRENTLY {name} ON {TABLE} "
+        f"USING {args.method} (embedding public.{column_type}_cosine_ops) WITH ({options})"
+    )
+    await connection.execute(f"ANALYZE {TABLE}")
+
+
+async def drop_index(connection: asyncpg.Connection, args: argparse.Namespace) -> None:
+    name = INDEX_NAMES[args.method]
+    await connection.execute(f"DROP INDEX CONCURRENTLY IF EXISTS public.{name}")
+    print(f"Dropped {name}")
+
+
+async def show_status(connection: asyncpg.Connection, args: argparse.Namespace) -> None:  # noqa: ARG001
+    indexes = await connection.fetch(STATUS_QUERY)
+    if not indexes:
+        print("No vector index on video_embeddings, searches will use a sequential scan")
+    for index in indexes:
+        print(f"{index['name']} ({index['method']}, {index['size']}, {index['scans']} scans)")
+        print(f"    {index['definition']}")
+
+
+async def main(args: argparse.Namespace) -> None:
+    connection = await asyncpg.connect(POSTGRES_CONNECTION_STRING)
+    try:
+        await args.handler(connection, args)
+    finally:
+        await connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(required=True)
+
+    create = commands.add_parser("create", help="Build (or rebuild) a cosine distance index")
+    create.add_argument("--method", choices=INDEX_NAMES, default="hnsw")
+    create.add_argument("--m", type=int, default=16, help="HNSW: max connections per layer")
+    create.add_argument("--ef-construction", type=int, default=64, help="HNSW: candidate list size while building")
+    create.add_argument("--lists", type=int, help="IVFFlat: number of lists (default from row count)")
+    create.add_argument("--maintenance-work-mem", default="1GB", help="Memory for the build, keep the graph in RAM")
+    create.set_defaults(handler=create_index)
+
+    drop = commands.add_parser("drop", help="Drop an index")
+    drop.add_argument("--method", choices=INDEX_NAMES, default="hnsw")
+    drop.set_defaults(handler=drop_index)
+
+    status = commands.add_parser("status", help="Show vector indexes, their size and usage")
+    status.set_defaults(handler=show_status)
+
+    asyncio.run(main(parser.parse_args()))